@@ -0,0 +1,106 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.cache import (
+    CATALOG_PRODUCTS_KEY,
+    CATALOG_VERSION_KEY,
+    CATEGORY_KEY,
+    CATEGORY_TREE_KEY,
+    PRODUCT_KEY,
+    get_generations,
+)
+
+
+class CachedListMixin:
+    """
+    Cache response của list() theo tham số truy vấn đã chuẩn hóa và các bộ đếm
+    thế hệ dữ liệu. Chỉ một request được tính lại key nóng sau khi bị vô hiệu hóa,
+    các request khác chờ kết quả (chống stampede).
+    """
+
+    cache_prefix = None
+    cache_timeout = 60 * 10
+    # Các tham số dạng "1,2,3" được sắp xếp để chuẩn hóa key
+    cache_list_params = []
+    cache_lock_timeout = 10
+    cache_lock_wait = 0.05
+    cache_lock_retries = 40
+
+    def get_cache_generation_keys(self, request):
+        return []
+
+    def normalize_query_params(self, request):
+        params = []
+        for key, values in request.query_params.lists():
+            values = sorted(value.strip() for value in values if value.strip())
+            if key in self.cache_list_params:
+                values = sorted(
+                    {part.strip() for value in values for part in value.split(",")}
+                    - {""}
+                )
+            if not values:
+                continue
+            params.append((key, values))
+        return sorted(params)
+
+    def get_list_cache_key(self, request):
+        generation_keys = [CATALOG_VERSION_KEY, *self.get_cache_generation_keys(request)]
+        raw = json.dumps(
+            [
+                self.normalize_query_params(request),
+                sorted(get_generations(generation_keys).items()),
+            ]
+        )
+        digest = hashlib.md5(raw.encode()).hexdigest()
+        return f"response_{self.cache_prefix}_{digest}"
+
+    def list(self, request, *args, **kwargs):
+        cache_key = self.get_list_cache_key(request)
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+
+        lock_key = f"{cache_key}_lock"
+        if not cache.add(lock_key, 1, timeout=self.cache_lock_timeout):
+            # Một request khác đang tính lại, chờ kết quả thay vì truy vấn DB
+            for _ in range(self.cache_lock_retries):
+                time.sleep(self.cache_lock_wait)
+                data = cache.get(cache_key)
+                if data is not None:
+                    return Response(data)
+            return super().list(request, *args, **kwargs)
+
+        try:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(cache_key, response.data, timeout=self.cache_timeout)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+
+class ProductListCacheMixin(CachedListMixin):
+    cache_prefix = "product_list"
+    cache_list_params = ["ids", "category"]
+
+    def get_cache_generation_keys(self, request):
+        params = dict(self.normalize_query_params(request))
+        if "ids" in params:
+            return [PRODUCT_KEY.format(product_id) for product_id in params["ids"]]
+        if "category" in params:
+            return [
+                CATEGORY_KEY.format(category_id) for category_id in params["category"]
+            ]
+        return [CATALOG_PRODUCTS_KEY]
+
+
+class CategoryListCacheMixin(CachedListMixin):
+    cache_prefix = "category_list"
+
+    def get_cache_generation_keys(self, request):
+        return [CATEGORY_TREE_KEY]
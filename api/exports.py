@@ -0,0 +1,182 @@
+import csv
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.timezone import localtime
+from openpyxl import Workbook
+
+from core.models import Category, Order, PromotionItem, Variant
+
+EXPORT_CHUNK_SIZE = 2000
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def format_datetime(value):
+    return localtime(value).strftime("%d/%m/%Y %H:%M") if value else ""
+
+
+class Echo:
+    """Đối tượng giả file cho csv.writer, trả lại dòng vừa ghi thay vì lưu"""
+
+    def write(self, value):
+        return value
+
+
+class BaseExporter:
+    """
+    Xuất dữ liệu theo từng dòng: queryset được đọc theo chunk bằng iterator()
+    và ghi dần ra CSV/XLSX, bộ nhớ không tăng theo số dòng.
+    """
+
+    filename = None
+    sheet_title = None
+    # Field dùng để lọc theo danh sách ids gửi lên
+    id_field = "id"
+    # [(tiêu đề cột, field của values_list)]
+    columns = []
+
+    def __init__(self, ids=None):
+        self.ids = ids
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def format_row(self, row):
+        return row
+
+    def get_headers(self):
+        return [header for header, field in self.columns]
+
+    def iter_rows(self):
+        queryset = self.get_queryset()
+        if self.ids:
+            queryset = queryset.filter(**{f"{self.id_field}__in": self.ids})
+        fields = [field for header, field in self.columns]
+        for row in queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield self.format_row(list(row))
+
+    def csv_response(self):
+        writer = csv.writer(Echo())
+
+        def stream():
+            # BOM để Excel nhận đúng tiếng Việt (UTF-8)
+            yield "\ufeff"
+            yield writer.writerow(self.get_headers())
+            for row in self.iter_rows():
+                yield writer.writerow(row)
+
+        response = StreamingHttpResponse(stream(), content_type="text/csv")
+        response["Content-Disposition"] = f"attachment; filename={self.filename}.csv"
+        return response
+
+    def xlsx_response(self):
+        # Chế độ write_only ghi từng dòng ra file tạm thay vì giữ cả bảng trong RAM
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet(self.sheet_title or self.filename)
+        worksheet.append(self.get_headers())
+        for row in self.iter_rows():
+            worksheet.append(row)
+
+        output = tempfile.TemporaryFile()
+        workbook.save(output)
+        output.seek(0)
+        # FileResponse gửi file theo từng khối và tự đóng file sau khi gửi
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=f"{self.filename}.xlsx",
+            content_type=XLSX_CONTENT_TYPE,
+        )
+
+    def response(self, export_format="xlsx"):
+        if export_format == "csv":
+            return self.csv_response()
+        return self.xlsx_response()
+
+
+class CategoryExporter(BaseExporter):
+    filename = "categories"
+    # Cùng cột với CategoryResource để file xuất có thể nhập lại
+    columns = [("Tên Danh Mục", "name"), ("Kích Hoạt", "is_active")]
+
+    def get_queryset(self):
+        return Category.objects.order_by("id")
+
+    def format_row(self, row):
+        row[1] = int(row[1])
+        return row
+
+
+class ProductExporter(BaseExporter):
+    """Mỗi dòng là một phân loại kèm thông tin sản phẩm"""
+
+    filename = "products"
+    id_field = "product_id"
+    columns = [
+        ("ID Sản Phẩm", "product_id"),
+        ("Sku Sản Phẩm", "product__sku"),
+        ("Tên Sản Phẩm", "product__name"),
+        ("Danh Mục", "product__category__name"),
+        ("Kích Hoạt", "product__is_active"),
+        ("ID Phân Loại", "id"),
+        ("Sku Phân Loại", "sku"),
+        ("Phân Loại", "name"),
+        ("Giá", "price"),
+        ("Kho", "stock"),
+    ]
+
+    def get_queryset(self):
+        return Variant.objects.order_by("product_id", "id")
+
+    def format_row(self, row):
+        row[4] = int(row[4])
+        row[8] = int(row[8] or 0)
+        return row
+
+
+class OrderExporter(BaseExporter):
+    filename = "orders"
+    columns = [
+        ("Mã Đơn Hàng", "invoice"),
+        ("Email", "user__email"),
+        ("Khách Hàng", "user__full_name"),
+        ("Tổng Tiền", "total_price"),
+        ("Phí Ship", "shipping_cost"),
+        ("Trạng Thái", "status"),
+        ("Ngày Tạo", "created_at"),
+    ]
+    status_display = dict(Order.STATUS_CHOICES)
+
+    def get_queryset(self):
+        return Order.objects.order_by("-created_at", "-id")
+
+    def format_row(self, row):
+        row[5] = self.status_display.get(row[5], row[5])
+        row[6] = format_datetime(row[6])
+        return row
+
+
+class PromotionItemExporter(BaseExporter):
+    filename = "promotion_items"
+    id_field = "promotion_id"
+    columns = [
+        ("Chương Trình", "promotion__name"),
+        ("Bắt Đầu", "promotion__start_date"),
+        ("Kết Thúc", "promotion__end_date"),
+        ("Sản Phẩm", "product__name"),
+        ("Phân Loại", "variant__name"),
+        ("Loại Giảm Giá", "discount_type"),
+        ("Giá Trị Giảm", "discount_value"),
+        ("Giới Hạn Mua", "user_purchase_limit"),
+    ]
+    discount_types = dict(PromotionItem.DISCOUNT_TYPE_CHOICES)
+
+    def get_queryset(self):
+        return PromotionItem.objects.order_by("promotion_id", "id")
+
+    def format_row(self, row):
+        row[1] = format_datetime(row[1])
+        row[2] = format_datetime(row[2])
+        row[5] = self.discount_types.get(row[5], row[5])
+        row[6] = float(row[6] or 0)
+        return row
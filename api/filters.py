@@ -4,6 +4,8 @@ from django_filters import rest_framework as filters
 from core.models import Order, Product, Promotion, Variant, AttributeValue
 from django.utils import timezone
 from datetime import timezone as py_timezone
+from rest_framework.filters import BaseFilterBackend
+from core.search import search_products
 
 class BaseInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
     """Cho phép lọc nhiều giá trị dưới dạng chuỗi
@@ -198,3 +200,25 @@ class PromotionFilter(django_filters.FilterSet):
         return queryset
 
 
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    Tìm kiếm sản phẩm không phân biệt dấu qua ProductSearchDocument (tsvector + trigram).
+    Nếu không có tham số ordering, kết quả được sắp xếp theo độ liên quan.
+    Đặt sau OrderingFilter trong filter_backends.
+    """
+
+    search_param = "search"
+    ordering_param = "ordering"
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, "").strip()
+        if not query:
+            return queryset
+        queryset = search_products(queryset, query)
+        if "search_rank" in queryset.query.annotations and not request.query_params.get(
+            self.ordering_param
+        ):
+            queryset = queryset.order_by("-search_rank", "-id")
+        return queryset
@@ -1,122 +1,195 @@
+import hashlib
+import json
+from base64 import b64decode, b64encode
+from math import ceil
+from urllib import parse
+
+from django.core.cache import cache
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_CACHE_KEY = "pagination_count_{}"
+COUNT_CACHE_TIMEOUT = 60 * 5
+# Dưới ngưỡng này thì đếm chính xác (COUNT(*) trên tập nhỏ không tốn kém)
+ESTIMATE_THRESHOLD = 10000
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Phân trang theo cursor (keyset): trang sau được lọc theo vị trí của bản ghi cuối
+    trang trước thay cho OFFSET, và không chạy COUNT(*) ở mỗi trang.
+    total_pages lấy từ số lượng đã cache hoặc ước tính của planner PostgreSQL,
+    gửi `count=exact` để đếm chính xác.
+    Client cũ gửi `page=N` (không có cursor) vẫn được phân trang theo OFFSET như
+    trước, link next/previous khi đó cũng dùng `page`.
+    """
 
-class UserPagination(PageNumberPagination):
     page_size = 10
     max_page_size = 100
-    page_size_query_param = 'page_size'
-    
-    def get_paginated_response(self, data):
-        # Tính toán dải số trang
-        current_page = self.page.number
-        total_pages = self.page.paginator.num_pages
-        pagination = {
-            'current_page': current_page,
-            'total_pages': total_pages,
-        }
-        return Response({
-            'pagination': pagination,
-            'users': data
-        })
-    
-class CategoryPagination(PageNumberPagination):
-    page_size = 10
     page_size_query_param = "page_size"
+    ordering = ("-created_at", "-id")
+    count_query_param = "count"
+    page_query_param = "page"
+    # Key chứa danh sách dữ liệu trong response
+    results_key = "data"
 
-    def get_paginated_response(self, data):
-        # Tính toán dải số trang
-        current_page = self.page.number
-        total_pages = self.page.paginator.num_pages
-        pagination = {
-            "current_page": current_page,
-            "total_pages": total_pages,
+    def paginate_queryset(self, queryset, request, view=None):
+        self.offset_page = None
+        if request.query_params.get(
+            self.page_query_param
+        ) and not request.query_params.get(self.cursor_query_param):
+            return self.paginate_queryset_by_page(queryset, request, view)
+        self.current_page = self.get_page_number(request)
+        self.count, self.count_exact = self.get_count(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_queryset_by_page(self, queryset, request, view=None):
+        """Phân trang theo `page=N` (OFFSET) cho client dùng số trang"""
+        try:
+            self.offset_page = int(request.query_params[self.page_query_param])
+        except ValueError:
+            self.offset_page = 0
+        if self.offset_page < 1:
+            raise NotFound(_("Trang không hợp lệ."))
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.current_page = self.offset_page
+        self.count, self.count_exact = self.get_count(queryset, request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        offset = (self.offset_page - 1) * self.page_size
+        # Lấy dư một bản ghi để biết còn trang sau không
+        results = list(
+            queryset.order_by(*self.ordering)[offset : offset + self.page_size + 1]
+        )
+        self.has_next = len(results) > self.page_size
+        self.has_previous = self.offset_page > 1
+        return results[: self.page_size]
+
+    def get_next_link(self):
+        if self.offset_page is None:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.base_url, self.page_query_param, self.offset_page + 1
+        )
+
+    def get_previous_link(self):
+        if self.offset_page is None:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        return replace_query_param(
+            self.base_url, self.page_query_param, self.offset_page - 1
+        )
+
+    def get_ordering(self, request, queryset, view):
+        # Dùng thứ tự mà các filter đã áp dụng (OrderingFilter, xếp hạng tìm kiếm)
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        if ordering and all(
+            isinstance(field, str) and field != "?" for field in ordering
+        ):
+            return tuple(ordering)
+        return self.ordering
+
+    def get_page_number(self, request):
+        """Số trang hiện tại được mang theo trong cursor (chỉ dùng để hiển thị)"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return 1
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode("ascii")).decode("ascii"))
+            return max(1, int(tokens.get("n", ["1"])[0]))
+        except (TypeError, ValueError):
+            return 1
+
+    def encode_cursor(self, cursor):
+        # Như CursorPagination.encode_cursor, thêm số trang (n) vào cursor
+        tokens = {
+            "n": self.current_page - 1 if cursor.reverse else self.current_page + 1
         }
-        return Response({"pagination": pagination, "data": data})
+        if cursor.offset != 0:
+            tokens["o"] = str(cursor.offset)
+        if cursor.reverse:
+            tokens["r"] = "1"
+        if cursor.position is not None:
+            tokens["p"] = cursor.position
+        querystring = parse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode("ascii")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_count(self, queryset, request):
+        """Trả về (số bản ghi, có chính xác hay không)"""
+        exact = request.query_params.get(self.count_query_param) == "exact"
+        queryset = queryset.order_by()
+        sql, params = queryset.query.sql_with_params()
+        key = COUNT_CACHE_KEY.format(
+            hashlib.md5(repr((sql, params)).encode()).hexdigest()
+        )
+        cached = cache.get(key)
+        if cached is not None and (cached[1] or not exact):
+            return cached
+
+        count, count_exact = None, False
+        if not exact:
+            count = self.estimate_count(queryset)
+        if count is None or count < ESTIMATE_THRESHOLD:
+            count, count_exact = queryset.count(), True
+        cache.set(key, (count, count_exact), timeout=COUNT_CACHE_TIMEOUT)
+        return count, count_exact
+
+    def estimate_count(self, queryset):
+        """Số dòng ước tính theo EXPLAIN, None nếu không đọc được"""
+        try:
+            plan = json.loads(queryset.explain(format="json"))
+            return int(plan[0]["Plan"]["Plan Rows"])
+        except (TypeError, ValueError, KeyError, IndexError):
+            return None
 
-class PromotionPagination(PageNumberPagination):
-    page_size = 6
-    page_size_query_param = 'page_size'
-    
     def get_paginated_response(self, data):
-        # Tính toán dải số trang
-        current_page = self.page.number
-        total_pages = self.page.paginator.num_pages
         pagination = {
-            'current_page': current_page,
-            'total_pages': total_pages,
+            "current_page": self.current_page,
+            "total_pages": max(1, ceil(self.count / self.page_size)),
+            "count": self.count,
+            "count_exact": self.count_exact,
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
         }
-        return Response({
-            'pagination': pagination,
-            'promotions': data
-        })
-    
-class ProductPagination(PageNumberPagination):
-    page_size = 10
+        return Response({"pagination": pagination, self.results_key: data})
+
+
+class UserPagination(KeysetPagination):
+    results_key = "users"
+
+
+class CategoryPagination(KeysetPagination):
+    results_key = "data"
+
+
+class PromotionPagination(KeysetPagination):
+    page_size = 6
+    results_key = "promotions"
+
+
+class ProductPagination(KeysetPagination):
     max_page_size = 1000
-    page_size_query_param = 'page_size'
-    
-    def get_paginated_response(self, data):
-        # Tính toán dải số trang
-        current_page = self.page.number
-        total_pages = self.page.paginator.num_pages
-        pagination = {
-            'current_page': current_page,
-            'total_pages': total_pages,
-        }
-        return Response({
-            'pagination': pagination,
-            'products': data
-        })
-    
-class VariantPagination(PageNumberPagination):
-    page_size = 10
-    max_page_size = 100
-    page_size_query_param = 'page_size'
-    
-    def get_paginated_response(self, data):
-        # Tính toán dải số trang
-        current_page = self.page.number
-        total_pages = self.page.paginator.num_pages
-        pagination = {
-            'current_page': current_page,
-            'total_pages': total_pages,
-        }
-        return Response({
-            'pagination': pagination,
-            'variants': data
-        })
-    
-class CommentPagination(PageNumberPagination):
+    results_key = "products"
+
+
+class VariantPagination(KeysetPagination):
+    results_key = "variants"
+
+
+class CommentPagination(KeysetPagination):
     page_size = 6
-    page_size_query_param = 'page_size'
-    
-    def get_paginated_response(self, data):
-        # Tính toán dải số trang
-        current_page = self.page.number
-        total_pages = self.page.paginator.num_pages
-        pagination = {
-            'current_page': current_page,
-            'total_pages': total_pages,
-        }
-        return Response({
-            'pagination': pagination,
-            'comments': data
-        })
-    
-class ReviewPagination(PageNumberPagination):
+    results_key = "comments"
+
+
+class ReviewPagination(KeysetPagination):
     page_size = 6
-    page_size_query_param = 'page_size'
-    
-    def get_paginated_response(self, data):
-        # Tính toán dải số trang
-        current_page = self.page.number
-        total_pages = self.page.paginator.num_pages
-        pagination = {
-            'current_page': current_page,
-            'total_pages': total_pages,
-        }
-        return Response({
-            'pagination': pagination,
-            'reviews': data
-        })
-    
\ No newline at end of file
+    results_key = "reviews"
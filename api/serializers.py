@@ -1,4 +1,7 @@
+from collections import Counter
 from decimal import Decimal
+from functools import reduce
+from operator import or_
 from django.db.models import F, Sum, Min, Max
 from django.db import transaction
 from django.utils.translation import gettext_lazy as _
@@ -8,8 +11,17 @@ from rest_framework.validators import UniqueValidator
 from django.utils.formats import number_format
 from core.models import default_no_image
 from itertools import product as itertools_product
-from django.core.files.base import ContentFile
 from core.models import *
+from django.core.cache import cache
+from core.counters import product_search_counter, product_view_counter
+from core.images import image_srcset
+from core.importers import IMPORT_PROGRESS_KEY
+from core.inventory import apply_stock_updates
+from core.listing import refresh_listing_summaries
+from core.orders import transition_orders
+from core.pricing import refresh_variant_prices
+from core.snapshots import change_snapshot_refs, snapshot_order_items
+from core.tasks import run_after_commit
 
 
 class TokenObtainSerializer(serializers.ModelSerializer):
@@ -321,10 +333,14 @@ class CategorySerializer(serializers.ModelSerializer):
 class GallerySerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
     order = serializers.IntegerField(required=False)
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Gallery
-        fields = ["id", "image", "order"]
+        fields = ["id", "image", "order", "srcset"]
+
+    def get_srcset(self, obj):
+        return image_srcset(obj.image.name if obj.image else None)
 
 
 class StockSettingSerializer(serializers.ModelSerializer):
@@ -349,6 +365,36 @@ class StockSettingSerializer(serializers.ModelSerializer):
         ]
 
 
+class ImportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.IntegerField(read_only=True)
+    status_display = serializers.CharField(source="get_status_display", read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = [
+            "id",
+            "kind",
+            "status",
+            "status_display",
+            "progress",
+            "total_rows",
+            "processed_rows",
+            "created_count",
+            "updated_count",
+            "errors",
+            "created_at",
+            "finished_at",
+        ]
+
+    def to_representation(self, instance):
+        if instance.status == "running":
+            # Tiến độ khi đang chạy được lưu trong cache (transaction chưa commit)
+            instance.processed_rows = cache.get(
+                IMPORT_PROGRESS_KEY.format(instance.id), instance.processed_rows
+            )
+        return super().to_representation(instance)
+
+
 class PromotionItemSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
 
@@ -424,6 +470,9 @@ class PromotionSerializer(serializers.ModelSerializer):
         for product in affected_products:
             product.promotions.add(promotion)
 
+        # bulk_create không gửi signal nên cần tính lại bảng giá hiệu lực
+        refresh_variant_prices(item.variant_id for item in promotion_items)
+
         return promotion
 
     @transaction.atomic
@@ -482,6 +531,7 @@ class PromotionSerializer(serializers.ModelSerializer):
         for product in affected_products:
             product.promotions.add(instance)
 
+        # Lưu promotion sẽ kích hoạt signal tính lại bảng giá hiệu lực của các variant
         return super().update(instance, validated_data)
 
 
@@ -604,6 +654,21 @@ class VariantSerializer(serializers.ModelSerializer):
         )
 
 
+class ProductListListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        representation = super().to_representation(data)
+        # Cộng các lượt xem/tìm kiếm đang chờ ghi xuống DB (một lần gọi Redis mỗi bộ đếm)
+        product_ids = [product["id"] for product in representation]
+        for field, counter in (
+            ("view_count", product_view_counter),
+            ("search_count", product_search_counter),
+        ):
+            pending = counter.pending(product_ids)
+            for product in representation:
+                product[field] += pending.get(product["id"], 0)
+        return representation
+
+
 class ProductListSerializer(serializers.ModelSerializer):
     category = serializers.CharField(source="category.name")
     rating_star = serializers.DecimalField(
@@ -645,6 +710,7 @@ class ProductListSerializer(serializers.ModelSerializer):
             "variants",
             "promotions",
         ]
+        list_serializer_class = ProductListListSerializer
 
     def get_cover_image(self, obj):
         # Lấy đối tượng request từ context
@@ -699,9 +765,33 @@ class ProductListSerializer(serializers.ModelSerializer):
         return data
 
 
+def get_variant_attr_value_ids(variant_ids):
+    """Lấy id giá trị thuộc tính của nhiều variant trong một truy vấn"""
+    attr_value_ids = {}
+    rows = (
+        Variant.attribute_values.through.objects.filter(variant_id__in=variant_ids)
+        .order_by("variant_id", "attributevalue_id")
+        .values_list("variant_id", "attributevalue_id")
+    )
+    for variant_id, attr_value_id in rows:
+        attr_value_ids.setdefault(variant_id, []).append(attr_value_id)
+    return attr_value_ids
+
+
+class ProductListPublicListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        products = list(data.all() if hasattr(data, "all") else data)
+        # Lấy trước giá trị thuộc tính của các variant trong trang để tạo url
+        self.child.variant_attr_value_ids = get_variant_attr_value_ids(
+            {product.variant_id for product in products if product.variant_id}
+        )
+        return super().to_representation(products)
+
+
 class ProductListPublicSerializer(serializers.ModelSerializer):
     url = serializers.SerializerMethodField()
     cover_image = serializers.SerializerMethodField()
+    cover_srcset = serializers.SerializerMethodField()
     variant_id = (
         serializers.IntegerField()
     )  # variant có giá thấp nhất (đã tính giám giá)
@@ -726,18 +816,17 @@ class ProductListPublicSerializer(serializers.ModelSerializer):
             "discount_price",
             "discount",
             "is_active",
+            "cover_srcset",
         ]
+        list_serializer_class = ProductListPublicListSerializer
 
     def get_url(self, obj):
         # Ưu tiên url của variant có giá thấp nhất (đã tính giám giá)
-        variant = Variant.objects.filter(pk=obj.variant_id).prefetch_related(
-            "attribute_values"
-        )
-        if variant.exists():
-            url = variant.first().get_absolute_url
-            return url
-        # Không có thì fallback url của product
-        return obj.get_absolute_url
+        attr_value_ids = getattr(self, "variant_attr_value_ids", None)
+        if attr_value_ids is None:
+            attr_value_ids = get_variant_attr_value_ids([obj.variant_id])
+        # Không có variant thì fallback url của product
+        return Variant.build_url(obj.slug, attr_value_ids.get(obj.variant_id, []))
 
     def get_cover_image(self, obj):
         # Lấy đối tượng request từ context
@@ -745,6 +834,9 @@ class ProductListPublicSerializer(serializers.ModelSerializer):
             return settings.MEDIA_URL + obj.cover_image
         return ""
 
+    def get_cover_srcset(self, obj):
+        return image_srcset(getattr(obj, "cover_image", None))
+
 
 class ProductCreateUpdateSerializer(serializers.ModelSerializer):
     sku = serializers.CharField(
@@ -1304,55 +1396,96 @@ class ProductVariantStockPriceUpdateSerializer(serializers.ModelSerializer):
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        variants_data = validated_data["variants"]
-        print(variants_data)
-        errors = []
+        updates, variant_errors = collect_stock_updates(
+            [(instance.id, validated_data["variants"])]
+        )
+        if any(variant_errors[0]):
+            transaction.set_rollback(True)
+            raise serializers.ValidationError(
+                {
+                    "status": "failed",
+                    "errors": {"stock_update": [{"variants": variant_errors[0]}]},
+                }
+            )
+
+        apply_stock_updates(updates)
+        return instance
+
+
+def collect_stock_updates(products_variants):
+    """
+    Kiểm tra variant của nhiều sản phẩm bằng một truy vấn.
+    products_variants: [(product_id, variants_data), ...]
+    Trả về (updates theo variant_id, danh sách variant_errors theo từng sản phẩm).
+    """
+    variant_ids = {
+        variant_data.get("id")
+        for _, variants_data in products_variants
+        for variant_data in variants_data
+    }
+    variant_products = dict(
+        Variant.objects.filter(id__in=variant_ids - {None}).values_list(
+            "id", "product_id"
+        )
+    )
+
+    updates = {}
+    products_errors = []
+    for product_id, variants_data in products_variants:
         variant_errors = []
         for variant_data in variants_data:
             variant_id = variant_data.get("id", None)
-            variant_error = (
-                {}
-            )  # nếu không có lỗi thì dict rỗng giữ chỗ cho đúng index lỗi trong variant_errors
-
-            try:
-                variant = Variant.objects.get(product=instance, id=variant_id)
-            except Variant.DoesNotExist:
+            # nếu không có lỗi thì dict rỗng giữ chỗ cho đúng index lỗi trong variant_errors
+            variant_error = {}
+            if variant_products.get(variant_id) != product_id:
                 variant_error["id"] = _("Phân loại ID %s không tồn tại.") % variant_id
                 variant_errors.append(variant_error)
                 continue
 
-            # Cập nhật giá
-            new_price = variant_data.get("price")
-            if new_price is not None:
-                variant.price = new_price
-
-            # Cập nhật tồn kho
-            add_stock = variant_data.get("add_stock")
-            if add_stock:
-                variant.stock = F("stock") + add_stock
-
-            variant.save(update_fields=("stock", "price"))
+            update = updates.setdefault(
+                variant_id, {"price": None, "add_stock": 0, "stock_setting": {}}
+            )
+            if variant_data.get("price") is not None:
+                update["price"] = variant_data["price"]
+            update["add_stock"] += variant_data.get("add_stock") or 0
+            update["stock_setting"].update(variant_data.get("stock_setting", {}))
+            variant_errors.append(variant_error)
+        products_errors.append(variant_errors)
+    return updates, products_errors
 
-            # Cập nhật StockSetting
-            stock_setting_data = variant_data.get("stock_setting", {})
-            stock_setting, created = StockSetting.objects.get_or_create(variant=variant)
 
-            for field, value in stock_setting_data.items():
-                setattr(stock_setting, field, value)
+class ProductStockUpdateItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    variants = VariantPriceStockSerializer(many=True)
 
-            stock_setting.save()
-            variant_errors.append(variant_error)
 
-        if any(variant_error):
-            errors.append({"variants": variant_errors})
+class ProductBulkStockUpdateSerializer(serializers.Serializer):
+    products = ProductStockUpdateItemSerializer(many=True, allow_empty=False)
 
-        if any(errors):
-            transaction.set_rollback(True)
+    @transaction.atomic
+    def save(self):
+        products_data = self.validated_data["products"]
+        updates, products_errors = collect_stock_updates(
+            [
+                (product_data["id"], product_data["variants"])
+                for product_data in products_data
+            ]
+        )
+        if any(any(variant_errors) for variant_errors in products_errors):
             raise serializers.ValidationError(
-                {"status": "failed", "errors": {"stock_update": errors}}
+                {
+                    "status": "failed",
+                    "errors": {
+                        "stock_update": [
+                            {"variants": variant_errors} if any(variant_errors) else {}
+                            for variant_errors in products_errors
+                        ]
+                    },
+                }
             )
 
-        return instance
+        apply_stock_updates(updates)
+        return updates
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -1360,7 +1493,17 @@ class CommentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Comment
-        fields = ["id", "parent", "user", "product", "content", "timesince", "replies"]
+        fields = [
+            "id",
+            "parent",
+            "user",
+            "product",
+            "content",
+            "depth",
+            "timesince",
+            "replies",
+        ]
+        read_only_fields = ["depth"]
         extra_kwargs = {
             "content": {
                 "allow_blank": False,  # Không cho phép giá trị rỗng
@@ -1369,7 +1512,11 @@ class CommentSerializer(serializers.ModelSerializer):
 
     def get_replies(self, obj):
         """Lấy danh sách phản hồi của bình luận"""
-        return CommentSerializer(obj.replies, many=True).data
+        # Cây trả lời đã được tải sẵn bởi load_comment_trees
+        replies = getattr(obj, "loaded_replies", None)
+        if replies is None:
+            replies = obj.replies.select_related("user")
+        return CommentSerializer(replies, many=True).data
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -1443,6 +1590,7 @@ class CartItemSerializer(serializers.ModelSerializer):
                 if instance.product.cover_image
                 else settings.MEDIA_URL + default_no_image
             ),  # Lấy từ annotate
+            "cover_srcset": image_srcset(instance.product.cover_image),
         }
 
         # Lấy dữ liệu variant đã annotate
@@ -1460,6 +1608,7 @@ class CartItemSerializer(serializers.ModelSerializer):
                     if instance.variant.image
                     else ""
                 ),  # Lấy từ annotate
+                "srcset": image_srcset(instance.variant.image),
                 "url": instance.variant.get_absolute_url,
             }
 
@@ -1631,13 +1780,13 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["id", "status", "total_price"]
 
+    @transaction.atomic
     def create(self, validated_data):
         """Tạo mới đơn hàng, xử lý trừ kho và Payment"""
         items_data = validated_data.pop("items", [])
         shipping_address_data = validated_data.pop("shipping_address", {})
         payment_data = validated_data.pop("payment", None)
         user = validated_data.get("user")
-        errors = {}
         # Tạo hoặc lấy địa chỉ giao hàng
         shipping_address_id = shipping_address_data.pop(
             "id", None
@@ -1649,116 +1798,175 @@ class OrderSerializer(serializers.ModelSerializer):
                     user=user,  # phải là địa chỉ giao hàng của chính User đó
                 )
             except UserShippingAddress.DoesNotExist:
-                errors["shipping_address"] = {
-                    "id": _("Địa chỉ giao hàng không tồn tại")
-                }
+                raise serializers.ValidationError(
+                    {"shipping_address": {"id": _("Địa chỉ giao hàng không tồn tại")}}
+                )
         else:
             shipping_address = UserShippingAddress.objects.create(
                 user=user, **shipping_address_data
             )
 
-        # Tạo đơn hàng
-        order = Order.objects.create(
-            shipping_address=shipping_address, **validated_data
-        )
+        # Khóa toàn bộ variant của đơn hàng trong một truy vấn, theo thứ tự id
+        # để các đơn hàng đồng thời không bị deadlock
+        variant_ids = {item_data.get("variant_id") for item_data in items_data}
+        variants = {
+            variant.id: variant
+            for variant in Variant.objects.select_for_update(of=("self",))
+            .filter(id__in=variant_ids - {None})
+            .select_related("product")
+            .with_effective_price()
+            .order_by("id")
+        }
+        # Ảnh của dòng đơn hàng: (đường dẫn ảnh nguồn, snapshot_id, đường dẫn snapshot)
+        attribute_images = {}
+        for variant_id, *image in (
+            Variant.attribute_values.through.objects.filter(
+                variant_id__in=variants, attributevalue__image__isnull=False
+            )
+            .exclude(attributevalue__image="")
+            .order_by("variant_id", "attributevalue_id")
+            .values_list(
+                "variant_id",
+                "attributevalue__image",
+                "attributevalue__snapshot_id",
+                "attributevalue__snapshot__image",
+            )
+        ):
+            attribute_images.setdefault(variant_id, image)
+        gallery_images = {
+            product_id: image
+            for product_id, *image in Gallery.objects.filter(
+                product_id__in={variant.product_id for variant in variants.values()},
+                order=1,
+            ).values_list("product_id", "image", "snapshot_id", "snapshot__image")
+        }
 
         # Danh sách lỗi
         item_errors = [
             {} for _ in range(len(items_data))
         ]  # Mảng lỗi cùng số lượng items
+        reserved_stock = {}  # variant_id -> số lượng cần trừ kho
         order_items = []
         total_price = 0
 
         for index, item_data in enumerate(items_data):
-            product_id = item_data.get("product_id")
-            variant_id = item_data.get("variant_id")
+            variant = variants.get(item_data.get("variant_id"))
             quantity = item_data.get("quantity", 0)
 
-            variant = (
-                Variant.objects.filter(id=variant_id, product__id=product_id)
-                .select_related("product")
-                .annotate(
-                    discount_price=Case(
-                        When(
-                            promotion_items__isnull=False,
-                            promotion_items__discount_type="percent",
-                            promotion_items__promotion__start_date__lte=now(),
-                            promotion_items__promotion__end_date__gt=now(),
-                            then=F("price")
-                            * (1 - F("promotion_items__discount_value") / 100),
-                        ),
-                        When(
-                            promotion_items__isnull=False,
-                            promotion_items__discount_type="amount",
-                            promotion_items__promotion__start_date__lte=now(),
-                            promotion_items__promotion__end_date__gt=now(),
-                            then=F("price") - F("promotion_items__discount_value"),
-                        ),
-                        default=F("price"),
-                        output_field=models.DecimalField(
-                            max_digits=10, decimal_places=2
-                        ),
-                    )
-                )
-                .first()
-            )
-
             # Kiểm tra lỗi
-            if not variant:
+            if not variant or str(variant.product_id) != str(
+                item_data.get("product_id")
+            ):
                 item_errors[index]["variant"] = _("Phân loại sản phẩm không tồn tại.")
+                continue
 
-            if quantity > variant.stock:
+            reserved = reserved_stock.get(variant.id, 0) + quantity
+            if reserved > variant.stock:
                 item_errors[index]["quantity"] = _("Sản phẩm không đủ hàng trong kho.")
-
-            # Nếu có lỗi thì bỏ qua item này
-            if item_errors[index]:
                 continue
-
-            attribute_image = variant.attribute_values.filter(
-                image__isnull=False
-            ).first()
-
-            if attribute_image and attribute_image.image:
-                source_image = attribute_image.image  # Ảnh từ attribute_values
-            elif variant.product.gallery.filter(order=1).exists():
-                source_image = (
-                    variant.product.gallery.filter(order=1).first().image
-                )  # Ảnh từ gallery
-            else:
-                source_image = None  # Không có ảnh
-
-            if source_image:
-                # Đọc nội dung ảnh gốc
-                with source_image.open("rb") as image_file:
-                    image_content = image_file.read()
-                    filename = image_file.name.split("/")[-1]
-                    # Lưu ảnh mới vào OrderItem
-                    item_data["image"] = ContentFile(image_content, filename)
+            reserved_stock[variant.id] = reserved
+
+            # Ảnh từ attribute_values, không có thì lấy ảnh gallery.
+            # Dòng đơn hàng tham chiếu snapshot bất biến thay vì sao chép file ảnh
+            source_image, snapshot_id, snapshot_image = attribute_images.get(
+                variant.id
+            ) or gallery_images.get(variant.product_id, (None, None, None))
+            if snapshot_id:
+                image = snapshot_image
+            elif source_image:
+                # Chưa có snapshot: tạm dùng ảnh nguồn, snapshot được tạo nền sau khi đặt hàng
+                image = source_image
             else:
-                item_data["image"] = (
-                    default_no_image  # Ảnh mặc định nếu không có ảnh gốc
+                image = default_no_image  # Ảnh mặc định nếu không có ảnh gốc
+
+            discount_price = variant.discount_price or variant.price
+            total_price += quantity * discount_price
+            order_items.append(
+                OrderItem(
+                    product_id=variant.product_id,
+                    variant_id=variant.id,
+                    quantity=quantity,
+                    image=image,
+                    snapshot_id=snapshot_id,
+                    name=variant.product.name,
+                    attributes=variant.name,
+                    price=variant.price,
+                    discount_price=discount_price,
                 )
-            item_data["name"] = variant.product.name
-            item_data["attributes"] = variant.name
-            item_data["price"] = variant.price
-            item_data["discount_price"] = variant.discount_price
-
-            total_price += quantity * (
-                variant.discount_price if variant.discount_price else variant.price
             )
-            order_item = OrderItem(order=order, **item_data)
-            order_items.append(order_item)
 
         # Nếu có lỗi thì trả về response lỗi
         if any(item_errors):
             raise serializers.ValidationError({"items": item_errors})
 
-        # Lưu danh sách sản phẩm vào DB
+        # Trừ kho cho toàn bộ variant bằng một câu UPDATE có điều kiện
+        if reserved_stock:
+            updated_rows = Variant.objects.filter(
+                reduce(
+                    or_,
+                    (
+                        Q(id=variant_id, stock__gte=quantity)
+                        for variant_id, quantity in reserved_stock.items()
+                    ),
+                )
+            ).update(
+                stock=F("stock")
+                - Case(
+                    *(
+                        When(id=variant_id, then=Value(quantity))
+                        for variant_id, quantity in reserved_stock.items()
+                    ),
+                    output_field=models.IntegerField(),
+                )
+            )
+            if updated_rows != len(reserved_stock):
+                # Variant không bị trừ kho (tồn kho không còn đủ), các thay đổi
+                # khác được rollback cùng transaction
+                stocks = dict(
+                    Variant.objects.filter(id__in=reserved_stock).values_list(
+                        "id", "stock"
+                    )
+                )
+                failed_ids = {
+                    variant_id
+                    for variant_id, quantity in reserved_stock.items()
+                    if stocks.get(variant_id) != variants[variant_id].stock - quantity
+                }
+                for index, item_data in enumerate(items_data):
+                    if item_data.get("variant_id") in failed_ids:
+                        item_errors[index]["quantity"] = _(
+                            "Sản phẩm không đủ hàng trong kho."
+                        )
+                raise serializers.ValidationError({"items": item_errors})
+
+        # Tạo đơn hàng cùng tổng giá trị
+        order = Order.objects.create(
+            shipping_address=shipping_address,
+            total_price=int(total_price),
+            **validated_data,
+        )
+
+        # Lưu danh sách sản phẩm vào DB (kho đã được trừ ở trên)
+        for order_item in order_items:
+            order_item.order = order
         OrderItem.objects.bulk_create(order_items)
 
-        # Cập nhật tổng giá trị đơn hàng
-        order.total_price = total_price
-        order.save()
+        # Tăng số tham chiếu của snapshot, tạo nền snapshot cho ảnh nguồn chưa có
+        snapshot_refs = Counter(order_item.snapshot_id for order_item in order_items)
+        change_snapshot_refs(snapshot_refs)
+        if any(
+            not order_item.snapshot_id and order_item.image.name != default_no_image
+            for order_item in order_items
+        ):
+            run_after_commit(snapshot_order_items, order.id)
+
+        # Cập nhật tổng tồn kho hiển thị của các sản phẩm ở thread nền sau khi commit.
+        # Chỉ tồn kho thay đổi nên không vô hiệu hóa cache danh sách không lọc
+        run_after_commit(
+            refresh_listing_summaries,
+            {order_item.product_id for order_item in order_items},
+            product_list=False,
+        )
 
         # Payment**
         if payment_data:
@@ -1776,6 +1984,20 @@ class OrderSerializer(serializers.ModelSerializer):
         return order
 
 
+class OrderBulkStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False
+    )
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+
+    def save(self, user=None):
+        order_ids = self.validated_data["ids"]
+        errors = transition_orders(order_ids, self.validated_data["status"], user)
+        if any(errors):
+            raise serializers.ValidationError({"ids": errors})
+        return order_ids
+
+
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
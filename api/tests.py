@@ -1,3 +1,72 @@
 from django.test import TestCase
 
-# Create your tests here.
+from api.pagination import ProductPagination
+from api.serializers import ProductListPublicSerializer
+from api.views import ProductListPublicAPIView
+from core.models import (
+    AttributeValue,
+    Category,
+    Product,
+    ProductAttribute,
+    ProductListingSummary,
+    Variant,
+)
+
+
+class ProductListPublicQueryCountTests(TestCase):
+    """Số truy vấn khi serialize danh sách sản phẩm không phụ thuộc số sản phẩm mỗi trang"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create không gửi signal (cache, dữ liệu tìm kiếm, ...)
+        category = Category.objects.bulk_create(
+            [Category(name="Danh mục", slug="danh-muc")]
+        )[0]
+        products = Product.objects.bulk_create(
+            Product(
+                sku=f"SKU{index}",
+                name=f"Sản phẩm kiểm tra {index}",
+                slug=f"san-pham-kiem-tra-{index}",
+                category=category,
+                detail="",
+            )
+            for index in range(ProductPagination.max_page_size)
+        )
+        variants = Variant.objects.bulk_create(
+            Variant(product=product, name="Đỏ", price=100000, stock=10)
+            for product in products
+        )
+        attributes = ProductAttribute.objects.bulk_create(
+            ProductAttribute(product=product, name="Màu") for product in products
+        )
+        attribute_values = AttributeValue.objects.bulk_create(
+            AttributeValue(attribute=attribute, value="Đỏ") for attribute in attributes
+        )
+        Variant.attribute_values.through.objects.bulk_create(
+            Variant.attribute_values.through(
+                variant_id=variant.id, attributevalue_id=attribute_value.id
+            )
+            for variant, attribute_value in zip(variants, attribute_values)
+        )
+        ProductListingSummary.objects.bulk_create(
+            ProductListingSummary(
+                product=variant.product,
+                variant=variant,
+                price=variant.price,
+                discount_price=variant.price,
+                total_stock=variant.stock,
+            )
+            for variant in variants
+        )
+
+    def serialize_page(self, page_size):
+        queryset = ProductListPublicAPIView().get_queryset().order_by("-id")
+        data = ProductListPublicSerializer(queryset[:page_size], many=True).data
+        self.assertEqual(len(data), page_size)
+        self.assertTrue(all("attr_value=" in product["url"] for product in data))
+
+    def test_constant_query_count(self):
+        # Một truy vấn sản phẩm và một truy vấn giá trị thuộc tính của các variant
+        for page_size in (1, ProductPagination.max_page_size):
+            with self.subTest(page_size=page_size), self.assertNumQueries(2):
+                self.serialize_page(page_size)
@@ -78,18 +78,29 @@ urlpatterns = [
     path(
         "categories/import/", views.CategoryImportView.as_view(), name="category-import"
     ),
+    path("imports/<int:pk>/", views.ImportJobAPIView.as_view(), name="import-job"),
     path(
         "categories/export/", views.CategoryExportView.as_view(), name="category-export"
     ),
     # Product
     path("products/", views.ProductListAPIView.as_view(), name="product-list"),
     path("products/public/", views.ProductListPublicAPIView.as_view(), name="product-list-public"),
+    path(
+        "products/autocomplete/",
+        views.ProductAutocompleteAPIView.as_view(),
+        name="product-autocomplete",
+    ),
     path("products/create/", views.ProductAPIView.as_view(), name="product-create"),
     path(
         "products/<int:pk>/",
         views.ProductAPIView.as_view(),
         name="product-read-update-delete",
     ),
+    path(
+        "products/<int:pk>/view/",
+        views.ProductViewCountAPIView.as_view(),
+        name="product-view-count",
+    ),
     path(
         "products/<int:pk>/reviews/",
         views.ProductReviewAPIView.as_view(),
@@ -105,11 +116,19 @@ urlpatterns = [
         views.ProductCommentAPIView.as_view(),
         name="product-comments-list-create",
     ),
+    path(
+        "products/export/", views.ProductExportView.as_view(), name="product-export"
+    ),
     path(
         "products/bulk-delete/",
         views.ProductBulkDeleteAPIView.as_view(),
         name="product-bulk-delete",
     ),
+    path(
+        "products/bulk-stock-update/",
+        views.ProductBulkStockUpdateAPIView.as_view(),
+        name="product-bulk-stock-update",
+    ),
     #Variant
     path(
         "variants/",
@@ -119,12 +138,22 @@ urlpatterns = [
     # Promotion
     path('promotions/', views.PromotionAPIView.as_view(), name='promotion-list'),
     path('promotions/<int:pk>/', views.PromotionAPIView.as_view(), name='promotion-detail'),
+    path(
+        "promotions/export/",
+        views.PromotionItemExportView.as_view(),
+        name="promotion-item-export",
+    ),
     # Notifications
     path(
         "notifications/<int:pk>/mark-read/",
         views.NotificationMarkReadAPIView.as_view(),
         name="notification-mark-read",
     ),
+    path(
+        "notifications/unread-count/",
+        views.NotificationUnreadCountAPIView.as_view(),
+        name="notification-unread-count",
+    ),
     path(
         "notifications/mark-read/",
         views.NotificationMarkReadAPIView.as_view(),
@@ -152,7 +181,21 @@ urlpatterns = [
     # Order
     path("place-order/", views.PlaceOrderView.as_view(), name="place_order"),
     path("orders/create/", views.PlaceOrderView.as_view(), name="order_create"),
+    path("orders/export/", views.OrderExportView.as_view(), name="order_export"),
+    path(
+        "orders/bulk-status/",
+        views.OrderBulkStatusAPIView.as_view(),
+        name="order_bulk_status",
+    ),
     path("chat-user/", views.ChatUserAPIView.as_view(), name="chat_user_create"),
     path("chat/", views.ChatRoomAPIView.as_view(), name="chat_room_create"),
+    path(
+        "chat/dispatch/", views.ChatDispatchAPIView.as_view(), name="chat_dispatch"
+    ),
     path("chat/<str:pk>/", views.ChatRoomAPIView.as_view(), name="chat_room"),
+    path(
+        "chat/<str:pk>/messages/",
+        views.ChatMessageHistoryAPIView.as_view(),
+        name="chat_message_history",
+    ),
 ]
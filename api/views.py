@@ -1,5 +1,4 @@
 import json
-from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.conf import settings
@@ -10,7 +9,6 @@ from django.utils.translation import gettext as _, ngettext
 from django.contrib.auth.tokens import default_token_generator
 from django.db.models import (
     Count,
-    Avg,
     F,
     Q,
     Case,
@@ -23,9 +21,7 @@ from django.db.models import (
     Prefetch,
     Subquery,
     CharField,
-    ExpressionWrapper,
     Value,
-    DecimalField,
     IntegerField,
 )
 from django.db.models.functions import Coalesce, Concat
@@ -36,7 +32,9 @@ from rest_framework.decorators import api_view
 from rest_framework.views import APIView
 from rest_framework.generics import *
 from rest_framework.mixins import *
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.permissions import (
     IsAuthenticated,
     IsAuthenticatedOrReadOnly,
@@ -48,19 +46,56 @@ from django_filters.rest_framework import DjangoFilterBackend
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from urllib.parse import urlparse, parse_qs
-from import_export.formats.base_formats import XLSX, XLS
 from api.filters import (
     ProductFilter,
+    ProductSearchFilter,
     PromotionFilter,
     VariantFilter,
 )
 from rest_framework.parsers import JSONParser
 from api.pagination import *
 from api.parsers import NestedMultiPartParser
+from api.cache import CategoryListCacheMixin, ProductListCacheMixin
+from core.carts import get_cart_with_items
+from core.chat_dispatch import (
+    claim_room,
+    dispatch_rooms,
+    get_dispatch_stats,
+    send_assignment,
+    staff_offline,
+    staff_online,
+)
+from core.chats import (
+    CHAT_HISTORY_SIZE,
+    MAX_CHAT_HISTORY_SIZE,
+    buffer_chat_message,
+    decode_chat_cursor,
+    get_chat_history,
+    group_messages_by_date,
+)
+from core.comments import (
+    COMMENT_TREE_DEPTH,
+    MAX_COMMENT_TREE_DEPTH,
+    load_comment_trees,
+)
+from core.counters import product_search_counter, product_view_counter
+from core.importers import run_import_job
+from core.notifications import (
+    change_unread_count,
+    get_unread_count,
+    reset_unread_count,
+)
+from core.search import search_products, search_terms
+from core.tasks import run_after_commit
 from core.models import *
 from .permissions import IsOwnerOrStaff, IsStaff, IsStaffOrReadOnly
 from .serializers import *
-from .resources import CategoryResource
+from .exports import (
+    CategoryExporter,
+    OrderExporter,
+    ProductExporter,
+    PromotionItemExporter,
+)
 
 
 @api_view(["GET"])
@@ -481,34 +516,44 @@ class NotificationSettingsView(GenericAPIView):
 class NotificationMarkReadAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def delete_notification_count_key(self, notification_link):
-        # Delete key cache trả lời bình luận liên quan đến notification
-        parsed_url = urlparse(notification_link)
-        query_params = parse_qs(parsed_url.query)
-        # Lấy comment-id từ query parameters
-        comment_id = query_params.get("comment-id", "")
-        if comment_id:  # Chỉ xóa cache nếu comment_id tồn tại
-            notification_count_key = f"notification_{self.request.user.id}_{comment_id}"
-            cache.delete(notification_count_key)
-        else:
-            rating_id = query_params.get("rating-id", "")
-            if rating_id:  # Chỉ xóa cache nếu rating_id tồn tại
-                notification_count_key = (
-                    f"notification_{self.request.user.id}_{rating_id}"
-                )
-                cache.delete(notification_count_key)
+    def get_notification_count_key(self, notification_link):
+        # Key cache gộp trả lời bình luận/đánh giá liên quan đến notification
+        query_params = parse_qs(urlparse(notification_link or "").query)
+        # parse_qs trả về danh sách giá trị cho mỗi tham số
+        comment_id = (
+            query_params.get("comment-id") or query_params.get("review-id") or [""]
+        )[0]
+        if comment_id:
+            return f"notification_{self.request.user.id}_{comment_id}"
+        return None
+
+    def delete_notification_count_keys(self, notification_links):
+        # Xóa tất cả key trong một lệnh (DEL nhiều key)
+        keys = {self.get_notification_count_key(link) for link in notification_links}
+        keys.discard(None)
+        if keys:
+            cache.delete_many(keys)
 
     def patch(self, request, pk=None, *args, **kwargs):
         if pk:
             # Đánh dấu một thông báo cụ thể là đã đọc
             try:
                 notification = Notification.objects.get(pk=pk)
-                notification_read, created = NotificationRead.objects.get_or_create(
-                    user=request.user, notification=notification
+                was_read = notification.is_read_by(request.user)
+                # Upsert một câu lệnh thay cho get_or_create + save
+                NotificationRead.objects.bulk_create(
+                    [
+                        NotificationRead(
+                            user=request.user, notification=notification, is_read=True
+                        )
+                    ],
+                    update_conflicts=True,
+                    unique_fields=["user", "notification"],
+                    update_fields=["is_read", "updated_at"],
                 )
-                notification_read.is_read = True
-                notification_read.save()
-                self.delete_notification_count_key(notification.link)
+                self.delete_notification_count_keys([notification.link])
+                if not was_read:
+                    change_unread_count(request.user.id, -1)
                 next_url = notification.link if notification.link else ""
                 return Response(
                     {
@@ -520,53 +565,50 @@ class NotificationMarkReadAPIView(APIView):
             except Notification.DoesNotExist:
                 return Response({"error": "Không tìm thấy thông báo."}, status=404)
         else:
-            # Nếu không có ID, đánh dấu tất cả thông báo là đã đọc
-            # unread_notifications = Notification.objects.filter(
-            #     Q(user=request.user) | Q(notification_type__in=Notification.FILTER_TYPES)
-            # ).exclude(
-            #     notification_read__user=request.user,  # Loại bỏ thông báo đã có bản ghi trong NotificationRead
-            #     notification_read__is_read=True  # Loại bỏ thông báo đã đọc
-            # )
-
-            unread_notifications = (
-                Notification.objects.filter(
-                    Q(user=request.user)
-                    | Q(notification_type__in=Notification.FILTER_TYPES)
-                )
-                .annotate(
-                    is_read=Exists(
-                        NotificationRead.objects.filter(
-                            user=request.user, notification=OuterRef("pk"), is_read=True
-                        )
-                    )
-                )
-                .filter(is_read=False)
+            # Nếu không có ID, đánh dấu tất cả thông báo là đã đọc bằng mốc thời gian
+            read_until = now()
+            unread_links = list(
+                Notification.objects.unread_for(request.user)
+                .filter(updated_at__lte=read_until)
+                .exclude(link__isnull=True)
+                .values_list("link", flat=True)
             )
 
-            # Cập nhật tất cả các thông báo còn lại là đã đọc, nếu chưa có bản ghi NotificationRead
             with transaction.atomic():
-                # Tạo hoặc cập nhật các bản ghi NotificationRead
-                notifications_to_update = []
-                for notification in unread_notifications:
-                    notification_read, created = NotificationRead.objects.get_or_create(
-                        user=request.user, notification=notification
-                    )
-                    notification_read.is_read = True
-                    notifications_to_update.append(notification_read)
-                    self.delete_notification_count_key(notification.link)
-
-                # Bulk update tất cả các bản ghi
-                NotificationRead.objects.bulk_update(
-                    notifications_to_update, ["is_read"]
+                NotificationReadMarker.objects.bulk_create(
+                    [NotificationReadMarker(user=request.user, read_until=read_until)],
+                    update_conflicts=True,
+                    unique_fields=["user"],
+                    update_fields=["read_until", "updated_at"],
                 )
+                # Bản ghi đọc riêng lẻ trước mốc không còn cần thiết
+                NotificationRead.objects.filter(
+                    user=request.user, notification__updated_at__lte=read_until
+                ).delete()
 
+            self.delete_notification_count_keys(unread_links)
+            reset_unread_count(request.user.id)
             return Response(
                 {"message": "Tất cả thông báo được đánh dấu là đã đọc."}, status=200
             )
 
 
+class NotificationUnreadCountAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """Số thông báo chưa đọc của user (đọc từ bộ đếm Redis)"""
+        return Response(
+            {
+                "status": "success",
+                "data": {"unread_count": get_unread_count(request.user)},
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
 # -------------------- CATEGORY -------------------- #
-class CategoryAPIView(mixins.ListModelMixin, GenericAPIView):
+class CategoryAPIView(CategoryListCacheMixin, mixins.ListModelMixin, GenericAPIView):
     permission_classes = [IsStaffOrReadOnly]
     serializer_class = CategorySerializer
     pagination_class = CategoryPagination
@@ -725,66 +767,70 @@ class CategoryImportView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Choose the correct format based on file extension
-        format_class = XLSX() if file.name.endswith(".xlsx") else XLS()
-
-        # Read the file content into a dataset
-        dataset = format_class.create_dataset(file.read())
-
-        # Use CategoryResource to import data
-        category_resource = CategoryResource()
-        result = category_resource.import_data(
-            dataset, dry_run=True
-        )  # Dry run for validation
-        # Use CategoryResource to import data
-        if result.has_errors():
-            errors = {
-                f"row_{index + 1}": error
-                for index, error in enumerate(result.row_errors())
-            }
-            return Response(
-                {
-                    "status": "error",
-                    "message": _("Import không thành công."),
-                    "errors": errors,
-                },
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-        category_resource.import_data(dataset, dry_run=False)
+        # Lưu file và nhập dữ liệu trong thread nền để không chặn request
+        job = ImportJob.objects.create(
+            kind="category", file=file, created_by=request.user
+        )
+        run_after_commit(run_import_job, job.id)
         return Response(
             {
                 "status": "success",
-                "message": _("%s danh mục đã nhập thành công.")
-                % len(result.valid_rows()),
+                "message": _("Đang nhập dữ liệu danh mục."),
+                "data": ImportJobSerializer(job).data,
             },
-            status=status.HTTP_200_OK,
+            status=status.HTTP_202_ACCEPTED,
         )
 
 
-class CategoryExportView(APIView):
-    permission_classes = [AllowAny]
+class ImportJobAPIView(RetrieveAPIView):
+    """Tiến độ và kết quả của tiến trình nhập dữ liệu"""
+
+    permission_classes = [IsStaff]
+    serializer_class = ImportJobSerializer
+    queryset = ImportJob.objects.all()
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        return Response(
+            {"status": "success", "data": serializer.data}, status=status.HTTP_200_OK
+        )
+
+
+class ExportAPIView(APIView):
+    """Xuất file XLSX (mặc định) hoặc CSV theo từng dòng, lọc theo "ids" nếu có"""
+
+    permission_classes = [IsStaff]
+    exporter_class = None
 
     def post(self, request, *args, **kwargs):
-        category_resource = CategoryResource()
+        ids = request.data.get("ids", [])
+        try:
+            ids = list(map(int, ids))
+        except (TypeError, ValueError):
+            return Response(
+                {"status": "error", "message": _("Danh sách IDs không hợp lệ.")},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # Không dùng query param "format" vì DRF dành cho chọn renderer
+        export_format = request.data.get("format", "xlsx")
+        return self.exporter_class(ids).response(export_format)
+
 
-        # Lấy danh sách ID danh mục từ request body
-        category_ids = request.data.get("ids", [])
+class CategoryExportView(ExportAPIView):
+    permission_classes = [AllowAny]
+    exporter_class = CategoryExporter
 
-        # Bạn có thể lọc danh mục theo ID nếu cần
-        if category_ids:
-            categories = Category.objects.filter(id__in=category_ids)
-            category_resource = (
-                CategoryResource()
-            )  # Tạo lại resource sau khi lọc dữ liệu
 
-        # Xuất dữ liệu
-        dataset = category_resource.export(queryset=categories)
+class ProductExportView(ExportAPIView):
+    exporter_class = ProductExporter
 
-        # Tạo phản hồi HTTP với tệp Excel (XLSX)
-        response = HttpResponse(dataset.xlsx)
-        response["Content-Disposition"] = "attachment; filename=categories.xlsx"
 
-        return response
+class OrderExportView(ExportAPIView):
+    exporter_class = OrderExporter
+
+
+class PromotionItemExportView(ExportAPIView):
+    exporter_class = PromotionItemExporter
 
 
 # -------------------- PRODUCT --------------------- #
@@ -871,11 +917,10 @@ class ProductListAPIView(ListAPIView):
     permission_classes = [IsStaff]
     serializer_class = ProductListSerializer
     pagination_class = ProductPagination
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, OrderingFilter, ProductSearchFilter]
     filterset_class = ProductFilter
     ordering_fields = ["created_at", "id"]
     ordering = ["-created_at", "-id"]
-    search_fields = ["sku", "name", "category__name"]
 
     def get_base_queryset(self):
         queryset = Product.objects.select_related("category").annotate(
@@ -891,72 +936,34 @@ class ProductListAPIView(ListAPIView):
         return queryset
 
     def get_queryset_include_variants(self):
-        # Tính toán giá giảm cho từng variant của sản phẩm trong chương trình khuyến mãi
-        variants_queryset = Variant.objects.prefetch_related("stock_setting").annotate(
-            discount_price=Case(
-                When(
-                    promotion_items__promotion__start_date__lte=now(),
-                    promotion_items__promotion__end_date__gt=now(),
-                    promotion_items__discount_type="percent",  # Giảm giá theo phần trăm
-                    then=F("price") * (1 - F("promotion_items__discount_value") / 100),
-                ),
-                When(
-                    promotion_items__promotion__start_date__lte=now(),
-                    promotion_items__promotion__end_date__gt=now(),
-                    promotion_items__discount_type="amount",  # Giảm giá theo số tiền
-                    then=F("price") - F("promotion_items__discount_value"),
-                ),
-                default=F("price"),  # Nếu không có giảm giá, lấy giá ban đầu
-                output_field=IntegerField(),
-            ),
-            discount=Case(
-                When(
-                    promotion_items__promotion__start_date__lte=now(),
-                    promotion_items__promotion__end_date__gt=now(),
-                    promotion_items__discount_type="amount",
-                    then=ExpressionWrapper(
-                        (F("promotion_items__discount_value") / F("price")) * 100,
-                        output_field=IntegerField(),
-                    ),
-                ),
-                When(
-                    promotion_items__promotion__start_date__lte=now(),
-                    promotion_items__promotion__end_date__gt=now(),
-                    promotion_items__discount_type="percent",
-                    then=F("promotion_items__discount_value"),
-                ),
-                default=Value(0),
-                output_field=IntegerField(),
-            ),
-            discount_display=Case(
-                When(
-                    promotion_items__promotion__start_date__lte=now(),
-                    promotion_items__promotion__end_date__gt=now(),
-                    promotion_items__discount_type="percent",
-                    then=Concat(
-                        F("promotion_items__discount_value"),
-                        Value("%"),
-                        output_field=CharField(),
+        # Giá giảm của từng variant được đọc từ bảng giá hiệu lực
+        variants_queryset = (
+            Variant.objects.prefetch_related("stock_setting")
+            .with_info_display()
+            .annotate(
+                discount_display=Case(
+                    When(
+                        discount__gt=0,
+                        effective_price__discount_type="percent",
+                        then=Concat(
+                            F("effective_price__discount_value"),
+                            Value("%"),
+                            output_field=CharField(),
+                        ),
                     ),
-                ),
-                When(
-                    promotion_items__promotion__start_date__lte=now(),
-                    promotion_items__promotion__end_date__gt=now(),
-                    promotion_items__discount_type="amount",
-                    then=Concat(
-                        F("promotion_items__discount_value"),
-                        Value("₫"),
-                        output_field=CharField(),
+                    When(
+                        discount__gt=0,
+                        effective_price__discount_type="amount",
+                        then=Concat(
+                            F("effective_price__discount_value"),
+                            Value("₫"),
+                            output_field=CharField(),
+                        ),
                     ),
+                    default=Value(None),
+                    output_field=CharField(),
                 ),
-                default=Value(None),
-                output_field=CharField(),
-            ),
-            image=Subquery(
-                AttributeValue.objects.filter(
-                    Q(variants=OuterRef("pk")) & Q(image__isnull=False) & ~Q(image="")
-                ).values("image")[:1]
-            ),
+            )
         )
 
         queryset = self.get_base_queryset().prefetch_related(
@@ -1063,79 +1070,73 @@ class ProductListAPIView(ListAPIView):
         return queryset
 
 
-class ProductListPublicAPIView(ListAPIView):
+class ProductListPublicAPIView(ProductListCacheMixin, ListAPIView):
     permission_classes = [AllowAny]
     serializer_class = ProductListPublicSerializer
     pagination_class = ProductPagination
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, OrderingFilter, ProductSearchFilter]
     filterset_class = ProductFilter
     ordering_fields = ["created_at", "id"]
     ordering = ["-created_at", "-id"]
-    search_fields = ["sku", "name", "category__name"]
 
     def get_queryset(self):
-        best_price_discount_variant = (
-            Variant.objects.filter(product=OuterRef("pk"))
-            .annotate(
-                discount_price=Case(
-                    When(
-                        promotion_items__promotion__start_date__lte=now(),
-                        promotion_items__promotion__end_date__gt=now(),
-                        promotion_items__discount_type="percent",
-                        then=ExpressionWrapper(
-                            F("price")
-                            * (1 - F("promotion_items__discount_value") / 100),
-                            output_field=DecimalField(max_digits=10, decimal_places=0),
-                        ),
-                    ),
-                    When(
-                        promotion_items__promotion__start_date__lte=now(),
-                        promotion_items__promotion__end_date__gt=now(),
-                        promotion_items__discount_type="amount",
-                        then=ExpressionWrapper(
-                            F("price") - F("promotion_items__discount_value"),
-                            output_field=DecimalField(max_digits=10, decimal_places=0),
-                        ),
-                    ),
-                    default=F("price"),
-                    output_field=DecimalField(max_digits=10, decimal_places=0),
-                ),
-                discount=Case(
-                    When(
-                        promotion_items__promotion__start_date__lte=now(),
-                        promotion_items__promotion__end_date__gt=now(),
-                        promotion_items__discount_type="amount",
-                        then=ExpressionWrapper(
-                            (F("promotion_items__discount_value") / F("price")) * 100,
-                            output_field=IntegerField(),
-                        ),
-                    ),
-                    When(
-                        promotion_items__discount_type="percent",
-                        then=F("promotion_items__discount_value"),
-                    ),
-                    default=Value(0),
-                    output_field=IntegerField(),
-                ),
-            )
-            .order_by("discount_price")[:1]
-        )
+        # Đọc dữ liệu tính sẵn trong ProductListingSummary (mỗi sản phẩm một dòng)
         queryset = Product.objects.select_related("category").annotate(
-            cover_image=Subquery(
-                Gallery.objects.filter(product=OuterRef("pk"))
-                .order_by("order")
-                .values("image")[:1]
-            ),
-            rating_star=Avg("reviews__score"),
-            variant_id=Subquery(best_price_discount_variant.values("id")),
-            price=Subquery(best_price_discount_variant.values("price")),
-            discount_price=Subquery(
-                best_price_discount_variant.values("discount_price")
-            ),
-            discount=Subquery(best_price_discount_variant.values("discount")),
+            cover_image=F("listing_summary__cover_image"),
+            rating_star=F("listing_summary__rating_star"),
+            total_stock=F("listing_summary__total_stock"),
+            variant_id=F("listing_summary__variant_id"),
+            price=F("listing_summary__price"),
+            discount_price=F("listing_summary__discount_price"),
+            discount=F("listing_summary__discount"),
         )
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        # Tính lượt tìm kiếm cho các sản phẩm ở trang đầu của kết quả (ghi trễ qua Redis)
+        if (
+            response.status_code == status.HTTP_200_OK
+            and request.query_params.get("search", "").strip()
+            and not request.query_params.get("cursor")
+            and request.query_params.get("page", "1") == "1"
+        ):
+            product_search_counter.incr_many(
+                product["id"] for product in response.data.get("products", [])
+            )
+        return response
+
+
+class ProductViewCountAPIView(APIView):
+    permission_classes = [AllowAny]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = "product_view"
+
+    def post(self, request, pk, *args, **kwargs):
+        """Ghi nhận một lượt xem sản phẩm (gom trong Redis, ghi xuống DB theo lô)"""
+        product_view_counter.incr(pk)
+        return Response({"status": "success"}, status=status.HTTP_200_OK)
+
+
+class ProductAutocompleteAPIView(APIView):
+    permission_classes = [AllowAny]
+    max_results = 10
+
+    def get(self, request, *args, **kwargs):
+        """Gợi ý sản phẩm theo tiền tố đang gõ (không phân biệt dấu)"""
+        query = request.query_params.get("q", "").strip()
+        if not search_terms(query):
+            return Response({"status": "success", "data": []}, status=status.HTTP_200_OK)
+
+        products = (
+            search_products(Product.objects.filter(is_active=True), query)
+            .order_by("-search_rank", "-sale_count", "-id")
+            .values("id", "name", "slug")[: self.max_results]
+        )
+        return Response(
+            {"status": "success", "data": list(products)}, status=status.HTTP_200_OK
+        )
+
 
 class ProductBulkDeleteAPIView(APIView):
     permission_classes = [IsStaff]
@@ -1195,6 +1196,29 @@ class ProductBulkDeleteAPIView(APIView):
         )
 
 
+class ProductBulkStockUpdateAPIView(APIView):
+    permission_classes = [IsStaff]
+
+    def patch(self, request, *args, **kwargs):
+        """Cập nhật giá, tồn kho và cảnh báo kho cho nhiều sản phẩm cùng lúc."""
+        serializer = ProductBulkStockUpdateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"status": "error", "error": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        updates = serializer.save()
+        message = ngettext(
+            "Đã cập nhật thành công %(count)s phân loại.",
+            "Đã cập nhật thành công %(count)s phân loại.",
+            len(updates),
+        ) % {"count": len(updates)}
+        return Response(
+            {"status": "success", "message": message}, status=status.HTTP_200_OK
+        )
+
+
 class ProductReviewAPIView(mixins.ListModelMixin, GenericAPIView):
     """
     API để lấy danh sách đánh giá và thêm đánh giá mới.
@@ -1251,30 +1275,24 @@ class ProductReviewSummaryAPIView(APIView):
 
     def get(self, request, pk):
         """Trả về thống kê chi tiết đánh giá của sản phẩm."""
-        product = get_object_or_404(Product, pk=pk)
-        ratings = Review.objects.filter(product=product).aggregate(
-            score_avg=Avg("score"),
-            total_ratings=Count("score"),
-            rating_1=Count(Case(When(score=1, then=1))),
-            rating_2=Count(Case(When(score=2, then=1))),
-            rating_3=Count(Case(When(score=3, then=1))),
-            rating_4=Count(Case(When(score=4, then=1))),
-            rating_5=Count(Case(When(score=5, then=1))),
-        )
+        stats = ProductRatingStats.objects.filter(product_id=pk).first()
+        if stats is None:
+            # Sản phẩm chưa có đánh giá nào
+            product = get_object_or_404(Product, pk=pk)
+            stats = ProductRatingStats(product=product)
+        average_score = stats.average_score
 
         return Response(
             {
-                "product_id": product.id,
-                "average_score": (
-                    round(ratings["score_avg"], 1) if ratings["score_avg"] else 0
-                ),
-                "total_ratings": ratings["total_ratings"],
+                "product_id": stats.product_id,
+                "average_score": round(average_score, 1) if average_score else 0,
+                "total_ratings": stats.total_ratings,
                 "ratings_distribution": {
-                    "5": ratings["rating_5"],
-                    "4": ratings["rating_4"],
-                    "3": ratings["rating_3"],
-                    "2": ratings["rating_2"],
-                    "1": ratings["rating_1"],
+                    "5": stats.rating_5,
+                    "4": stats.rating_4,
+                    "3": stats.rating_3,
+                    "2": stats.rating_2,
+                    "1": stats.rating_1,
                 },
             },
             status=status.HTTP_200_OK,
@@ -1296,19 +1314,31 @@ class ProductCommentAPIView(mixins.ListModelMixin, GenericAPIView):
 
     def get_queryset(self):
         """Trả về danh sách bình luận không liên quan đến đánh giá (rating)."""
-        queryset = Comment.objects.filter(review__isnull=True).prefetch_related(
-            "replies"
-        )
+        queryset = Comment.objects.filter(review__isnull=True).select_related("user")
         product_id = self.kwargs.get("pk")
         if product_id:
-            queryset = queryset.filter(
-                product_id=product_id, parent__isnull=True
-            ).select_related("user")
+            queryset = queryset.filter(product_id=product_id, parent__isnull=True)
         return queryset
 
+    def get_tree_depth(self):
+        """Số tầng trả lời được tải kèm (?depth=)"""
+        try:
+            depth = int(self.request.query_params.get("depth", COMMENT_TREE_DEPTH))
+        except ValueError:
+            depth = COMMENT_TREE_DEPTH
+        return min(max(depth, 0), MAX_COMMENT_TREE_DEPTH)
+
     def get(self, request, *args, **kwargs):
         """Lấy danh sách bình luận theo sản phẩm."""
-        return self.list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        comments = load_comment_trees(
+            queryset if page is None else page, self.get_tree_depth()
+        )
+        serializer = self.get_serializer(comments, many=True)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     def post(self, request, *args, **kwargs):
         """Thêm bình luận mới cho sản phẩm."""
@@ -1337,35 +1367,7 @@ class VariantListAPIView(ListAPIView):
     filterset_class = VariantFilter
 
     def get_queryset(self):
-        queryset = Variant.objects.annotate(
-            discount_price=Case(
-                When(
-                    promotion_items__discount_type="amount",
-                    then=F("price") - F("promotion_items__discount_value"),
-                ),
-                When(
-                    promotion_items__discount_type="percent",
-                    then=F("price") * (1 - F("promotion_items__discount_value") / 100),
-                ),
-                default=F("price"),
-                output_field=DecimalField(),
-            ),
-            discount=Case(
-                When(
-                    promotion_items__discount_type="amount",
-                    then=ExpressionWrapper(
-                        (F("promotion_items__discount_value") / F("price")) * 100,
-                        output_field=FloatField(),
-                    ),
-                ),
-                When(
-                    promotion_items__discount_type="percent",
-                    then=F("promotion_items__discount_value"),
-                ),
-                default=Value(0),
-                output_field=FloatField(),
-            ),
-        )
+        queryset = Variant.objects.with_effective_price()
         return queryset
 
 
@@ -1435,82 +1437,11 @@ class CartView(GenericAPIView):
     serializer_class = CartSerializer
 
     def get_queryset(self):
-
-        user = self.request.user
-
-        variant_queryset = Variant.objects.annotate(
-            image=Subquery(
-                AttributeValue.objects.filter(
-                    Q(variants=OuterRef("pk")) & Q(image__isnull=False) & ~Q(image="")
-                ).values("image")[:1]
-            ),
-            discount_price=Case(
-                When(
-                    promotion_items__promotion__start_date__lte=now(),
-                    promotion_items__promotion__end_date__gt=now(),
-                    promotion_items__discount_type="percent",
-                    then=ExpressionWrapper(
-                        F("price") * (1 - F("promotion_items__discount_value") / 100),
-                        output_field=DecimalField(max_digits=10, decimal_places=0),
-                    ),
-                ),
-                When(
-                    promotion_items__promotion__start_date__lte=now(),
-                    promotion_items__promotion__end_date__gt=now(),
-                    promotion_items__discount_type="amount",
-                    then=ExpressionWrapper(
-                        F("price") - F("promotion_items__discount_value"),
-                        output_field=DecimalField(max_digits=10, decimal_places=0),
-                    ),
-                ),
-                default=F("price"),
-                output_field=DecimalField(max_digits=10, decimal_places=0),
-            ),
-            discount=Case(
-                When(
-                    promotion_items__discount_type="percent",
-                    then=F("promotion_items__discount_value"),
-                ),
-                When(
-                    promotion_items__discount_type="amount",
-                    then=(F("promotion_items__discount_value") / F("price")) * 100,
-                ),
-                default=Value(0),
-                output_field=IntegerField(),
-            ),
-        )
-
-        product_queryset = Product.objects.annotate(
-            cover_image=Subquery(
-                Gallery.objects.filter(product=OuterRef("id"))
-                .order_by("order")
-                .values("image")[:1]  # Lấy ảnh đại diện đầu tiên
-            )
-        )
-        # Query giỏ hàng của user
-        cart_queryset = (
-            Cart.objects.filter(user=user)
-            .prefetch_related(
-                Prefetch(
-                    "cart_items",
-                    queryset=CartItem.objects.prefetch_related(
-                        Prefetch("product", queryset=product_queryset),
-                        Prefetch(
-                            "variant", queryset=variant_queryset
-                        ),  # Gộp luôn variant với giá, ảnh, stock
-                    ),
-                )
-            )
-            .annotate(
-                total_items=Count("cart_items"),
-            )
-            .first()
-        )
-
-        return cart_queryset
+        # Giỏ hàng kèm ảnh và giá sau khuyến mãi (đọc từ bảng giá hiệu lực)
+        return get_cart_with_items(user=self.request.user)
 
     def get(self, request, *args, **kwargs):
-        cart = self.get_queryset().first()
+        cart = self.get_queryset()
         if not cart:
             return Response({"message": "Giỏ hàng trống."}, status=status.HTTP_200_OK)
 
@@ -1636,6 +1567,29 @@ class PlaceOrderView(GenericAPIView):
             )
 
 
+class OrderBulkStatusAPIView(APIView):
+    permission_classes = [IsStaff]
+
+    def patch(self, request, *args, **kwargs):
+        """Chuyển trạng thái nhiều đơn hàng cùng lúc (lỗi trả về theo thứ tự ids)."""
+        serializer = OrderBulkStatusSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"status": "error", "error": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        order_ids = serializer.save(user=request.user)
+        message = ngettext(
+            "Đã cập nhật trạng thái %(count)s đơn hàng.",
+            "Đã cập nhật trạng thái %(count)s đơn hàng.",
+            len(order_ids),
+        ) % {"count": len(order_ids)}
+        return Response(
+            {"status": "success", "message": message}, status=status.HTTP_200_OK
+        )
+
+
 # ------------------- WISHLIST --------------------- #
 class WishlistAPIView(GenericAPIView):
     permission_classes = [IsAuthenticated]
@@ -1808,12 +1762,28 @@ class ChatRoomAPIView(GenericAPIView):
         self.permission_classes = [IsStaff]
         self.check_permissions(request)
         chat_room = self.get_object()
-        old_status = chat_room.status
         serializer = self.serializer_class(
             data=request.data, instance=chat_room, partial=True
         )
         if serializer.is_valid():
-            serializer.save()
+            data = serializer.validated_data
+            if chat_room.status == ChatRoom.WAITING and (
+                data.get("recipient") or data.get("status") == ChatRoom.ACTIVE
+            ):
+                # Nhận phòng đang chờ: chỉ một nhân viên nhận được phòng
+                recipient = data.get("recipient") or request.user
+                if not claim_room(chat_room.id, recipient.id):
+                    return Response(
+                        {
+                            "status": "error",
+                            "error": _("Phòng chat đã được nhân viên khác tiếp nhận."),
+                        },
+                        status=status.HTTP_409_CONFLICT,
+                    )
+                chat_room.refresh_from_db()
+                send_assignment(chat_room)
+            else:
+                serializer.save()
             return Response(
                 {
                     "status": "success",
@@ -1841,3 +1811,145 @@ class ChatRoomAPIView(GenericAPIView):
                 {"status": "success", "message": _("Xoá phòng chat thành công.")},
                 status=status.HTTP_200_OK,
             )
+
+
+class ChatDispatchAPIView(APIView):
+    """
+    Phân phối phòng chat cho nhân viên.
+
+    - `GET /chat/dispatch/` → Số phòng đang chờ, thời gian chờ (giây) và số phòng
+      đang phụ trách của các nhân viên trực tuyến.
+    - `POST /chat/dispatch/` → Nhân viên báo trực tuyến (gọi định kỳ) và nhận phòng chờ.
+    - `DELETE /chat/dispatch/` → Nhân viên ngừng nhận phòng mới.
+    """
+
+    permission_classes = [IsStaff]
+
+    def get(self, request, *args, **kwargs):
+        return Response(
+            {"status": "success", "data": get_dispatch_stats()},
+            status=status.HTTP_200_OK,
+        )
+
+    def post(self, request, *args, **kwargs):
+        staff_online(request.user.id)
+        assigned = dispatch_rooms()
+        return Response(
+            {
+                "status": "success",
+                "message": _("Đã phân phối %s phòng chat.") % len(assigned),
+                "data": ChatRoomSerializer(
+                    [chat_room for chat_room, user_id in assigned], many=True
+                ).data,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    def delete(self, request, *args, **kwargs):
+        staff_offline(request.user.id)
+        return Response(
+            {"status": "success", "message": _("Đã ngừng nhận phòng chat mới.")},
+            status=status.HTTP_200_OK,
+        )
+
+
+class ChatMessageHistoryAPIView(APIView):
+    """
+    Lịch sử tin nhắn của phòng chat theo cửa sổ.
+
+    - `GET /chat/{id}/messages/?before=<cursor>&size=<n>` → n tin nhắn gần nhất
+      (cũ hơn cursor), gom theo ngày, kèm `next_cursor` để tải tin cũ hơn.
+    - `POST /chat/{id}/messages/` → Gửi tin nhắn (ghi DB theo lô bởi flush_chat_messages).
+    """
+
+    permission_classes = [AllowAny]
+
+    def has_room_access(self, request, chat_room):
+        """Nhân viên hoặc người tạo phòng chat (user đăng nhập hoặc khách theo cookie)"""
+        if request.user.is_staff:
+            return True
+        creator = chat_room.created_by
+        if creator is None:
+            return False
+        if request.user.is_authenticated and creator.user_id == request.user.id:
+            return True
+        return bool(creator.guest_id) and creator.guest_id == request.COOKIES.get(
+            "guestid"
+        )
+
+    def get_chat_room(self, request, pk):
+        chat_room = get_object_or_404(
+            ChatRoom.objects.select_related("created_by"), pk=pk
+        )
+        if not self.has_room_access(request, chat_room):
+            raise PermissionDenied(_("Bạn không có quyền xem phòng chat này."))
+        return chat_room
+
+    def get(self, request, pk, *args, **kwargs):
+        chat_room = self.get_chat_room(request, pk)
+
+        before = None
+        if request.query_params.get("before"):
+            before = decode_chat_cursor(request.query_params["before"])
+            if before is None:
+                return Response(
+                    {"status": "error", "error": {"before": _("Cursor không hợp lệ.")}},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        try:
+            size = int(request.query_params.get("size", CHAT_HISTORY_SIZE))
+        except ValueError:
+            size = CHAT_HISTORY_SIZE
+        size = min(max(size, 1), MAX_CHAT_HISTORY_SIZE)
+
+        messages, next_cursor = get_chat_history(chat_room.id, before, size)
+        return Response(
+            {
+                "status": "success",
+                "data": {
+                    "messages": [
+                        {"date": date, "messages": date_messages}
+                        for date, date_messages in group_messages_by_date(
+                            messages
+                        ).items()
+                    ],
+                    "next_cursor": next_cursor,
+                },
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    def post(self, request, pk, *args, **kwargs):
+        chat_room = self.get_chat_room(request, pk)
+        content = str(request.data.get("content") or "").strip()
+        if not content:
+            return Response(
+                {
+                    "status": "error",
+                    "error": {"content": _("Nội dung tin nhắn không được để trống.")},
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if request.user.is_authenticated:
+            sender = ChatUser.objects.filter(user=request.user).first()
+        else:
+            sender = ChatUser.objects.filter(
+                guest_id=request.COOKIES.get("guestid")
+            ).first()
+        if sender is None:
+            raise PermissionDenied(_("Bạn không có quyền xem phòng chat này."))
+
+        # Tin nhắn được xác nhận và gửi cho phòng chat ngay, chưa ghi DB
+        message = buffer_chat_message(chat_room.id, sender, content)
+        data = {
+            "stream_id": message.stream_id,
+            "content": message.content,
+            "sender": {"id": sender.id, "name": sender.name},
+            "time": message.created_at,
+        }
+        async_to_sync(get_channel_layer().group_send)(
+            f"chat_{chat_room.name}", {"type": "chat_message", "data": data}
+        )
+        return Response(
+            {"status": "success", "data": data}, status=status.HTTP_201_CREATED
+        )
@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.db.models import F, OuterRef, Subquery
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import *
 from django.utils.translation import gettext_lazy as _
 from rest_framework_simplejwt import token_blacklist
+from .images import preview_image_tag
 
 
 class UserAdmin(BaseUserAdmin):
@@ -59,11 +61,25 @@ class OrderItemInline(admin.TabularInline):
     
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['invoice','user','total_price','get_status_display','status','created_at']
+    list_select_related = ['user']
     inlines = [OrderItemInline,]
     
+    def get_queryset(self, request):
+        # Trạng thái thanh toán lấy cùng truy vấn danh sách
+        return super().get_queryset(request).annotate(payment_status=F('payment__status'))
+    
     @display(description=_('Thanh Toán'))
     def get_status_display(self, obj):
-        return obj.payment.get_status_display()  
+        return dict(Payment.STATUS_CHOICES).get(obj.payment_status, '-')
+    
+class OrderItemAdmin(admin.ModelAdmin):
+    list_select_related = ['order']
+    
+class OrderStatusHistoryAdmin(admin.ModelAdmin):
+    list_select_related = ['order']
+    
+class PaymentAdmin(admin.ModelAdmin):
+    list_select_related = ['order']
     
 class GalleryInLine(admin.TabularInline):
     model = Gallery
@@ -73,6 +89,7 @@ class GalleryInLine(admin.TabularInline):
     
 class GalleryAdmin(admin.ModelAdmin):
     list_display = ['preview_image','product']
+    list_select_related = ['product']
     fields = ['preview_image','image','product','order']
     readonly_fields = ['preview_image'] 
     
@@ -105,6 +122,7 @@ class ProductAttributeAdmin(admin.ModelAdmin):
     
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['preview_image','sku','name','category','is_active']
+    list_select_related = ['category']
     fields = ['sku','name','slug','category','description','sale_count','view_count','search_count','detail','promotions','is_active']
     readonly_fields = ('sale_count','view_count', 'search_count',)
     inlines = [GalleryInLine,ProductAttributeInline,VariantInline]
@@ -112,12 +130,48 @@ class ProductAdmin(admin.ModelAdmin):
     class Media:
         js = ('js/admin/image_preview.js',)
         
+    def get_queryset(self, request):
+        # Ảnh đại diện lấy bằng subquery thay cho 2 truy vấn gallery mỗi dòng
+        return super().get_queryset(request).annotate(
+            cover_image=Subquery(
+                Gallery.objects.filter(product=OuterRef('pk')).order_by('order', 'id').values('image')[:1]
+            )
+        )
+        
+    @display(description=_('Xem trước Hình ảnh'))
+    def preview_image(self, obj):
+        return preview_image_tag(obj.cover_image or default_no_image.rstrip('/'))
+        
 class VariantAdmin(admin.ModelAdmin):
+    list_display = ['preview_image','__str__','sku','price','stock','is_default']
+    list_select_related = ['product']
     fields = ['preview_image','product','sku','name','price','stock','attribute_values','is_default']
     readonly_fields = ['preview_image'] 
     
     class Media:
         js = ('js/admin/image_preview.js',)
+        
+    def get_queryset(self, request):
+        # Ảnh của giá trị thuộc tính đầu tiên có ảnh, lấy cùng truy vấn danh sách
+        return super().get_queryset(request).annotate(
+            cover_image=Subquery(
+                Variant.attribute_values.through.objects.filter(variant_id=OuterRef('pk'))
+                .exclude(attributevalue__image__isnull=True)
+                .exclude(attributevalue__image='')
+                .order_by('attributevalue_id')
+                .values('attributevalue__image')[:1]
+            )
+        )
+        
+    @display(description=_('Xem trước Hình ảnh'))
+    def preview_image(self, obj):
+        return preview_image_tag(obj.cover_image or default_no_image.rstrip('/'))
+        
+class PromotionItemAdmin(admin.ModelAdmin):
+    list_select_related = ['product','variant','promotion']
+    
+class StockSettingAdmin(admin.ModelAdmin):
+    list_select_related = ['variant__product']
     
 class WardInLine(admin.TabularInline):
     model = Ward
@@ -150,18 +204,18 @@ admin.site.register(User, UserAdmin)
 admin.site.register(Category,CategoryAdmin)
 admin.site.register(Product,ProductAdmin)
 admin.site.register(Variant,VariantAdmin)
-admin.site.register(StockSetting)
+admin.site.register(StockSetting,StockSettingAdmin)
 admin.site.register(Gallery,GalleryAdmin)
 admin.site.register(ProductAttribute,ProductAttributeAdmin)
 admin.site.register(AttributeValue)
 
 admin.site.register(Cart,CartAdmin)
-admin.site.register(OrderStatusHistory)
+admin.site.register(OrderStatusHistory,OrderStatusHistoryAdmin)
 admin.site.register(Order,OrderAdmin)
-admin.site.register(OrderItem)
+admin.site.register(OrderItem,OrderItemAdmin)
 admin.site.register(Promotion)
-admin.site.register(PromotionItem)
-admin.site.register(Payment)
+admin.site.register(PromotionItem,PromotionItemAdmin)
+admin.site.register(Payment,PaymentAdmin)
 admin.site.register(UserShippingAddress)
 admin.site.register(Review)
 admin.site.register(Comment)
@@ -171,6 +225,7 @@ admin.site.register(Ward)
 admin.site.register(NotificationSettings)
 admin.site.register(Notification)
 admin.site.register(NotificationRead)
+admin.site.register(NotificationReadMarker)
 admin.site.register(Wishlist)
 admin.site.register(ChatUser)
 admin.site.register(ChatRoom)
@@ -0,0 +1,70 @@
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+from django_redis import get_redis_connection
+
+# Bộ đếm thế hệ (generation) dùng để vô hiệu hóa cache danh mục/sản phẩm:
+# key cache của response chứa giá trị các bộ đếm liên quan, tăng bộ đếm
+# đồng nghĩa với việc các response cũ không còn được đọc tới nữa.
+CATALOG_VERSION_KEY = "catalog_gen_version"  # Toàn bộ catalog (rebuild)
+CATALOG_PRODUCTS_KEY = "catalog_gen_products"  # Danh sách không lọc theo danh mục/id
+CATEGORY_TREE_KEY = "catalog_gen_category_tree"  # Danh sách danh mục (số lượng sản phẩm)
+CATEGORY_KEY = "catalog_gen_category_{}"
+PRODUCT_KEY = "catalog_gen_product_{}"
+
+
+def get_generations(keys):
+    """Đọc giá trị các bộ đếm (mặc định 0) trong một lần gọi Redis"""
+    values = cache.get_many(keys)
+    return {key: values.get(key, 0) for key in keys}
+
+
+def bump_generations(keys):
+    """
+    Tăng các bộ đếm bằng một pipeline INCR, sau khi transaction hiện tại commit
+    (tăng trước khi commit thì request đọc song song có thể cache lại dữ liệu cũ
+    dưới thế hệ mới). Không ở trong transaction thì tăng ngay.
+    """
+    keys = set(keys)
+    if keys:
+        transaction.on_commit(partial(_incr_generations, keys))
+
+
+def _incr_generations(keys):
+    pipeline = get_redis_connection("default").pipeline(transaction=False)
+    for key in keys:
+        pipeline.incr(cache.make_key(key))
+    pipeline.execute()
+
+
+def invalidate_catalog(
+    product_ids=(),
+    category_ids=None,
+    category_tree=False,
+    everything=False,
+    product_list=True,
+):
+    """
+    Vô hiệu hóa cache catalog cho các sản phẩm/danh mục thay đổi.
+    Nếu không truyền category_ids, danh mục được lấy từ product_ids.
+    product_list=False: không vô hiệu hóa danh sách không lọc (vd: chỉ đổi tồn kho).
+    """
+    from core.models import Product
+
+    if everything:
+        bump_generations([CATALOG_VERSION_KEY])
+        return
+
+    product_ids = set(product_ids)
+    if category_ids is None:
+        category_ids = Product.objects.filter(id__in=product_ids).values_list(
+            "category_id", flat=True
+        )
+    keys = [PRODUCT_KEY.format(product_id) for product_id in product_ids]
+    keys += [CATEGORY_KEY.format(category_id) for category_id in set(category_ids)]
+    if product_ids and product_list:
+        keys.append(CATALOG_PRODUCTS_KEY)
+    if category_tree:
+        keys.append(CATEGORY_TREE_KEY)
+    bump_generations(keys)
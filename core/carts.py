@@ -0,0 +1,130 @@
+import threading
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import (
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Sum,
+)
+
+from api.serializers import CartItemSerializer, CartSerializer
+from core.managers import effective_price_annotations
+from core.models import Cart, CartItem, Gallery, Product, Variant
+from core.tasks import run_in_background
+
+# Thời gian gom các thay đổi liên tiếp của một giỏ hàng trước khi gửi (giây)
+CART_PUSH_DELAY = 0.3
+
+_pending_lock = threading.Lock()
+_pending_changes = {}  # cart_id -> {cart_item_id: deleted}
+
+
+def cart_items_queryset():
+    """CartItem kèm sản phẩm (ảnh đại diện) và variant (giá sau giảm, ảnh)"""
+    product_queryset = Product.objects.annotate(
+        cover_image=Subquery(
+            Gallery.objects.filter(product=OuterRef("id"))
+            .order_by("order")
+            .values("image")[:1]  # Lấy ảnh đại diện đầu tiên
+        )
+    )
+    return CartItem.objects.prefetch_related(
+        Prefetch("product", queryset=product_queryset),
+        # Gộp luôn variant với giá, ảnh, stock
+        Prefetch("variant", queryset=Variant.objects.with_info_display()),
+    )
+
+
+def get_cart_with_items(**filters):
+    """Lấy giỏ hàng (vd: user=..., id=...) kèm toàn bộ sản phẩm trong giỏ"""
+    return (
+        Cart.objects.filter(**filters)
+        .prefetch_related(Prefetch("cart_items", queryset=cart_items_queryset()))
+        .annotate(total_items=Count("cart_items"))
+        .first()
+    )
+
+
+def get_cart_totals(cart_id):
+    """Tính tổng số sản phẩm và tổng tiền của giỏ hàng bằng một truy vấn"""
+    discount_price = effective_price_annotations("variant__")["discount_price"]
+    totals = CartItem.objects.filter(cart_id=cart_id).aggregate(
+        total_items=Count("id"),
+        total_price=Sum(
+            ExpressionWrapper(
+                F("quantity") * discount_price,
+                output_field=DecimalField(max_digits=14, decimal_places=0),
+            )
+        ),
+    )
+    return totals["total_items"], float(totals["total_price"] or 0)
+
+
+def queue_cart_update(cart_id, cart_item_id, deleted=False):
+    """Đăng ký gửi cập nhật giỏ hàng qua WebSocket sau khi transaction commit"""
+    transaction.on_commit(partial(_schedule_cart_update, cart_id, cart_item_id, deleted))
+
+
+def _schedule_cart_update(cart_id, cart_item_id, deleted):
+    with _pending_lock:
+        changes = _pending_changes.get(cart_id)
+        scheduled = changes is not None
+        if not scheduled:
+            changes = _pending_changes[cart_id] = {}
+        changes[cart_item_id] = deleted
+
+    if not scheduled:
+        # Chờ một khoảng ngắn để gom các thay đổi liên tiếp thành một lần gửi
+        timer = threading.Timer(
+            CART_PUSH_DELAY, run_in_background, args=(dispatch_cart_update, cart_id)
+        )
+        timer.daemon = True
+        timer.start()
+
+
+def _build_cart_delta(cart_id, cart_item_id, deleted):
+    item = None
+    if not deleted:
+        item = cart_items_queryset().filter(id=cart_item_id, cart_id=cart_id).first()
+    total_items, total_price = get_cart_totals(cart_id)
+    return {
+        "delta": True,
+        "item": CartItemSerializer(item).data if item else None,
+        "removed_item_id": None if item else cart_item_id,
+        "total_items": total_items,
+        "total_price": total_price,
+    }
+
+
+def dispatch_cart_update(cart_id):
+    """Gửi thay đổi (hoặc toàn bộ giỏ hàng) đã gom của một giỏ hàng qua WebSocket"""
+    with _pending_lock:
+        changes = _pending_changes.pop(cart_id, {})
+    if not changes:
+        return
+
+    user_id = Cart.objects.filter(id=cart_id).values_list("user_id", flat=True).first()
+    if not user_id:
+        return
+
+    if len(changes) == 1:
+        # Chỉ một sản phẩm thay đổi: gửi phần thay đổi kèm tổng tiền
+        cart_data = _build_cart_delta(cart_id, *next(iter(changes.items())))
+    else:
+        cart = get_cart_with_items(id=cart_id)
+        if not cart:
+            return
+        cart_data = CartSerializer(cart).data
+
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f"user_{user_id}_cart", {"type": "send_cart_update", "cart": cart_data}
+    )
@@ -0,0 +1,239 @@
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils.timezone import now
+from django_redis import get_redis_connection
+
+from core.models import ChatRoom, User
+from core.tasks import run_in_background
+
+# Hàng đợi phòng chat chờ tiếp nhận: sorted set {room_id: thời điểm vào hàng đợi}
+WAITING_ROOMS_KEY = "chat_dispatch_waiting"
+# Số phòng đang phụ trách của nhân viên: sorted set {user_id: số phòng}
+STAFF_LOAD_KEY = "chat_dispatch_load"
+# Lần cuối nhân viên báo trực tuyến: sorted set {user_id: timestamp}
+STAFF_SEEN_KEY = "chat_dispatch_seen"
+# Không báo trực tuyến quá PRESENCE_TIMEOUT giây thì xem như đã offline
+PRESENCE_TIMEOUT = 90
+# Số phòng tối đa một nhân viên phụ trách cùng lúc
+MAX_ACTIVE_ROOMS = 5
+
+# Lấy phòng chờ lâu nhất và giao cho nhân viên trực tuyến đang ít phòng nhất
+# trong một lệnh, hai dispatcher chạy song song không giao trùng phòng.
+ASSIGN_NEXT_ROOM = """
+local room = redis.call("zrange", KEYS[1], 0, 0)[1]
+if not room then
+    return nil
+end
+local agents = redis.call("zrange", KEYS[2], 0, -1, "WITHSCORES")
+local online_since = tonumber(ARGV[1]) - tonumber(ARGV[2])
+for index = 1, #agents, 2 do
+    if tonumber(agents[index + 1]) >= tonumber(ARGV[3]) then
+        return nil
+    end
+    local seen = redis.call("zscore", KEYS[3], agents[index])
+    if seen and tonumber(seen) >= online_since then
+        redis.call("zrem", KEYS[1], room)
+        redis.call("zincrby", KEYS[2], 1, agents[index])
+        return {room, agents[index]}
+    end
+end
+return nil
+"""
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def _keys():
+    return [
+        cache.make_key(WAITING_ROOMS_KEY),
+        cache.make_key(STAFF_LOAD_KEY),
+        cache.make_key(STAFF_SEEN_KEY),
+    ]
+
+
+def enqueue_room(room_id, created_at=None):
+    """Đưa phòng chat vào hàng đợi (giữ thời điểm vào hàng đợi nếu đã có)"""
+    timestamp = (created_at or now()).timestamp()
+    _redis().zadd(cache.make_key(WAITING_ROOMS_KEY), {room_id: timestamp}, nx=True)
+
+
+def dequeue_room(room_id):
+    _redis().zrem(cache.make_key(WAITING_ROOMS_KEY), room_id)
+
+
+def change_staff_load(user_id, amount):
+    if user_id and amount:
+        _redis().zincrby(cache.make_key(STAFF_LOAD_KEY), amount, user_id)
+
+
+def staff_online(user_id):
+    """Nhân viên báo trực tuyến (gọi định kỳ, nhỏ hơn PRESENCE_TIMEOUT)"""
+    waiting_key, load_key, seen_key = _keys()
+    pipeline = _redis().pipeline()
+    pipeline.zadd(load_key, {user_id: 0}, nx=True)
+    pipeline.zadd(seen_key, {user_id: time.time()})
+    pipeline.execute()
+
+
+def staff_offline(user_id):
+    # Giữ số phòng đang phụ trách, chỉ không nhận thêm phòng mới
+    _redis().zrem(cache.make_key(STAFF_SEEN_KEY), user_id)
+
+
+def claim_room(room_id, user_id):
+    """
+    Nhận phòng chat đang chờ cho nhân viên: chỉ thành công nếu phòng vẫn ở trạng thái
+    chờ (câu UPDATE có điều kiện), hai nhân viên không thể nhận cùng một phòng.
+    """
+    claimed = ChatRoom.objects.filter(id=room_id, status=ChatRoom.WAITING).update(
+        recipient_id=user_id, status=ChatRoom.ACTIVE, updated_at=now()
+    )
+    if claimed:
+        dequeue_room(room_id)
+        change_staff_load(user_id, 1)
+    return bool(claimed)
+
+
+def apply_room_change(room_id, created_at, old, new):
+    """
+    Cập nhật hàng đợi và số phòng của nhân viên khi phòng chat được tạo/sửa/xóa
+    (old, new: (trạng thái, recipient_id), None nếu phòng mới tạo/đã xóa).
+    Có phòng mới chờ hoặc nhân viên rảnh thêm thì chạy phân phối ở thread nền.
+    """
+    old_status, old_recipient = old or (None, None)
+    new_status, new_recipient = new or (None, None)
+    dispatch = False
+    if new_status == ChatRoom.WAITING and old_status != ChatRoom.WAITING:
+        enqueue_room(room_id, created_at)
+        dispatch = True
+    elif old_status == ChatRoom.WAITING and new_status != ChatRoom.WAITING:
+        dequeue_room(room_id)
+
+    old_holder = old_recipient if old_status == ChatRoom.ACTIVE else None
+    new_holder = new_recipient if new_status == ChatRoom.ACTIVE else None
+    if old_holder != new_holder:
+        change_staff_load(old_holder, -1)
+        change_staff_load(new_holder, 1)
+        dispatch = dispatch or old_holder is not None
+    if dispatch:
+        run_in_background(dispatch_rooms)
+
+
+def assign_next_room():
+    """Giao phòng chờ lâu nhất, trả về (phòng, user_id) hoặc None nếu không giao được"""
+    while True:
+        assigned = _redis().eval(
+            ASSIGN_NEXT_ROOM,
+            3,
+            *_keys(),
+            time.time(),
+            PRESENCE_TIMEOUT,
+            MAX_ACTIVE_ROOMS,
+        )
+        if not assigned:
+            return None
+        room_id, user_id = int(assigned[0]), int(assigned[1])
+        # Phòng đã được nhận/đóng bằng cách khác: hoàn lại số phòng và thử phòng tiếp theo
+        if not ChatRoom.objects.filter(id=room_id, status=ChatRoom.WAITING).update(
+            recipient_id=user_id, status=ChatRoom.ACTIVE, updated_at=now()
+        ):
+            change_staff_load(user_id, -1)
+            continue
+        chat_room = ChatRoom.objects.select_related("recipient").get(id=room_id)
+        send_assignment(chat_room)
+        return chat_room, user_id
+
+
+def dispatch_rooms():
+    """Giao các phòng đang chờ cho đến khi hết phòng hoặc hết nhân viên rảnh"""
+    assigned = []
+    while result := assign_next_room():
+        assigned.append(result)
+    return assigned
+
+
+def send_assignment(chat_room):
+    """Báo cho nhân viên được giao và cho phòng chat qua channel layer"""
+    data = {
+        "room_id": chat_room.id,
+        "room_name": chat_room.name,
+        "recipient": {
+            "id": chat_room.recipient.id,
+            "name": chat_room.recipient.full_name,
+        },
+    }
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f"chat_staff_{chat_room.recipient_id}",
+        {"type": "chat_assignment", "data": data},
+    )
+    async_to_sync(channel_layer.group_send)(
+        f"chat_{chat_room.name}", {"type": "chat_assignment", "data": data}
+    )
+
+
+def get_dispatch_stats():
+    """Độ dài hàng đợi, thời gian chờ và số phòng của các nhân viên trực tuyến"""
+    waiting_key, load_key, seen_key = _keys()
+    current = time.time()
+    pipeline = _redis().pipeline(transaction=False)
+    pipeline.zrange(waiting_key, 0, -1, withscores=True)
+    pipeline.zrange(load_key, 0, -1, withscores=True)
+    pipeline.zrangebyscore(seen_key, current - PRESENCE_TIMEOUT, "+inf")
+    waiting, loads, online = pipeline.execute()
+
+    wait_times = [current - enqueued_at for room_id, enqueued_at in waiting]
+    online = {int(user_id) for user_id in online}
+    staff = User.objects.in_bulk(online)
+    return {
+        "queue_depth": len(waiting),
+        "oldest_wait": round(max(wait_times), 1) if wait_times else 0,
+        "average_wait": (
+            round(sum(wait_times) / len(wait_times), 1) if wait_times else 0
+        ),
+        "online_staff": [
+            {
+                "id": int(user_id),
+                "name": staff[int(user_id)].full_name,
+                "active_rooms": int(load),
+            }
+            for user_id, load in loads
+            if int(user_id) in staff
+        ],
+    }
+
+
+def rebuild_dispatch_state():
+    """Tính lại hàng đợi và số phòng của nhân viên từ DB (giữ trạng thái trực tuyến)"""
+    waiting_key, load_key, seen_key = _keys()
+    waiting = {
+        room_id: created_at.timestamp()
+        for room_id, created_at in ChatRoom.objects.filter(
+            status=ChatRoom.WAITING
+        ).values_list("id", "created_at")
+    }
+    loads = dict(
+        ChatRoom.objects.filter(status=ChatRoom.ACTIVE, recipient__isnull=False)
+        .order_by()
+        .values("recipient_id")
+        .annotate(count=Count("id"))
+        .values_list("recipient_id", "count")
+    )
+    redis = _redis()
+    for user_id in redis.zrange(seen_key, 0, -1):
+        loads.setdefault(int(user_id), 0)
+
+    pipeline = redis.pipeline()
+    pipeline.delete(waiting_key, load_key)
+    if waiting:
+        pipeline.zadd(waiting_key, waiting)
+    if loads:
+        pipeline.zadd(load_key, loads)
+    pipeline.execute()
+    return len(waiting)
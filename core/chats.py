@@ -0,0 +1,258 @@
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import localtime, now
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from core.models import ChatMessage, ChatRoom, ChatUser
+
+CHAT_HISTORY_SIZE = 50
+MAX_CHAT_HISTORY_SIZE = 200
+
+# Tin nhắn mới được ghi vào Redis stream rồi flush_chat_messages ghi xuống DB theo lô.
+# Một consumer duy nhất đọc stream theo thứ tự nên thứ tự tin nhắn trong phòng được giữ,
+# tin nhắn chỉ bị xóa khỏi stream sau khi đã ghi xuống DB (at-least-once)
+CHAT_STREAM_KEY = "chat_message_stream"
+CHAT_STREAM_GROUP = "chat_message_flusher"
+CHAT_STREAM_CONSUMER = "flusher"
+# Bản sao tin nhắn chưa ghi DB theo từng phòng (cùng stream id), đọc lịch sử
+# chỉ cần đọc stream của phòng thay vì toàn bộ stream chung
+CHAT_ROOM_STREAM_KEY = "chat_message_stream_room_{}"
+
+# Ghi tin nhắn vào stream chung và stream của phòng với cùng id trong một lệnh
+BUFFER_MESSAGE = """
+local stream_id = redis.call("xadd", KEYS[1], "*", unpack(ARGV))
+redis.call("xadd", KEYS[2], stream_id, unpack(ARGV))
+return stream_id
+"""
+
+# Xóa các tin nhắn đã ghi DB khỏi stream của phòng, stream rỗng thì xóa key
+DELETE_ROOM_MESSAGES = """
+redis.call("xdel", KEYS[1], unpack(ARGV))
+if redis.call("xlen", KEYS[1]) == 0 then
+    redis.call("del", KEYS[1])
+end
+"""
+
+
+# Id dùng trong cursor trỏ tới tin nhắn còn trong stream (chưa có id): lấy mọi tin nhắn
+# trong DB có cùng thời điểm
+PENDING_CURSOR_ID = 2**63 - 1
+
+
+def encode_chat_cursor(message):
+    """Cursor (không cần hiểu nội dung) trỏ tới tin nhắn cũ nhất của cửa sổ"""
+    message_id = PENDING_CURSOR_ID if message.id is None else message.id
+    value = f"{message.created_at.isoformat()}|{message_id}"
+    return urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_chat_cursor(cursor):
+    """Trả về (created_at, id), None nếu cursor không hợp lệ"""
+    try:
+        created_at, message_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        created_at = parse_datetime(created_at)
+        return (created_at, int(message_id)) if created_at else None
+    except (TypeError, ValueError):
+        return None
+
+
+def get_chat_history(chat_room_id, before=None, size=CHAT_HISTORY_SIZE):
+    """
+    Lấy `size` tin nhắn gần nhất của phòng chat (cũ hơn cursor `before` nếu có),
+    đọc theo index (chat_room, created_at, id) thay cho OFFSET.
+    Tin nhắn còn trong stream được ghép vào trước khi cắt cửa sổ, cursor trỏ tới
+    tin nhắn cũ nhất thực sự được trả về nên không tin nhắn nào bị bỏ qua.
+    Trả về (danh sách tin nhắn theo thứ tự thời gian, cursor để tải tin cũ hơn).
+    """
+    # Đọc tin nhắn chưa ghi xuống DB trước, tin nào vừa được ghi thì bỏ bản trong stream
+    pending = pending_chat_messages(chat_room_id)
+    messages = ChatMessage.objects.filter(chat_room_id=chat_room_id)
+    if before:
+        created_at, message_id = before
+        messages = messages.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+        )
+        pending = [message for message in pending if message.created_at < created_at]
+    # Lấy dư một tin nhắn để biết còn tin cũ hơn không
+    messages = list(
+        messages.select_related("sender").order_by("-created_at", "-id")[: size + 1]
+    )
+    messages.reverse()
+    if pending:
+        saved = {message.stream_id for message in messages}
+        # sorted giữ thứ tự ổn định: tin nhắn trong DB đứng trước tin cùng thời điểm
+        messages = sorted(
+            messages
+            + [message for message in pending if message.stream_id not in saved],
+            key=lambda message: message.created_at,
+        )
+    next_cursor = None
+    if len(messages) > size:
+        messages = messages[-size:]
+        next_cursor = encode_chat_cursor(messages[0])
+    return messages, next_cursor
+
+
+def group_messages_by_date(messages):
+    """Gom các tin nhắn (đã sắp theo thời gian) theo ngày: {ngày: [tin nhắn]}"""
+    grouped_messages = {}
+    for message in messages:
+        message_date = localtime(message.created_at).date()
+        grouped_messages.setdefault(message_date, []).append(
+            {
+                "id": message.id,
+                "content": message.content,
+                "sender": {"id": message.sender.id, "name": message.sender.name},
+                "time": message.created_at,
+            }
+        )
+    return grouped_messages
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def _stream_key():
+    return cache.make_key(CHAT_STREAM_KEY)
+
+
+def _room_stream_key(chat_room_id):
+    return cache.make_key(CHAT_ROOM_STREAM_KEY.format(chat_room_id))
+
+
+def buffer_chat_message(chat_room_id, sender, content):
+    """
+    Nhận tin nhắn: ghi vào Redis stream (chưa ghi DB) và trả về tin nhắn để gửi
+    ngay cho phòng chat. Tin nhắn được flush_chat_messages ghi xuống DB theo lô.
+    """
+    created_at = now()
+    fields = {
+        "chat_room": chat_room_id,
+        "sender": sender.id,
+        "content": content,
+        "created_at": created_at.isoformat(),
+    }
+    stream_id = _redis().eval(
+        BUFFER_MESSAGE,
+        2,
+        _stream_key(),
+        _room_stream_key(chat_room_id),
+        *(value for field in fields.items() for value in field),
+    )
+    return ChatMessage(
+        chat_room_id=chat_room_id,
+        sender=sender,
+        content=content,
+        created_at=created_at,
+        stream_id=stream_id.decode(),
+    )
+
+
+def _message_from_entry(stream_id, fields):
+    fields = {key.decode(): value.decode() for key, value in fields.items()}
+    return ChatMessage(
+        chat_room_id=int(fields["chat_room"]),
+        sender_id=int(fields["sender"]),
+        content=fields["content"],
+        created_at=parse_datetime(fields["created_at"]),
+        stream_id=stream_id.decode(),
+    )
+
+
+def pending_chat_messages(chat_room_id):
+    """Tin nhắn của phòng chat còn trong stream (chưa được ghi xuống DB)"""
+    messages = [
+        _message_from_entry(stream_id, fields)
+        for stream_id, fields in _redis().xrange(_room_stream_key(chat_room_id))
+    ]
+    senders = ChatUser.objects.in_bulk({message.sender_id for message in messages})
+    for message in messages:
+        message.sender = senders.get(message.sender_id)
+    return [message for message in messages if message.sender]
+
+
+def _ensure_stream_group(redis):
+    try:
+        redis.xgroup_create(_stream_key(), CHAT_STREAM_GROUP, id="0", mkstream=True)
+    except ResponseError as error:
+        if "BUSYGROUP" not in str(error):
+            raise
+
+
+def read_chat_batch(batch_size=500, max_wait=1.0):
+    """
+    Đọc một lô tin nhắn từ stream: trả về khi đủ batch_size tin nhắn hoặc hết max_wait giây.
+    Tin nhắn đã đọc nhưng chưa xác nhận (flusher bị dừng giữa chừng) được đọc lại trước.
+    """
+    redis = _redis()
+    _ensure_stream_group(redis)
+    key = _stream_key()
+    entries = []
+    for _stream, stream_entries in redis.xreadgroup(
+        CHAT_STREAM_GROUP, CHAT_STREAM_CONSUMER, {key: "0"}, count=batch_size
+    ):
+        entries.extend(stream_entries)
+
+    deadline = time.monotonic() + max_wait
+    while len(entries) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        response = redis.xreadgroup(
+            CHAT_STREAM_GROUP,
+            CHAT_STREAM_CONSUMER,
+            {key: ">"},
+            count=batch_size - len(entries),
+            block=max(1, int(remaining * 1000)),
+        )
+        if not response:
+            break
+        for _stream, stream_entries in response:
+            entries.extend(stream_entries)
+    return entries
+
+
+def flush_chat_messages(batch_size=500, max_wait=1.0):
+    """Ghi một lô tin nhắn trong stream xuống DB bằng bulk_create, trả về số tin nhắn"""
+    entries = read_chat_batch(batch_size, max_wait)
+    if not entries:
+        return 0
+    messages = [_message_from_entry(stream_id, fields) for stream_id, fields in entries]
+    # Bỏ tin nhắn của phòng chat/người gửi đã bị xóa (nếu không cả lô sẽ lỗi mãi)
+    room_ids = set(
+        ChatRoom.objects.filter(
+            id__in={message.chat_room_id for message in messages}
+        ).values_list("id", flat=True)
+    )
+    sender_ids = set(
+        ChatUser.objects.filter(
+            id__in={message.sender_id for message in messages}
+        ).values_list("id", flat=True)
+    )
+    # bulk_create theo thứ tự stream nên id tăng dần theo thứ tự nhận tin nhắn;
+    # tin nhắn đã được ghi ở lần flush trước (trùng stream_id) thì bỏ qua
+    ChatMessage.objects.bulk_create(
+        [
+            message
+            for message in messages
+            if message.chat_room_id in room_ids and message.sender_id in sender_ids
+        ],
+        ignore_conflicts=True,
+    )
+    stream_ids = [stream_id for stream_id, fields in entries]
+    room_stream_ids = {}
+    for message in messages:
+        room_stream_ids.setdefault(message.chat_room_id, []).append(message.stream_id)
+    pipeline = _redis().pipeline()
+    pipeline.xack(_stream_key(), CHAT_STREAM_GROUP, *stream_ids)
+    pipeline.xdel(_stream_key(), *stream_ids)
+    for chat_room_id, ids in room_stream_ids.items():
+        pipeline.eval(DELETE_ROOM_MESSAGES, 1, _room_stream_key(chat_room_id), *ids)
+    pipeline.execute()
+    return len(entries)
@@ -0,0 +1,66 @@
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.models import Comment
+
+# Số tầng trả lời được tải kèm bình luận (mặc định và tối đa)
+COMMENT_TREE_DEPTH = 3
+MAX_COMMENT_TREE_DEPTH = 10
+
+
+def load_comment_trees(comments, max_depth=COMMENT_TREE_DEPTH):
+    """
+    Gắn loaded_replies (cây trả lời tới max_depth tầng) cho các bình luận.
+    Toàn bộ bình luận con được tải bằng một truy vấn theo root, user đi kèm
+    bằng select_related, cây được dựng trong bộ nhớ.
+    """
+    comments = list(comments)
+    if not comments:
+        return comments
+
+    root_ids = {comment.root_id or comment.id for comment in comments}
+    max_level = max(comment.depth for comment in comments) + max_depth
+    descendants = (
+        Comment.objects.filter(root_id__in=root_ids, depth__lte=max_level)
+        .select_related("user")
+        .order_by("-created_at", "-id")
+    )
+
+    children = {}
+    for comment in descendants:
+        children.setdefault(comment.parent_id, []).append(comment)
+
+    def attach(comment, level):
+        if level >= max_depth:
+            comment.loaded_replies = []
+            return
+        comment.loaded_replies = children.get(comment.id, [])
+        for reply in comment.loaded_replies:
+            attach(reply, level + 1)
+
+    for comment in comments:
+        attach(comment, 0)
+    return comments
+
+
+def rebuild_comment_tree():
+    """
+    Tính lại root và depth của toàn bộ bình luận.
+    Mỗi vòng cập nhật các bình luận con của tầng trước bằng một câu UPDATE,
+    bình luận ở tầng k được cập nhật lần cuối ở vòng k (khi root của cha đã đúng).
+    """
+    Comment.objects.update(root=None, depth=0)
+    depth = 0
+    while True:
+        depth += 1
+        updated = Comment.objects.filter(parent__depth=depth - 1).update(
+            depth=depth,
+            root_id=Coalesce(
+                Subquery(
+                    Comment.objects.filter(id=OuterRef("parent_id")).values("root_id")
+                ),
+                F("parent_id"),
+            ),
+        )
+        if not updated:
+            return Comment.objects.count()
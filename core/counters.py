@@ -0,0 +1,124 @@
+from django.core.cache import cache
+from django.db import connection, transaction
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+from core.models import Product
+
+FLUSH_CHUNK_SIZE = 1000
+# Thời gian giữ khóa tối đa của một lần ghi (tiến trình bị dừng giữa chừng thì khóa tự hết hạn)
+FLUSH_LOCK_TIMEOUT = 60 * 5
+
+
+class CounterBuffer:
+    """
+    Bộ đếm ghi trễ: lượt tăng được cộng dồn trong một hash Redis (HINCRBY theo id)
+    và ghi xuống cột `field` theo lô, tránh UPDATE từng dòng trên các bản ghi nóng.
+    """
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self.name = f"counter_{model._meta.label_lower}_{field}"
+
+    @property
+    def key(self):
+        return cache.make_key(self.name)
+
+    @property
+    def flushing_key(self):
+        return f"{self.key}_flushing"
+
+    def _redis(self):
+        return get_redis_connection("default")
+
+    def incr(self, pk, amount=1):
+        self.incr_many([pk], amount)
+
+    def incr_many(self, pks, amount=1):
+        pks = [pk for pk in pks if pk]
+        if not pks or not amount:
+            return
+        pipeline = self._redis().pipeline(transaction=False)
+        for pk in pks:
+            pipeline.hincrby(self.key, pk, amount)
+        pipeline.execute()
+
+    def pending(self, pks):
+        """Lượt tăng chưa ghi xuống DB của các id (gồm cả lô đang ghi)"""
+        pks = list(pks)
+        if not pks:
+            return {}
+        pipeline = self._redis().pipeline(transaction=False)
+        pipeline.hmget(self.key, pks)
+        pipeline.hmget(self.flushing_key, pks)
+        counts, flushing_counts = pipeline.execute()
+        return {
+            pk: int(count or 0) + int(flushing_count or 0)
+            for pk, count, flushing_count in zip(pks, counts, flushing_counts)
+        }
+
+    def flush(self):
+        """Ghi các lượt tăng đã gom xuống DB, trả về số bản ghi được cập nhật"""
+        redis = self._redis()
+        # Chỉ một tiến trình được ghi lô đang ghi, tránh cộng một lô hai lần
+        lock = redis.lock(f"{self.key}_lock", timeout=FLUSH_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            return 0
+        try:
+            # Đổi tên key để các lượt mới được gom vào key mới trong lúc ghi.
+            # Lô đang ghi còn sót lại (lần trước bị lỗi) thì ghi nốt trước
+            if not redis.exists(self.flushing_key):
+                if not redis.exists(self.key):
+                    return 0
+                redis.rename(self.key, self.flushing_key)
+
+            counts = {
+                int(pk): int(count)
+                for pk, count in redis.hgetall(self.flushing_key).items()
+                if int(count)
+            }
+            # Bỏ các id không tồn tại (API lượt xem không cần đăng nhập)
+            counts = [
+                (pk, counts[pk])
+                for pk in self.model.objects.filter(pk__in=counts).values_list(
+                    "pk", flat=True
+                )
+            ]
+            with transaction.atomic():
+                for start in range(0, len(counts), FLUSH_CHUNK_SIZE):
+                    self._apply(counts[start : start + FLUSH_CHUNK_SIZE])
+            redis.delete(self.flushing_key)
+            return len(counts)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # Khóa đã hết hạn trong lúc ghi
+                pass
+
+    def _apply(self, counts):
+        # Một câu UPDATE ... FROM (VALUES ...) cho cả lô
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        column = quote_name(self.model._meta.get_field(self.field).column)
+        pk_column = quote_name(self.model._meta.pk.column)
+        values = ", ".join(["(%s, %s)"] * len(counts))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET {column} = {table}.{column} + counts.amount "
+                f"FROM (VALUES {values}) AS counts(id, amount) "
+                f"WHERE {table}.{pk_column} = counts.id",
+                [value for row in counts for value in row],
+            )
+
+
+product_view_counter = CounterBuffer(Product, "view_count")
+product_search_counter = CounterBuffer(Product, "search_count")
+
+COUNTERS = [product_view_counter, product_search_counter]
+
+
+def flush_counters():
+    """Ghi tất cả bộ đếm, trả về {tên bộ đếm: số bản ghi}"""
+    return {counter.name: counter.flush() for counter in COUNTERS}
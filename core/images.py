@@ -0,0 +1,143 @@
+import logging
+import os
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+from django_redis import get_redis_connection
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# {tên kích thước: cạnh dài tối đa (px)}
+IMAGE_SIZES = {"thumb": 128, "card": 400, "detail": 1024}
+# {định dạng: (phần mở rộng, tham số lưu của Pillow)}
+IMAGE_FORMATS = {
+    "webp": ("webp", {"format": "WEBP", "quality": 80, "method": 4}),
+    "jpeg": ("jpg", {"format": "JPEG", "quality": 82, "optimize": True}),
+}
+DERIVATIVE_QUEUE_KEY = "image_derivative_queue"
+
+
+def derivative_name(name, size, image_format):
+    """Tên file ảnh phái sinh nằm cạnh ảnh gốc, vd: a/b.png -> a/b.card.webp"""
+    extension = IMAGE_FORMATS[image_format][0]
+    return f"{os.path.splitext(name)[0]}.{size}.{extension}"
+
+
+def derivative_names(name):
+    return [
+        derivative_name(name, size, image_format)
+        for size in IMAGE_SIZES
+        for image_format in IMAGE_FORMATS
+    ]
+
+
+def image_srcset(name):
+    """
+    Đường dẫn các kích thước của ảnh: {kích thước: {"width", "webp", "jpeg"}}.
+    Tên được tính trực tiếp (không kiểm tra file), ảnh mới tải lên có thể chưa
+    được tạo xong nên client nên fallback về ảnh gốc.
+    """
+    if not name:
+        return {}
+    return {
+        size: {
+            "width": width,
+            **{
+                image_format: default_storage.url(
+                    derivative_name(name, size, image_format)
+                )
+                for image_format in IMAGE_FORMATS
+            },
+        }
+        for size, width in IMAGE_SIZES.items()
+    }
+
+
+def preview_image_tag(name, size=64):
+    """Thẻ <img> xem trước trong admin: dùng ảnh thumb, chưa có thì dùng ảnh gốc"""
+    return format_html(
+        '<img src="{}" onerror="this.onerror=null;this.src=\'{}\'" '
+        'width="{}" height="{}" />',
+        default_storage.url(derivative_name(name, "thumb", "webp")),
+        default_storage.url(name),
+        size,
+        size,
+    )
+
+
+def generate_derivatives(name):
+    """
+    Tạo các ảnh phái sinh (mọi kích thước, WebP và JPEG) cho ảnh `name`.
+    Bỏ qua các file đã tạo sau lần sửa ảnh gốc, trả về số file được tạo.
+    """
+    if not name or not default_storage.exists(name):
+        return 0
+    source = default_storage.path(name)
+    source_mtime = os.path.getmtime(source)
+    created = 0
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        for size, width in IMAGE_SIZES.items():
+            image = None
+            for image_format, (extension, options) in IMAGE_FORMATS.items():
+                target = default_storage.path(derivative_name(name, size, image_format))
+                if os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+                    continue
+                if image is None:
+                    image = original.copy()
+                    if image.mode not in ("RGB", "RGBA"):
+                        image = image.convert("RGBA")
+                    image.thumbnail((width, width), Image.LANCZOS)
+                # JPEG không có kênh alpha: đặt ảnh lên nền trắng
+                output = image
+                if image_format == "jpeg" and image.mode == "RGBA":
+                    output = Image.new("RGB", image.size, (255, 255, 255))
+                    output.paste(image, mask=image.getchannel("A"))
+                # Ghi ra file tạm rồi đổi tên để không ai đọc phải file ghi dở
+                tmp_target = f"{target}.tmp{os.getpid()}"
+                output.save(tmp_target, **options)
+                os.replace(tmp_target, target)
+                created += 1
+    return created
+
+
+def delete_derivatives(name):
+    for derivative in derivative_names(name or ""):
+        if default_storage.exists(derivative):
+            default_storage.delete(derivative)
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def queue_image_derivatives(*names):
+    """Đưa ảnh vào hàng đợi tạo ảnh phái sinh (xử lý bởi generate_image_derivatives)"""
+    names = [name for name in names if name]
+    if names:
+        _redis().rpush(cache.make_key(DERIVATIVE_QUEUE_KEY), *names)
+
+
+def pop_image_derivatives(count, timeout=1):
+    """Lấy tối đa `count` ảnh trong hàng đợi, chờ tối đa `timeout` giây nếu đang rỗng"""
+    key = cache.make_key(DERIVATIVE_QUEUE_KEY)
+    redis = _redis()
+    item = redis.blpop(key, timeout=timeout)
+    if item is None:
+        return []
+    names = [item[1]]
+    if count > 1:
+        names += redis.lpop(key, count - 1) or []
+    # Bỏ ảnh trùng trong cùng lô
+    return list(dict.fromkeys(name.decode() for name in names))
+
+
+def process_image(name):
+    """Tạo ảnh phái sinh, lỗi của một ảnh không làm dừng worker"""
+    try:
+        return generate_derivatives(name)
+    except Exception:
+        logger.exception("Không tạo được ảnh phái sinh cho %s", name)
+        return 0
@@ -0,0 +1,249 @@
+import unicodedata
+from itertools import islice
+
+import xlrd
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils.text import slugify
+from django.utils.timezone import now
+from django.utils.translation import gettext as _
+from openpyxl import load_workbook
+
+from core.cache import invalidate_catalog
+from core.models import Category, ImportJob, generate_random_string
+
+IMPORT_CHUNK_SIZE = 500
+IMPORT_PROGRESS_KEY = "import_job_{}_progress"
+
+
+def open_sheet(path):
+    """
+    Mở sheet đầu tiên, trả về (số dòng ước tính, iterator các dòng).
+    File .xlsx được đọc từng dòng (read_only), không nạp cả file vào bộ nhớ.
+    """
+    if path.endswith(".xlsx"):
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        worksheet = workbook.worksheets[0]
+
+        def rows():
+            try:
+                yield from worksheet.iter_rows(values_only=True)
+            finally:
+                workbook.close()
+
+        return worksheet.max_row or 0, rows()
+
+    # .xls không hỗ trợ đọc từng dòng, on_demand chỉ nạp sheet cần dùng
+    workbook = xlrd.open_workbook(path, on_demand=True)
+    sheet = workbook.sheet_by_index(0)
+
+    def rows():
+        try:
+            for index in range(sheet.nrows):
+                yield tuple(sheet.row_values(index))
+        finally:
+            workbook.release_resources()
+
+    return sheet.nrows, rows()
+
+
+def assign_unique_slugs(instances):
+    """Tạo slug không trùng cho nhiều bản ghi mới, mỗi vòng kiểm tra bằng một truy vấn"""
+    if not instances:
+        return
+    model = instances[0].__class__
+    max_length = model._meta.get_field("slug").max_length
+    pending = [
+        (instance, slugify(instance.name)[:max_length]) for instance in instances
+    ]
+    used = set()
+    while pending:
+        taken = used | set(
+            model.objects.filter(
+                slug__in={slug for instance, slug in pending}
+            ).values_list("slug", flat=True)
+        )
+        retry = []
+        for instance, slug in pending:
+            # Kiểm tra cả slug đã gán trong vòng này (hai tên cùng một slug)
+            if slug in taken or slug in used:
+                # Trùng slug: thêm chuỗi ngẫu nhiên như generate_unique_slug
+                base_slug = slugify(instance.name)[: max_length - 5]
+                retry.append((instance, f"{base_slug}-{generate_random_string(4)}"))
+            else:
+                instance.slug = slug
+                used.add(slug)
+        pending = retry
+
+
+class BaseImporter:
+    """
+    Nhập dữ liệu từ sheet trong một lượt: đọc từng dòng, kiểm tra và ghi theo chunk.
+    Có lỗi ở bất kỳ dòng nào thì toàn bộ thay đổi bị hủy (giống dry run trước đây).
+    """
+
+    # {tiêu đề cột: tên field}
+    columns = {}
+
+    def __init__(self, job):
+        self.job = job
+        self.errors = {}
+        self.created_count = 0
+        self.updated_count = 0
+
+    def parse_row(self, row_number, values):
+        """Trả về dict dữ liệu đã chuẩn hóa, hoặc None nếu dòng có lỗi"""
+        raise NotImplementedError
+
+    def import_chunk(self, rows):
+        raise NotImplementedError
+
+    def after_import(self):
+        pass
+
+    def add_error(self, row_number, message):
+        self.errors.setdefault(f"row_{row_number}", []).append(str(message))
+
+    def run(self):
+        total_rows, rows = open_sheet(self.job.file.path)
+        ImportJob.objects.filter(id=self.job.id).update(
+            status="running", total_rows=max(total_rows - 1, 0)
+        )
+        progress_key = IMPORT_PROGRESS_KEY.format(self.job.id)
+
+        header = next(rows, None) or ()
+        indexes = {
+            field: index
+            for index, title in enumerate(header)
+            for column, field in self.columns.items()
+            if str(title or "").strip() == column
+        }
+        missing_columns = [
+            column for column, field in self.columns.items() if field not in indexes
+        ]
+        if missing_columns:
+            self.add_error(1, _("Thiếu cột: %s") % ", ".join(missing_columns))
+            return False
+
+        processed_rows = 0
+        # Dòng 1 là tiêu đề, dữ liệu bắt đầu từ dòng 2
+        numbered_rows = enumerate(rows, start=2)
+        with transaction.atomic():
+            while chunk := list(islice(numbered_rows, IMPORT_CHUNK_SIZE)):
+                parsed_rows = []
+                for row_number, row in chunk:
+                    if not any(value not in (None, "") for value in row):
+                        continue  # Bỏ qua dòng trống
+                    values = {
+                        field: row[index] if index < len(row) else None
+                        for field, index in indexes.items()
+                    }
+                    data = self.parse_row(row_number, values)
+                    if data is not None:
+                        parsed_rows.append(data)
+
+                # Đã có lỗi thì chỉ kiểm tra các dòng còn lại, không ghi nữa
+                if not self.errors:
+                    self.import_chunk(parsed_rows)
+                processed_rows += len(chunk)
+                # Transaction chưa commit nên tiến độ được lưu vào cache
+                cache.set(progress_key, processed_rows, timeout=60 * 60)
+
+            if self.errors:
+                transaction.set_rollback(True)
+                return False
+            transaction.on_commit(self.after_import)
+        return True
+
+
+class CategoryImporter(BaseImporter):
+    # Cùng cột với CategoryResource/CategoryExporter
+    columns = {"Tên Danh Mục": "name", "Kích Hoạt": "is_active"}
+
+    def __init__(self, job):
+        super().__init__(job)
+        self.category_ids = set()
+
+    def parse_row(self, row_number, values):
+        name = unicodedata.normalize("NFC", str(values["name"] or "").strip())
+        if not name:
+            self.add_error(row_number, _("Tên danh mục không được để trống."))
+        elif len(name) > Category._meta.get_field("name").max_length:
+            self.add_error(row_number, _("Tên danh mục quá dài."))
+
+        is_active = values["is_active"]
+        if is_active in (None, ""):
+            is_active = True
+        elif str(is_active).strip().lower() in ("1", "1.0", "true"):
+            is_active = True
+        elif str(is_active).strip().lower() in ("0", "0.0", "false"):
+            is_active = False
+        else:
+            self.add_error(row_number, _("Kích hoạt phải là 1 hoặc 0."))
+
+        if f"row_{row_number}" in self.errors:
+            return None
+        return {"name": name, "is_active": is_active}
+
+    def import_chunk(self, rows):
+        # Tên trùng trong cùng chunk: dòng sau ghi đè dòng trước
+        rows = {row["name"].lower(): row for row in rows}
+        # Danh mục cha không được trùng tên (không phân biệt hoa thường)
+        existing = {
+            category.name_lower: category
+            for category in Category.objects.filter(parent__isnull=True)
+            .annotate(name_lower=Lower("name"))
+            .filter(name_lower__in=rows)
+        }
+
+        to_create, to_update = [], []
+        for name_lower, row in rows.items():
+            category = existing.get(name_lower)
+            if category is None:
+                to_create.append(Category(name=row["name"], is_active=row["is_active"]))
+            elif category.is_active != row["is_active"]:
+                category.is_active = row["is_active"]
+                category.updated_at = now()  # bulk_update không tự cập nhật auto_now
+                to_update.append(category)
+
+        assign_unique_slugs(to_create)
+        Category.objects.bulk_create(to_create)
+        Category.objects.bulk_update(to_update, ["is_active", "updated_at"])
+
+        self.created_count += len(to_create)
+        self.updated_count += len(to_update)
+        self.category_ids.update(category.id for category in to_create + to_update)
+
+    def after_import(self):
+        # bulk_create/bulk_update không gửi signal nên xóa cache danh mục tại đây
+        cache.delete("category_list")
+        invalidate_catalog(category_ids=self.category_ids, category_tree=True)
+
+
+IMPORTERS = {
+    "category": CategoryImporter,
+}
+
+
+def run_import_job(job_id):
+    """Chạy tiến trình nhập dữ liệu (trong thread nền)"""
+    job = ImportJob.objects.get(id=job_id)
+    importer = IMPORTERS[job.kind](job)
+    try:
+        success = importer.run()
+    except Exception as error:
+        importer.add_error(0, error)
+        success = False
+        raise
+    finally:
+        ImportJob.objects.filter(id=job.id).update(
+            status="success" if success else "failed",
+            processed_rows=cache.get(IMPORT_PROGRESS_KEY.format(job.id), 0),
+            created_count=importer.created_count if success else 0,
+            updated_count=importer.updated_count if success else 0,
+            errors=importer.errors,
+            finished_at=now(),
+        )
+        cache.delete(IMPORT_PROGRESS_KEY.format(job.id))
+        job.file.delete(save=False)
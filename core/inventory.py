@@ -0,0 +1,89 @@
+from django.db.models import Case, DecimalField, F, IntegerField, Value, When
+
+from core.listing import refresh_listing_summaries
+from core.models import StockSetting, Variant
+from core.pricing import refresh_variant_prices
+
+STOCK_SETTING_FIELDS = ["safety_stock_threshold", "reminder_enabled"]
+
+
+def apply_stock_updates(updates):
+    """
+    Cập nhật giá, cộng tồn kho và cấu hình cảnh báo kho cho nhiều variant.
+    updates: {variant_id: {"price", "add_stock", "stock_setting"}} (variant đã kiểm tra tồn tại).
+    Mỗi bảng chỉ cần một câu lệnh, không phụ thuộc số lượng variant.
+    """
+    if not updates:
+        return
+
+    prices = {
+        variant_id: data["price"]
+        for variant_id, data in updates.items()
+        if data.get("price") is not None
+    }
+    add_stocks = {
+        variant_id: data["add_stock"]
+        for variant_id, data in updates.items()
+        if data.get("add_stock")
+    }
+
+    changes = {}
+    if prices:
+        changes["price"] = Case(
+            *(
+                When(id=variant_id, then=Value(price))
+                for variant_id, price in prices.items()
+            ),
+            default=F("price"),
+            output_field=DecimalField(max_digits=12, decimal_places=0),
+        )
+    if add_stocks:
+        changes["stock"] = F("stock") + Case(
+            *(
+                When(id=variant_id, then=Value(add_stock))
+                for variant_id, add_stock in add_stocks.items()
+            ),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    if changes:
+        Variant.objects.filter(id__in=prices.keys() | add_stocks.keys()).update(
+            **changes
+        )
+
+    _upsert_stock_settings(updates)
+
+    # update() không gửi signal: tính lại giá hiệu lực (đã gồm tổng tồn kho hiển thị)
+    if prices:
+        refresh_variant_prices(prices.keys())
+    if add_stocks.keys() - prices.keys():
+        refresh_listing_summaries(
+            Variant.objects.filter(id__in=add_stocks.keys() - prices.keys())
+            .values_list("product_id", flat=True)
+            .distinct()
+        )
+
+
+def _upsert_stock_settings(updates):
+    # Gom theo tập trường được gửi lên để mỗi nhóm là một câu upsert
+    groups = {}
+    for variant_id, data in updates.items():
+        stock_setting_data = data.get("stock_setting") or {}
+        fields = tuple(
+            field for field in STOCK_SETTING_FIELDS if field in stock_setting_data
+        )
+        groups.setdefault(fields, []).append(
+            StockSetting(variant_id=variant_id, **stock_setting_data)
+        )
+
+    for fields, stock_settings in groups.items():
+        if fields:
+            StockSetting.objects.bulk_create(
+                stock_settings,
+                update_conflicts=True,
+                unique_fields=["variant"],
+                update_fields=list(fields),
+            )
+        else:
+            # Không có dữ liệu cấu hình: chỉ tạo nếu chưa có (như get_or_create)
+            StockSetting.objects.bulk_create(stock_settings, ignore_conflicts=True)
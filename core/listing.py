@@ -0,0 +1,99 @@
+from django.db.models import Sum
+
+from core.cache import invalidate_catalog
+from core.models import (
+    Gallery,
+    Product,
+    ProductListingSummary,
+    ProductRatingStats,
+    Variant,
+)
+
+REFRESH_CHUNK_SIZE = 500
+
+LISTING_SUMMARY_UPDATE_FIELDS = [
+    "variant",
+    "price",
+    "discount_price",
+    "discount",
+    "cover_image",
+    "rating_star",
+    "total_stock",
+    "updated_at",
+]
+
+
+def _refresh_chunk(product_ids):
+    # Variant rẻ nhất sau khuyến mãi của mỗi sản phẩm
+    cheapest_variants = {
+        variant["product_id"]: variant
+        for variant in Variant.objects.filter(product_id__in=product_ids)
+        .with_effective_price()
+        .order_by("product_id", "discount_price", "id")
+        .distinct("product_id")
+        .values("id", "product_id", "price", "discount_price", "discount")
+    }
+    total_stocks = dict(
+        Variant.objects.filter(product_id__in=product_ids)
+        .order_by()
+        .values("product_id")
+        .annotate(total_stock=Sum("stock"))
+        .values_list("product_id", "total_stock")
+    )
+    cover_images = dict(
+        Gallery.objects.filter(product_id__in=product_ids)
+        .order_by("product_id", "order", "id")
+        .distinct("product_id")
+        .values_list("product_id", "image")
+    )
+    # Điểm trung bình đọc từ thống kê đánh giá đã tính sẵn
+    rating_stars = {
+        stats.product_id: stats.average_score
+        for stats in ProductRatingStats.objects.filter(product_id__in=product_ids)
+    }
+
+    summaries = []
+    for product_id in product_ids:
+        variant = cheapest_variants.get(product_id, {})
+        summaries.append(
+            ProductListingSummary(
+                product_id=product_id,
+                variant_id=variant.get("id"),
+                price=variant.get("price"),
+                discount_price=variant.get("discount_price"),
+                discount=variant.get("discount") or 0,
+                cover_image=cover_images.get(product_id),
+                rating_star=rating_stars.get(product_id),
+                total_stock=total_stocks.get(product_id) or 0,
+            )
+        )
+    ProductListingSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=["product"],
+        update_fields=LISTING_SUMMARY_UPDATE_FIELDS,
+    )
+
+
+def refresh_listing_summaries(product_ids=None, product_list=True):
+    """
+    Tính lại dữ liệu hiển thị danh sách cho các sản phẩm (None = toàn bộ)
+    và vô hiệu hóa cache catalog tương ứng (xem invalidate_catalog).
+    """
+    full_rebuild = product_ids is None
+    products = Product.objects.order_by("id")
+    if not full_rebuild:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        products = products.filter(id__in=product_ids)
+
+    # Chỉ lấy các sản phẩm còn tồn tại (có thể đã bị xóa cùng variant/ảnh)
+    product_ids = list(products.values_list("id", flat=True))
+    for start in range(0, len(product_ids), REFRESH_CHUNK_SIZE):
+        _refresh_chunk(product_ids[start : start + REFRESH_CHUNK_SIZE])
+
+    if full_rebuild:
+        invalidate_catalog(everything=True)
+    else:
+        invalidate_catalog(product_ids=product_ids, product_list=product_list)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.models import AttributeValue, Gallery
+from core.snapshots import create_snapshot, is_default_image
+
+
+class Command(BaseCommand):
+    help = "Tạo snapshot cho các ảnh Gallery/AttributeValue chưa có snapshot."
+
+    def handle(self, *args, **options):
+        created = 0
+        for model in (Gallery, AttributeValue):
+            names = (
+                model.objects.filter(snapshot__isnull=True)
+                .exclude(image="")
+                .values_list("image", flat=True)
+                .distinct()
+            )
+            for name in names.iterator():
+                if not is_default_image(name) and create_snapshot(name):
+                    created += 1
+        self.stdout.write(self.style.SUCCESS(f"Đã tạo snapshot cho {created} ảnh."))
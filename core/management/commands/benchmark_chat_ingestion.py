@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from core.models import ChatMessage, ChatRoom, ChatUser
+
+
+class Command(BaseCommand):
+    help = (
+        "So sánh tốc độ ghi tin nhắn chat: insert từng tin nhắn (mỗi tin một "
+        "transaction) và bulk_create theo lô. Dữ liệu thử được xóa sau khi chạy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2000)
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = options["messages"]
+        batch_size = options["batch_size"]
+        sender = ChatUser.objects.create(name="benchmark")
+        chat_room = ChatRoom.objects.create(created_by=sender)
+        try:
+            started = time.perf_counter()
+            for index in range(count):
+                ChatMessage.objects.create(
+                    chat_room=chat_room, sender=sender, content=f"single {index}"
+                )
+            single_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for start in range(0, count, batch_size):
+                ChatMessage.objects.bulk_create(
+                    ChatMessage(
+                        chat_room=chat_room,
+                        sender=sender,
+                        content=f"batch {index}",
+                        created_at=now(),
+                    )
+                    for index in range(start, min(start + batch_size, count))
+                )
+            batch_seconds = time.perf_counter() - started
+        finally:
+            chat_room.delete()
+            sender.delete()
+
+        self.stdout.write(
+            f"Từng tin nhắn: {count / single_seconds:,.0f} tin/giây "
+            f"({single_seconds:.2f}s)"
+        )
+        self.stdout.write(
+            f"Theo lô {batch_size}: {count / batch_seconds:,.0f} tin/giây "
+            f"({batch_seconds:.2f}s)"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Nhanh hơn {single_seconds / batch_seconds:.1f} lần.")
+        )
@@ -0,0 +1,52 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.chat_dispatch import dispatch_rooms, rebuild_dispatch_state
+
+
+class Command(BaseCommand):
+    help = (
+        "Giao các phòng chat đang chờ cho nhân viên trực tuyến ít phòng nhất. "
+        "Chạy định kỳ để giao các phòng còn chờ khi nhân viên rảnh hoặc trực tuyến trở lại."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Tính lại hàng đợi và số phòng của nhân viên từ DB trước khi chạy.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5.0,
+            help="Số giây giữa hai lần phân phối.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Phân phối một lần rồi thoát (mặc định chạy liên tục).",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            waiting = rebuild_dispatch_state()
+            self.stdout.write(f"Đã tính lại hàng đợi: {waiting} phòng đang chờ.")
+
+        running = True
+
+        def stop(signum, frame):
+            nonlocal running
+            running = False
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        while running:
+            assigned = dispatch_rooms()
+            for chat_room, user_id in assigned:
+                self.stdout.write(f"Phòng {chat_room.name} -> nhân viên {user_id}")
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
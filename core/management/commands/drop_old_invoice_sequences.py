@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.models import drop_old_invoice_sequences
+
+
+class Command(BaseCommand):
+    help = (
+        "Xóa sequence mã đơn hàng của các ngày cũ. "
+        "Chạy định kỳ (vd: mỗi ngày qua cron), không chạy trong request tạo đơn hàng."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=1,
+            help="Số ngày trước hôm nay được giữ lại sequence.",
+        )
+
+    def handle(self, *args, **options):
+        dropped = drop_old_invoice_sequences(keep_days=options["keep_days"])
+        self.stdout.write(self.style.SUCCESS(f"Đã xóa {dropped} sequence."))
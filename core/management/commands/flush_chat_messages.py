@@ -0,0 +1,47 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.chats import flush_chat_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Ghi các tin nhắn chat đang chờ trong Redis stream xuống cơ sở dữ liệu theo lô "
+        "(đủ --batch-size tin nhắn hoặc sau --max-wait giây). Chỉ chạy một tiến trình."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Số tin nhắn tối đa mỗi lần ghi.",
+        )
+        parser.add_argument(
+            "--max-wait",
+            type=float,
+            default=1.0,
+            help="Số giây chờ gom tin nhắn trước khi ghi.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Ghi một lô rồi thoát (mặc định chạy liên tục).",
+        )
+
+    def handle(self, *args, **options):
+        running = True
+
+        def stop(signum, frame):
+            nonlocal running
+            running = False
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        while running:
+            flushed = flush_chat_messages(options["batch_size"], options["max_wait"])
+            if flushed:
+                self.stdout.write(f"Đã ghi {flushed} tin nhắn.")
+            if options["once"]:
+                break
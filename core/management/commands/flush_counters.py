@@ -0,0 +1,50 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.counters import flush_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Ghi các bộ đếm (lượt xem, lượt tìm kiếm) đang gom trong Redis xuống "
+        "cơ sở dữ liệu. Dùng --interval để chạy liên tục."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Số giây giữa hai lần ghi (0 = ghi một lần rồi thoát).",
+        )
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        if not interval:
+            self.flush()
+            return
+
+        running = True
+
+        def stop(signum, frame):
+            nonlocal running
+            running = False
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        while running:
+            self.flush()
+            # Ngủ từng giây để dừng kịp khi nhận tín hiệu
+            for _ in range(interval):
+                if not running:
+                    break
+                time.sleep(1)
+        # Ghi lần cuối trước khi thoát
+        self.flush()
+
+    def flush(self):
+        for name, updated in flush_counters().items():
+            if updated:
+                self.stdout.write(f"{name}: {updated}")
@@ -0,0 +1,83 @@
+import signal
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.images import pop_image_derivatives, process_image, queue_image_derivatives
+from core.models import AttributeValue, Category, Gallery, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker tạo ảnh phái sinh (thumb, card, detail - WebP và JPEG) cho các ảnh "
+        "trong hàng đợi. Dùng --all để đưa toàn bộ ảnh hiện có vào hàng đợi."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Đưa toàn bộ ảnh hiện có vào hàng đợi trước khi xử lý.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Xử lý hết hàng đợi rồi thoát (mặc định chạy liên tục).",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=2,
+            help="Số tiến trình xử lý ảnh song song.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=20,
+            help="Số ảnh lấy khỏi hàng đợi mỗi lần.",
+        )
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            self.queue_all()
+
+        running = True
+
+        def stop(signum, frame):
+            nonlocal running
+            running = False
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        # Tiến trình con không dùng DB, đóng kết nối để không bị chia sẻ khi fork
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options["processes"]) as executor:
+            while running:
+                names = pop_image_derivatives(options["batch_size"])
+                if not names:
+                    if options["once"]:
+                        break
+                    continue
+                created = sum(executor.map(process_image, names))
+                self.stdout.write(f"{len(names)} ảnh, {created} ảnh phái sinh")
+
+    def queue_all(self):
+        count = 0
+        for model, field in [
+            (Gallery, "image"),
+            (AttributeValue, "image"),
+            (Category, "image"),
+            (User, "avatar"),
+        ]:
+            names = list(
+                model.objects.exclude(**{f"{field}__isnull": True})
+                .exclude(**{field: ""})
+                .order_by()
+                .values_list(field, flat=True)
+                .distinct()
+            )
+            for start in range(0, len(names), 1000):
+                queue_image_derivatives(*names[start : start + 1000])
+            count += len(names)
+        self.stdout.write(self.style.SUCCESS(f"Đã đưa {count} ảnh vào hàng đợi."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.snapshots import prune_snapshots
+
+
+class Command(BaseCommand):
+    help = "Xóa các snapshot ảnh không còn được tham chiếu."
+
+    def handle(self, *args, **options):
+        deleted = prune_snapshots()
+        self.stdout.write(self.style.SUCCESS(f"Đã xóa {deleted} snapshot."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.comments import rebuild_comment_tree
+
+
+class Command(BaseCommand):
+    help = "Tính lại bình luận gốc (root) và độ sâu (depth) của toàn bộ bình luận."
+
+    def handle(self, *args, **options):
+        updated = rebuild_comment_tree()
+        self.stdout.write(self.style.SUCCESS(f"Đã cập nhật {updated} bình luận."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.listing import refresh_listing_summaries
+from core.models import ProductListingSummary
+
+
+class Command(BaseCommand):
+    help = "Tính lại toàn bộ dữ liệu hiển thị danh sách sản phẩm (ProductListingSummary)."
+
+    def handle(self, *args, **options):
+        refresh_listing_summaries()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Đã cập nhật {ProductListingSummary.objects.count()} sản phẩm."
+            )
+        )
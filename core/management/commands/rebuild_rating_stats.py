@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.listing import refresh_listing_summaries
+from core.ratings import rebuild_rating_stats
+
+
+class Command(BaseCommand):
+    help = "Tính lại thống kê đánh giá (ProductRatingStats) của toàn bộ sản phẩm."
+
+    def handle(self, *args, **options):
+        updated = rebuild_rating_stats()
+        refresh_listing_summaries()
+        self.stdout.write(self.style.SUCCESS(f"Đã cập nhật {updated} sản phẩm."))
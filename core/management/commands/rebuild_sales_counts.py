@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.orders import rebuild_sales_counts
+
+
+class Command(BaseCommand):
+    help = "Tính lại số lượng đã bán (sale_count) của sản phẩm từ các đơn hàng đã giao."
+
+    def handle(self, *args, **options):
+        updated = rebuild_sales_counts()
+        self.stdout.write(self.style.SUCCESS(f"Đã cập nhật {updated} sản phẩm."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.models import ProductSearchDocument
+from core.search import refresh_search_documents
+
+
+class Command(BaseCommand):
+    help = "Tính lại toàn bộ dữ liệu tìm kiếm sản phẩm (ProductSearchDocument)."
+
+    def handle(self, *args, **options):
+        refresh_search_documents()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Đã cập nhật {ProductSearchDocument.objects.count()} sản phẩm."
+            )
+        )
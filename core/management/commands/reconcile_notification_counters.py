@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.models import User
+from core.notifications import iter_counter_user_ids, reconcile_unread_count
+
+
+class Command(BaseCommand):
+    help = "Đối chiếu bộ đếm thông báo chưa đọc trong Redis với cơ sở dữ liệu."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Tính lại cho tất cả user thay vì chỉ các user đang có bộ đếm.",
+        )
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            users = User.objects.filter(is_active=True)
+        else:
+            users = User.objects.filter(id__in=set(iter_counter_user_ids()))
+
+        fixed = 0
+        for user in users.iterator():
+            reconcile_unread_count(user)
+            fixed += 1
+        self.stdout.write(self.style.SUCCESS(f"Đã đối chiếu {fixed} user."))
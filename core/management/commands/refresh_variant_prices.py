@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core.pricing import refresh_expired_variant_prices, refresh_variant_prices
+
+
+class Command(BaseCommand):
+    help = (
+        "Tính lại bảng giá hiệu lực của variant khi khuyến mãi bắt đầu/kết thúc. "
+        "Chạy định kỳ (vd: mỗi phút bằng cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Tính lại toàn bộ variant thay vì chỉ các variant đã hết hiệu lực.",
+        )
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            product_ids = refresh_variant_prices()
+        else:
+            product_ids = refresh_expired_variant_prices()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Đã cập nhật giá hiệu lực cho {len(product_ids)} sản phẩm."
+            )
+        )
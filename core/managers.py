@@ -5,15 +5,15 @@ from django.db import models
 from django.db.models import (
     F,
     Value,
+    Q,
     Case,
     When,
     Subquery,
     OuterRef,
     DecimalField,
+    IntegerField,
     CharField,
     Exists,
-    FloatField,
-    ExpressionWrapper,
 )
 from django.db.models.functions import Coalesce, Concat
 from django.utils.timezone import now
@@ -40,43 +40,92 @@ class UserManager(BaseUserManager):
         return self.create_user(email, password, **extra_fields)
 
 
-class VariantManager(models.Manager):
+def effective_price_annotations(prefix=""):
+    """
+    Trả về các biểu thức discount_price/discount đọc từ bảng giá hiệu lực
+    (VariantEffectivePrice). `prefix` là đường dẫn tới Variant, vd "variant__".
+    """
+    current = now()
+    price_path = f"{prefix}effective_price__"
+    is_active = Q(
+        **{
+            f"{price_path}promotion_start__lte": current,
+            f"{price_path}promotion_end__gt": current,
+        }
+    )
+    return {
+        "discount_price": Case(
+            When(is_active, then=F(f"{price_path}discount_price")),
+            default=F(f"{prefix}price"),
+            output_field=DecimalField(max_digits=12, decimal_places=0),
+        ),
+        "discount": Case(
+            When(is_active, then=F(f"{price_path}discount")),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+    }
+
+
+class VariantQuerySet(models.QuerySet):
+    def with_effective_price(self):
+        """Gắn giá sau khuyến mãi và phần trăm giảm từ bảng giá hiệu lực"""
+        return self.annotate(**effective_price_annotations())
+
     def with_info_display(self):
         """Lấy thông tin hiển thị của variant bao gồm giá sau giảm giá, phần trăm giảm giá và ảnh"""
-        from core.models import Variant
+        from core.models import AttributeValue
 
-        return self.annotate(
-            discount_price=Case(
-                When(
-                    promotion_items__discount_type="amount",
-                    then=F("price") - F("promotion_items__discount_value"),
-                ),
-                When(
-                    promotion_items__discount_type="percent",
-                    then=F("price") * (1 - F("promotion_items__discount_value") / 100),
-                ),
-                default=F("price"),
-                output_field=DecimalField(),
-            ),
-            discount=Case(
-                When(
-                    promotion_items__discount_type="amount",
-                    then=ExpressionWrapper(
-                        (F("promotion_items__discount_value") / F("price")) * 100,
-                        output_field=FloatField(),
-                    ),
-                ),
-                When(
-                    promotion_items__discount_type="percent",
-                    then=F("promotion_items__discount_value"),
-                ),
-                default=Value(0),
-                output_field=FloatField(),
-            ),
+        return self.with_effective_price().annotate(
             image=Subquery(
-                Variant.objects.filter(
-                    id=OuterRef("id"),
-                    attribute_values__image__isnull=False,
-                ).values("attribute_values__image")[:1]
+                AttributeValue.objects.filter(
+                    variants=OuterRef("pk"), image__isnull=False
+                )
+                .exclude(image="")
+                .values("image")[:1]
             ),
         )
+
+
+class VariantManager(models.Manager.from_queryset(VariantQuerySet)):
+    pass
+
+
+class NotificationQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """Thông báo riêng của user và các thông báo chung (FILTER_TYPES)"""
+        return self.filter(
+            Q(user=user) | Q(notification_type__in=self.model.FILTER_TYPES)
+        )
+
+    def with_read_state(self, user):
+        """
+        Gắn is_read: thông báo đã đọc nếu cập nhật trước mốc "đọc tất cả" của user,
+        hoặc có bản ghi NotificationRead được đọc sau lần cập nhật cuối.
+        """
+        from core.models import NotificationRead, NotificationReadMarker
+
+        read_until = Subquery(
+            NotificationReadMarker.objects.filter(user=user).values("read_until")[:1]
+        )
+        return self.annotate(
+            is_read=Case(
+                When(updated_at__lte=read_until, then=Value(True)),
+                default=Exists(
+                    NotificationRead.objects.filter(
+                        user=user,
+                        notification=OuterRef("pk"),
+                        is_read=True,
+                        updated_at__gte=OuterRef("updated_at"),
+                    )
+                ),
+                output_field=models.BooleanField(),
+            )
+        )
+
+    def unread_for(self, user):
+        return self.for_user(user).with_read_state(user).filter(is_read=False)
+
+
+class NotificationManager(models.Manager.from_queryset(NotificationQuerySet)):
+    pass
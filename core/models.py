@@ -1,22 +1,13 @@
-import os, string, random
+import os, re, string, random
+from datetime import timedelta
 from django.urls import reverse
 from django.utils import timesince
 from django.utils.timezone import now
 
 from django.utils.text import capfirst
-from django.db import models
-from django.db.models import (
-    Case,
-    When,
-    OuterRef,
-    Q,
-    F,
-    Value,
-    DecimalField,
-    FloatField,
-    ExpressionWrapper,
-    Subquery,
-)
+from django.db import IntegrityError, ProgrammingError, connection, models, transaction
+from django.db.models import F
+from django.db.models.functions import Length
 from django.core.exceptions import ValidationError
 from django.core.validators import (
     MinValueValidator,
@@ -31,10 +22,13 @@ from django.contrib.admin.decorators import display
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.utils.translation import gettext_lazy as _
-from .managers import UserManager, VariantManager
+from .images import preview_image_tag
+from .managers import NotificationManager, UserManager, VariantManager
 from django.utils.safestring import mark_safe
 from django_ckeditor_5.fields import CKEditor5Field
 from django.db.models import UniqueConstraint
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 import unicodedata
 from django.utils.formats import number_format
 from django.utils.timezone import localtime
@@ -63,31 +57,82 @@ def generate_random_string(size=10):
     return "".join(random.choice(chars) for _ in range(size))
 
 
-def generate_unique_invoice(instance, prefix="VN-"):
-    # Get the current date
-    today = now()
-    # Format the date as YYYYMMDD
-    date_prefix = today.strftime("%Y%m%d")
+def _invoice_sequence_name(invoice_prefix):
+    # VN-20250101 -> invoice_seq_vn_20250101
+    return "invoice_seq_" + re.sub(r"\W+", "_", invoice_prefix).strip("_").lower()
 
-    # Get the model class from the instance
-    Klass = instance.__class__
 
-    # Query for the last invoice number with the same date prefix
+def _create_invoice_sequence(cursor, prefix, date_prefix):
+    """Tạo sequence cho ngày mới, bắt đầu sau mã đơn hàng lớn nhất đã có trong ngày"""
+    invoice_prefix = f"{prefix}{date_prefix}"
+    # So sánh theo độ dài trước: chuỗi "...10000" nhỏ hơn "...9999"
     last_invoice = (
-        Klass.objects.filter(invoice__startswith=f"{prefix}{date_prefix}")
-        .order_by("id")
-        .last()
-    )
+        Order.objects.filter(invoice__startswith=invoice_prefix)
+        .order_by(Length("invoice").desc(), "-invoice")
+        .values_list("invoice", flat=True)
+        .first()
+    )
+    start = int(last_invoice[len(invoice_prefix) :]) + 1 if last_invoice else 1
+    try:
+        with transaction.atomic():
+            cursor.execute(
+                f"CREATE SEQUENCE IF NOT EXISTS "
+                f"{connection.ops.quote_name(_invoice_sequence_name(invoice_prefix))} "
+                f"START {int(start)}"
+            )
+    except IntegrityError:
+        # Request khác vừa tạo cùng sequence
+        pass
 
-    # Determine the next invoice number
-    if last_invoice:
-        last_number = int(last_invoice.invoice[len(f"{prefix}{date_prefix}") :])
-        new_number = last_number + 1
-    else:
-        new_number = 1
 
-    # Return the new unique invoice number
-    return f"{prefix}{date_prefix}{new_number:04d}"
+def drop_old_invoice_sequences(prefix="VN-", keep_days=1):
+    """
+    Xóa sequence mã đơn hàng của các ngày cũ (giữ lại `keep_days` ngày trước cho
+    các request đang chạy). Chạy định kỳ bằng lệnh drop_old_invoice_sequences,
+    không chạy trong request tạo đơn hàng. Trả về số sequence đã xóa.
+    """
+    oldest_kept = (now() - timedelta(days=keep_days)).strftime("%Y%m%d")
+    base_name = _invoice_sequence_name(prefix)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT sequencename FROM pg_sequences "
+            "WHERE sequencename LIKE %s AND sequencename < %s",
+            [f"{base_name}\\_%", _invoice_sequence_name(f"{prefix}{oldest_kept}")],
+        )
+        sequence_names = [sequence_name for (sequence_name,) in cursor.fetchall()]
+        for sequence_name in sequence_names:
+            cursor.execute(
+                f"DROP SEQUENCE IF EXISTS {connection.ops.quote_name(sequence_name)}"
+            )
+    return len(sequence_names)
+
+
+def allocate_invoice_numbers(count=1, prefix="VN-"):
+    """
+    Cấp `count` mã đơn hàng dạng VN-YYYYMMDDNNNN từ sequence PostgreSQL theo ngày.
+    nextval không khóa và không bị rollback nên các request đồng thời không bao giờ
+    nhận trùng mã (có thể bỏ trống số khi transaction bị hủy).
+    """
+    date_prefix = now().strftime("%Y%m%d")
+    sequence_name = _invoice_sequence_name(f"{prefix}{date_prefix}")
+    query = "SELECT nextval(%s) FROM generate_series(1, %s)"
+
+    with connection.cursor() as cursor:
+        try:
+            with transaction.atomic():
+                cursor.execute(query, [sequence_name, count])
+                numbers = [number for (number,) in cursor.fetchall()]
+        except ProgrammingError:
+            # Sequence của ngày hôm nay chưa tồn tại
+            _create_invoice_sequence(cursor, prefix, date_prefix)
+            cursor.execute(query, [sequence_name, count])
+            numbers = [number for (number,) in cursor.fetchall()]
+
+    return [f"{prefix}{date_prefix}{number:04d}" for number in numbers]
+
+
+def generate_unique_invoice(instance, prefix="VN-"):
+    return allocate_invoice_numbers(prefix=prefix)[0]
 
 
 def generate_unique_slug(instance, field_name="name", field_sku=None, new_slug=None):
@@ -160,23 +205,6 @@ def notification_image_upload_to(instance, filename):
         return f"images/notification/other/{filename}"
 
 
-def resize_image(image_field, max_size=(1024, 1024)):
-    """
-    Resize the image if it exceeds the specified max dimensions.
-
-    Parameters:
-    image_field: ImageField
-        The image field to be resized.
-    max_size: tuple
-        Maximum allowed dimensions for the image (width, height).
-    """
-    if image_field and os.path.exists(image_field.path):
-        img = Image.open(image_field.path)
-        if img.height > max_size[0] or img.width > max_size[1]:
-            img.thumbnail(max_size)
-            img.save(image_field.path)
-
-
 def normalize_text(text):
     """Chuẩn hoá chuỗi sang dạng NFC"""
     return unicodedata.normalize("NFC", text)
@@ -194,6 +222,9 @@ class CustomImageField(models.ImageField):
         super().__init__(*args, **kwargs)
 
     def clean(self, value, model_instance):
+        # Chỉ kiểm tra file mới tải lên, ảnh đã lưu không cần đọc lại từ storage
+        if not value or getattr(value, "_committed", True):
+            return super().clean(value, model_instance)
         file = value.file
 
         # ✅ Kiểm tra kích thước file
@@ -213,22 +244,23 @@ class CustomImageField(models.ImageField):
                 % ", ".join(self.allowed_types)
             )
 
-        # ✅ Kiểm tra độ phân giải
+        # ✅ Kiểm tra độ phân giải: chỉ đọc phần header, không giải mã toàn bộ ảnh
+        # (ảnh được giải mã khi tạo ảnh phái sinh ở worker)
         try:
+            file.seek(0)
             with Image.open(file) as img:
-                img.verify()
                 width, height = img.size
-
-                if self.max_resolution:
-                    max_width, max_height = self.max_resolution
-                    if width > max_width or height > max_height:
-                        raise ValidationError(
-                            _("Kích thước tối đa là %dx%d px.")
-                            % (max_width, max_height)
-                        )
-
         except Exception:
             raise ValidationError(_("Tệp không phải là hình ảnh hợp lệ."))
+        finally:
+            file.seek(0)
+
+        if self.max_resolution:
+            max_width, max_height = self.max_resolution
+            if width > max_width or height > max_height:
+                raise ValidationError(
+                    _("Kích thước tối đa là %dx%d px.") % (max_width, max_height)
+                )
 
         return super().clean(value, model_instance)
 
@@ -316,7 +348,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     @display(description=_("Xem trước Avatar"))
     def preview_avatar(self):
         if self.avatar:
-            return mark_safe(f'<img src="{self.avatar.url}" width="64" height="64" />')
+            return preview_image_tag(self.avatar.name)
         return mark_safe(
             f'<img src="{settings.MEDIA_URL}{default_no_image}" width="64" height="64" />'
         )
@@ -395,12 +427,62 @@ class Category(models.Model):
     @display(description=_("Xem trước"))
     def preview_image(self):
         if self.image:
-            return mark_safe(f'<img src="{self.image.url}" width="64" height="64" />')
+            return preview_image_tag(self.image.name)
         return mark_safe(
             f'<img src="{settings.MEDIA_URL}{default_no_image}" width="64" height="64" />'
         )
 
 
+class ImportJob(models.Model):
+    """Tiến trình nhập dữ liệu từ file chạy nền"""
+
+    STATUS_CHOICES = [
+        ("pending", "Chờ xử lý"),
+        ("running", "Đang nhập"),
+        ("success", "Thành công"),
+        ("failed", "Thất bại"),
+    ]
+    KIND_CHOICES = [
+        ("category", "Danh mục"),
+    ]
+
+    kind = models.CharField(_("Loại Dữ Liệu"), max_length=20, choices=KIND_CHOICES)
+    file = models.FileField(_("File Nhập"), upload_to="imports/")
+    status = models.CharField(
+        _("Trạng Thái"), max_length=20, choices=STATUS_CHOICES, default="pending"
+    )
+    total_rows = models.PositiveIntegerField(_("Tổng Số Dòng"), default=0)
+    processed_rows = models.PositiveIntegerField(_("Số Dòng Đã Xử Lý"), default=0)
+    created_count = models.PositiveIntegerField(_("Số Bản Ghi Tạo Mới"), default=0)
+    updated_count = models.PositiveIntegerField(_("Số Bản Ghi Cập Nhật"), default=0)
+    # {"row_<số dòng>": [lỗi, ...]}
+    errors = models.JSONField(_("Lỗi"), default=dict, blank=True)
+    created_by = models.ForeignKey(
+        User,
+        verbose_name=_("Người Tạo"),
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    created_at = models.DateTimeField(_("Ngày Tạo"), auto_now_add=True)
+    finished_at = models.DateTimeField(_("Ngày Hoàn Thành"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Tiến Trình Nhập Dữ Liệu")
+        verbose_name_plural = _("Tiến Trình Nhập Dữ Liệu")
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} - {self.get_status_display()}"
+
+    @property
+    def progress(self):
+        if not self.total_rows:
+            return 100 if self.status in ("success", "failed") else 0
+        return min(100, self.processed_rows * 100 // self.total_rows)
+
+
 class Product(models.Model):
     sku = models.CharField(
         "Mã Sản Phẩm",
@@ -459,6 +541,13 @@ class Product(models.Model):
     def __str__(self):
         return self.sku
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lưu danh mục ban đầu để vô hiệu hóa cache khi sản phẩm đổi danh mục
+        instance._loaded_category_id = instance.__dict__.get("category_id")
+        return instance
+
     def save(self, *args, **kwargs):
         # Tạo slug nếu chưa có
         if not self.pk and not self.slug:
@@ -480,14 +569,10 @@ class Product(models.Model):
     def preview_image(self):
         cover_image = self.gallery.filter(order=1).first()
         if cover_image and cover_image.image:
-            return mark_safe(
-                f'<img src="{cover_image.image.url}" width="64" height="64" />'
-            )
+            return preview_image_tag(cover_image.image.name)
         fallback_image = self.gallery.first()
         if fallback_image and fallback_image.image:
-            return mark_safe(
-                f'<img src="{fallback_image.image.url}" width="64" height="64" />'
-            )
+            return preview_image_tag(fallback_image.image.name)
         return mark_safe(
             f'<img src="{settings.MEDIA_URL}{default_no_image}" width="64" height="64" />'
         )
@@ -495,86 +580,17 @@ class Product(models.Model):
     def get_variant_lowest_price(self):
         "Lấy biến thể có giá thấp nhất của sản phẩm sau khi đã tính khuyến mãi"
 
-        # Lấy khuyến mãi hợp lệ
-        valid_promotions = Q(
-            promotion_items__isnull=False,
-            promotion_items__promotion__start_date__lte=now(),
-            promotion_items__promotion__end_date__gte=now(),
-        )
-
+        # Giá sau khuyến mãi được đọc từ bảng giá hiệu lực (VariantEffectivePrice)
         variant_lowest_price = (
-            self.variants.filter(valid_promotions)
-            .annotate(
-                discount_price=Case(
-                    When(
-                        promotion_items__promotion__start_date__lte=now(),
-                        promotion_items__promotion__end_date__gt=now(),
-                        promotion_items__discount_type="amount",
-                        then=F("price") - F("promotion_items__discount_value"),
-                    ),
-                    When(
-                        promotion_items__promotion__start_date__lte=now(),
-                        promotion_items__promotion__end_date__gt=now(),
-                        promotion_items__discount_type="percent",
-                        then=F("price")
-                        * (1 - F("promotion_items__discount_value") / 100),
-                    ),
-                    default=F("price"),
-                    output_field=DecimalField(),
-                ),
-                discount=Case(
-                    When(
-                        promotion_items__promotion__start_date__lte=now(),
-                        promotion_items__promotion__end_date__gt=now(),
-                        promotion_items__discount_type="amount",
-                        then=ExpressionWrapper(
-                            (F("promotion_items__discount_value") / F("price")) * 100,
-                            output_field=FloatField(),
-                        ),
-                    ),
-                    When(
-                        promotion_items__promotion__start_date__lte=now(),
-                        promotion_items__promotion__end_date__gt=now(),
-                        promotion_items__discount_type="percent",
-                        then=F("promotion_items__discount_value"),
-                    ),
-                    default=Value(0),
-                    output_field=FloatField(),
-                ),
-                image=Subquery(
-                    AttributeValue.objects.filter(
-                        Q(variants=OuterRef("pk"))
-                        & Q(image__isnull=False)
-                        & ~Q(image=""),
-                    ).values("image")[:1]
-                ),
-            )
-            .order_by("discount_price")
-            .first()
+            self.variants.with_info_display().order_by("discount_price", "id").first()
         )
-
-        if not variant_lowest_price:
-            variant_lowest_price = (
-                self.variants.annotate(
-                    discount_price=F("price"),
-                    discount=Value(0, output_field=FloatField()),
-                    image=Subquery(
-                        Variant.objects.filter(
-                            id=OuterRef("id"),
-                            attribute_values__image__isnull=False,
-                        ).values("attribute_values__image")[:1]
-                    ),
-                )
-                .order_by("discount_price")
-                .first()
-            )
         return variant_lowest_price
         # endregion
 
     def update_sales_count(self, quantity):
         """Cập nhật số lượng sản phẩm đã bán"""
-        self.sale_count += quantity
-        self.save(update_fields=["sale_count"])
+        Product.objects.filter(id=self.id).update(sale_count=F("sale_count") + quantity)
+        self.refresh_from_db(fields=["sale_count"])
 
 
 class ProductAttribute(models.Model):
@@ -613,6 +629,15 @@ class AttributeValue(models.Model):
         related_name="attribute_values",
     )
     value = models.CharField(_("Giá Trị"), max_length=100)
+    snapshot = models.ForeignKey(
+        "ImageSnapshot",
+        verbose_name=_("Ảnh Lưu Trữ"),
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+    )
     created_at = models.DateTimeField(_("Ngày Tạo"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Ngày Cập Nhật"), auto_now=True)
 
@@ -628,10 +653,17 @@ class AttributeValue(models.Model):
     def __str__(self):
         return f"{self.attribute.name} {self.value}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lưu đường dẫn ảnh ban đầu để biết khi nào cần tạo lại snapshot
+        instance._loaded_image = instance.__dict__.get("image")
+        return instance
+
     @display(description=_("Xem trước Hình ảnh"))
     def preview_image(self):
         if self.image:
-            return mark_safe(f'<img src="{self.image.url}" width="64" height="64" />')
+            return preview_image_tag(self.image.name)
         return mark_safe(
             f'<img src="{settings.MEDIA_URL}{default_no_image}" width="64" height="64" />'
         )
@@ -686,7 +718,7 @@ class Variant(models.Model):
         for attr_value in self.attribute_values.all():
             image = attr_value.image
             if image:
-                return mark_safe(f'<img src="{image.url}" width="64" height="64" />')
+                return preview_image_tag(image.name)
         return mark_safe(
             f'<img src="{settings.MEDIA_URL}{default_no_image}" width="64" height="64" />'
         )
@@ -695,12 +727,16 @@ class Variant(models.Model):
     def get_absolute_url(self):
         """Trả về URL đầy đủ của sản phẩm"""
         attr_values = self.attribute_values.values_list("id", flat=True)
+        return Variant.build_url(self.product.slug, attr_values)
+
+    @staticmethod
+    def build_url(product_slug, attr_value_ids):
+        """Tạo URL sản phẩm từ slug và danh sách id giá trị thuộc tính (không truy vấn DB)"""
         query_params = urlencode(
-            [("attr_value", attr_value) for attr_value in attr_values]
+            [("attr_value", attr_value) for attr_value in attr_value_ids]
         )
-        base_url = self.product.get_absolute_url()
-        url = f"{base_url}?{query_params}" if query_params else base_url
-        return url
+        base_url = reverse("store:product_detail", kwargs={"slug": product_slug})
+        return f"{base_url}?{query_params}" if query_params else base_url
 
     def update_name(self):
         """Cập nhật tên variant dựa trên attribute_values."""
@@ -740,6 +776,11 @@ class Variant(models.Model):
         # Cập nhật lại instance với stock mới từ DB
         self.refresh_from_db(fields=["stock"])
 
+        # update() không gửi signal nên cập nhật tổng tồn kho của sản phẩm tại đây
+        from core.listing import refresh_listing_summaries
+
+        refresh_listing_summaries([self.product_id])
+
 
 class StockSetting(models.Model):
     variant = models.OneToOneField(
@@ -755,6 +796,23 @@ class StockSetting(models.Model):
         )
 
 
+class ImageSnapshot(models.Model):
+    """Ảnh bất biến lưu theo mã băm nội dung, dùng chung cho các dòng đơn hàng."""
+
+    digest = models.CharField(_("Mã Băm"), max_length=64, unique=True)
+    image = models.ImageField(_("Hình Ảnh"), max_length=255)
+    # Số dòng đơn hàng đang tham chiếu tới ảnh
+    ref_count = models.PositiveIntegerField(_("Số Tham Chiếu"), default=0)
+    created_at = models.DateTimeField(_("Ngày Tạo"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Ảnh Lưu Trữ")
+        verbose_name_plural = _("Ảnh Lưu Trữ")
+
+    def __str__(self):
+        return self.digest
+
+
 class Gallery(models.Model):
     product = models.ForeignKey(
         "Product",
@@ -770,6 +828,15 @@ class Gallery(models.Model):
         upload_to=image_upload_to,
     )
     order = models.PositiveIntegerField(_("Thứ Tự"))
+    snapshot = models.ForeignKey(
+        "ImageSnapshot",
+        verbose_name=_("Ảnh Lưu Trữ"),
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+    )
     created_at = models.DateTimeField(_("Ngày Tạo"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Ngày Cập Nhật"), auto_now=True)
 
@@ -781,10 +848,17 @@ class Gallery(models.Model):
     def __str__(self):
         return f"[{self.product.name}] - Image"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lưu đường dẫn ảnh ban đầu để biết khi nào cần tạo lại snapshot
+        instance._loaded_image = instance.__dict__.get("image")
+        return instance
+
     @display(description=_("Xem trước Hình ảnh"))
     def preview_image(self):
         if self.image:
-            return mark_safe(f'<img src="{self.image.url}" width="64" height="64" />')
+            return preview_image_tag(self.image.name)
         return mark_safe(
             f'<img src="{settings.MEDIA_URL}{default_no_image}" width="64" height="64" />'
         )
@@ -903,6 +977,177 @@ class PromotionItem(models.Model):
         super().save(*args, **kwargs)
 
 
+class VariantEffectivePrice(models.Model):
+    """Giá hiệu lực của variant (đã áp khuyến mãi), được tính sẵn để đọc nhanh."""
+
+    variant = models.OneToOneField(
+        Variant,
+        verbose_name=_("Phân Loại Sản Phẩm"),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="effective_price",
+    )
+    promotion = models.ForeignKey(
+        Promotion,
+        verbose_name=_("Khuyến Mãi"),
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    discount_type = models.CharField(
+        max_length=10,
+        choices=PromotionItem.DISCOUNT_TYPE_CHOICES,
+        null=True,
+        blank=True,
+    )
+    discount_value = models.DecimalField(
+        _("Giá Trị Giảm"), max_digits=10, decimal_places=0, null=True, blank=True
+    )
+    discount_price = models.DecimalField(
+        _("Giá Sau Giảm"), max_digits=12, decimal_places=decimal_places
+    )
+    discount = models.PositiveSmallIntegerField(_("Phần Trăm Giảm"), default=0)
+    promotion_start = models.DateTimeField(
+        _("Khuyến Mãi Bắt Đầu"), null=True, blank=True
+    )
+    promotion_end = models.DateTimeField(_("Khuyến Mãi Kết Thúc"), null=True, blank=True)
+    # Thời điểm giá cần được tính lại (kết thúc KM hiện tại hoặc bắt đầu KM kế tiếp)
+    valid_until = models.DateTimeField(
+        _("Hiệu Lực Đến"), null=True, blank=True, db_index=True
+    )
+    updated_at = models.DateTimeField(_("Ngày Cập Nhật"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Giá Hiệu Lực")
+        verbose_name_plural = _("Giá Hiệu Lực")
+
+    def __str__(self):
+        return f"{self.variant_id} - {self.discount_price}"
+
+
+class ProductListingSummary(models.Model):
+    """Dữ liệu hiển thị danh sách sản phẩm được tính sẵn (mỗi sản phẩm một dòng)."""
+
+    product = models.OneToOneField(
+        Product,
+        verbose_name=_("Sản Phẩm"),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="listing_summary",
+    )
+    # Variant có giá thấp nhất sau khuyến mãi
+    variant = models.ForeignKey(
+        Variant,
+        verbose_name=_("Phân Loại Sản Phẩm"),
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    price = models.DecimalField(
+        _("Giá"), max_digits=12, decimal_places=decimal_places, null=True, blank=True
+    )
+    discount_price = models.DecimalField(
+        _("Giá Sau Giảm"),
+        max_digits=12,
+        decimal_places=decimal_places,
+        null=True,
+        blank=True,
+    )
+    discount = models.PositiveSmallIntegerField(_("Phần Trăm Giảm"), default=0)
+    cover_image = models.CharField(
+        _("Ảnh Đại Diện"), max_length=255, null=True, blank=True
+    )
+    rating_star = models.FloatField(_("Điểm Đánh Giá"), null=True, blank=True)
+    total_stock = models.PositiveIntegerField(_("Tổng Tồn Kho"), default=0)
+    updated_at = models.DateTimeField(_("Ngày Cập Nhật"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Tóm Tắt Sản Phẩm")
+        verbose_name_plural = _("Tóm Tắt Sản Phẩm")
+
+    def __str__(self):
+        return f"{self.product_id} - {self.discount_price}"
+
+
+class ProductRatingStats(models.Model):
+    """
+    Thống kê đánh giá của sản phẩm: số lượt theo từng mức sao và tổng điểm.
+    Được cộng/trừ bằng F() khi thêm, sửa, xóa Review (core.ratings).
+    """
+
+    product = models.OneToOneField(
+        Product,
+        verbose_name=_("Sản Phẩm"),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="rating_stats",
+    )
+    rating_1 = models.PositiveIntegerField(_("1 Sao"), default=0)
+    rating_2 = models.PositiveIntegerField(_("2 Sao"), default=0)
+    rating_3 = models.PositiveIntegerField(_("3 Sao"), default=0)
+    rating_4 = models.PositiveIntegerField(_("4 Sao"), default=0)
+    rating_5 = models.PositiveIntegerField(_("5 Sao"), default=0)
+    score_sum = models.PositiveIntegerField(_("Tổng Điểm"), default=0)
+    updated_at = models.DateTimeField(_("Ngày Cập Nhật"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Thống Kê Đánh Giá")
+        verbose_name_plural = _("Thống Kê Đánh Giá")
+
+    def __str__(self):
+        return f"{self.product_id} - {self.average_score}"
+
+    @property
+    def total_ratings(self):
+        return (
+            self.rating_1 + self.rating_2 + self.rating_3 + self.rating_4 + self.rating_5
+        )
+
+    @property
+    def average_score(self):
+        total_ratings = self.total_ratings
+        return self.score_sum / total_ratings if total_ratings else None
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Dữ liệu tìm kiếm của sản phẩm: các trường đã bỏ dấu, viết thường (core.search.fold_text)
+    và tsvector có trọng số. Tìm kiếm không phân biệt dấu tiếng Việt.
+    """
+
+    product = models.OneToOneField(
+        Product,
+        verbose_name=_("Sản Phẩm"),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="search_document",
+    )
+    name = models.CharField(_("Tên Sản Phẩm"), max_length=255, blank=True)
+    sku = models.CharField(_("Sku"), max_length=255, blank=True)
+    category = models.CharField(_("Danh Mục"), max_length=255, blank=True)
+    attributes = models.TextField(_("Thuộc Tính"), blank=True)
+    search_vector = SearchVectorField(null=True)
+    updated_at = models.DateTimeField(_("Ngày Cập Nhật"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Dữ Liệu Tìm Kiếm")
+        verbose_name_plural = _("Dữ Liệu Tìm Kiếm")
+        indexes = [
+            GinIndex(fields=["search_vector"], name="product_search_vector_idx"),
+            # Cần extension pg_trgm
+            GinIndex(
+                fields=["name"],
+                name="product_search_name_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
 class Cart(models.Model):
     user = models.OneToOneField(
         User, verbose_name=_("Tài Khoản"), on_delete=models.CASCADE, related_name="cart"
@@ -1039,7 +1284,7 @@ class Order(models.Model):
             raise ValidationError({"status": _("Trạng thái đơn hàng không hợp lệ.")})
 
         if self.pk:  # Nếu đơn hàng đã tồn tại (không phải đơn mới)
-            old_status = self.__class__.objects.get(pk=self.pk).status  # Trạng thái cũ
+            old_status = self.get_loaded_status()  # Trạng thái cũ
             new_status = self.status
 
             if not self.is_valid_status_transition(old_status, new_status):
@@ -1050,20 +1295,40 @@ class Order(models.Model):
                     }
                 )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lưu trạng thái ban đầu để kiểm tra chuyển trạng thái mà không cần truy vấn lại
+        instance._loaded_status = instance.__dict__.get("status")
+        return instance
+
+    def get_loaded_status(self):
+        """Trạng thái hiện tại trong DB (None nếu là đơn hàng mới)"""
+        if not self.pk:
+            return None
+        if getattr(self, "_loaded_status", None) is None:
+            self._loaded_status = (
+                Order.objects.filter(pk=self.pk)
+                .values_list("status", flat=True)
+                .first()
+            )
+        return self._loaded_status
+
     def save(self, *args, **kwargs):
         self.clean()
         is_new = self.pk is None
-        old_status = None if is_new else Order.objects.get(pk=self.pk).status
+        old_status = self.get_loaded_status()
         new_status = self.status
         if is_new and not self.invoice:
             self.invoice = generate_unique_invoice(self)
         super().save(*args, **kwargs)
+        self._loaded_status = new_status
 
         if new_status == "delivered" and old_status != "delivered":
-            for item in self.order_items.all():
-                item.product.update_sales_count(
-                    item.quantity
-                )  # Cập nhật số lượng bán của sản phẩm
+            # Cập nhật số lượng bán của các sản phẩm bằng một câu UPDATE
+            from core.orders import add_sales_counts
+
+            add_sales_counts([self.id])
         if old_status and old_status != new_status:
             OrderStatusHistory.create_history(self, old_status)
 
@@ -1078,6 +1343,15 @@ class OrderItem(models.Model):
     image = models.ImageField(
         _("Hình Ảnh"), upload_to=image_upload_to, default="images/NoImage.png"
     )
+    # Ảnh dùng chung theo mã băm (ảnh của đơn hàng cũ được sao chép vào images/order/)
+    snapshot = models.ForeignKey(
+        ImageSnapshot,
+        verbose_name=_("Ảnh Lưu Trữ"),
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="order_items",
+    )
     product = models.ForeignKey(
         Product, verbose_name=_("Sản Phẩm"), on_delete=models.SET_NULL, null=True
     )
@@ -1502,6 +1776,16 @@ class Review(models.Model):
     def timesince(self):
         return _("%s trước") % timesince.timesince(self.created_at)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lưu sản phẩm và điểm ban đầu để cập nhật thống kê đánh giá khi sửa
+        instance._loaded_rating = (
+            instance.__dict__.get("product_id"),
+            instance.__dict__.get("score"),
+        )
+        return instance
+
 
 class Comment(models.Model):
     product = models.ForeignKey(
@@ -1521,6 +1805,18 @@ class Comment(models.Model):
         blank=True,
         related_name="replies",
     )
+    # Bình luận gốc của luồng (None với bình luận gốc) và độ sâu trong cây,
+    # dùng để tải cả luồng bình luận bằng một truy vấn
+    root = models.ForeignKey(
+        "self",
+        verbose_name=_("Bình Luận Gốc"),
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="thread_comments",
+    )
+    depth = models.PositiveSmallIntegerField(_("Độ Sâu"), default=0, editable=False)
     content = CustomTextField(
         _("Nội Dung"),
         null=True,
@@ -1539,6 +1835,7 @@ class Comment(models.Model):
         verbose_name = _("Bình Luận")
         verbose_name_plural = _("Bình Luận")
         ordering = ["-created_at"]
+        indexes = [models.Index(fields=["root", "depth"])]
 
     def __str__(self):
         return (
@@ -1552,6 +1849,12 @@ class Comment(models.Model):
         return _("%s trước") % timesince.timesince(self.created_at)
 
     def save(self, *args, **kwargs):
+        if self.parent:
+            self.root_id = self.parent.root_id or self.parent.id
+            self.depth = self.parent.depth + 1
+        else:
+            self.root = None
+            self.depth = 0
         self.full_clean()
         super().save(*args, **kwargs)
 
@@ -1592,7 +1895,11 @@ class Notification(models.Model):
         _("Liên Kết"), null=True, blank=True
     )  # Đường dẫn đến chi tiết đơn hàng, khuyến mãi, v.v.
     created_at = models.DateTimeField(_("Ngày Tạo"), auto_now_add=True)
-    updated_at = models.DateTimeField(_("Ngày Cập Nhật"), auto_now=True)
+    updated_at = models.DateTimeField(
+        _("Ngày Cập Nhật"), auto_now=True, db_index=True
+    )
+
+    objects = NotificationManager()
 
     def __str__(self):
         return f"{self.user.full_name if self.user else 'GENERAL'} - {self.title}"
@@ -1606,6 +1913,38 @@ class Notification(models.Model):
     def timesince(self):
         return _("%s ago") % timesince.timesince(self.updated_at)
 
+    def is_read_by(self, user):
+        return (
+            Notification.objects.filter(pk=self.pk)
+            .with_read_state(user)
+            .values_list("is_read", flat=True)
+            .first()
+        )
+
+
+class NotificationReadMarker(models.Model):
+    """
+    Mốc "đọc tất cả" của user: mọi thông báo cập nhật trước read_until được xem là đã đọc,
+    không cần tạo NotificationRead cho từng thông báo chung.
+    """
+
+    user = models.OneToOneField(
+        User,
+        verbose_name=_("Tài Khoản"),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="notification_read_marker",
+    )
+    read_until = models.DateTimeField(_("Đã Đọc Đến"))
+    updated_at = models.DateTimeField(_("Ngày Cập Nhật"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Mốc Đọc Thông Báo")
+        verbose_name_plural = _("Mốc Đọc Thông Báo")
+
+    def __str__(self):
+        return f"{self.user.email} - {self.read_until}"
+
 
 class NotificationRead(models.Model):
     user = models.ForeignKey(
@@ -1738,6 +2077,16 @@ class ChatRoom(models.Model):
             self.name = get_random_string(8)
         super().save(*args, **kwargs)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lưu trạng thái và người tiếp nhận ban đầu để cập nhật hàng đợi phân phối chat
+        instance._loaded_assignment = (
+            instance.__dict__.get("status"),
+            instance.__dict__.get("recipient_id"),
+        )
+        return instance
+
 
 class ChatMessage(models.Model):
     chat_room = models.ForeignKey(
@@ -1745,7 +2094,16 @@ class ChatMessage(models.Model):
     )
     content = models.TextField()
     sender = models.ForeignKey(ChatUser, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Thời điểm nhận tin nhắn (tin nhắn được ghi xuống DB theo lô sau đó)
+    created_at = models.DateTimeField(default=now)
+    # Id của tin nhắn trong Redis stream, tránh ghi trùng khi flush lại
+    stream_id = models.CharField(
+        max_length=32, unique=True, null=True, blank=True, editable=False
+    )
+
+    class Meta:
+        # Lịch sử chat được đọc theo cửa sổ (chat_room, created_at, id)
+        indexes = [models.Index(fields=["chat_room", "created_at", "id"])]
 
     def __str__(self):
         return f"{self.sender.name }: {self.content[:50]} - {self.created_at}"
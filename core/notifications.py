@@ -0,0 +1,114 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from core.models import Notification
+
+# Số thông báo chưa đọc của user được lưu trong hash: count là số thông báo riêng
+# (và điều chỉnh khi đọc), seq là giá trị bộ đếm thông báo chung tại lần đồng bộ cuối.
+# Thông báo chung mới chỉ tăng BROADCAST_SEQ_KEY, số chưa đọc của mỗi user được
+# cộng thêm (BROADCAST_SEQ_KEY - seq) khi đọc.
+UNREAD_KEY = "notification_unread_{}"
+BROADCAST_SEQ_KEY = "notification_broadcast_seq"
+UNREAD_TIMEOUT = 60 * 60 * 24 * 7
+
+# Chỉ tăng khi hash đã tồn tại (chưa có thì sẽ được tính lại từ DB khi đọc)
+INCREMENT_IF_EXISTS = """
+if redis.call("exists", KEYS[1]) == 1 then
+    return redis.call("hincrby", KEYS[1], "count", ARGV[1])
+end
+return nil
+"""
+
+
+def _connection():
+    return get_redis_connection("default")
+
+
+def _unread_key(user_id):
+    return cache.make_key(UNREAD_KEY.format(user_id))
+
+
+def change_unread_count(user_id, amount):
+    """Tăng/giảm số thông báo riêng chưa đọc của user"""
+    if user_id and amount:
+        _connection().eval(INCREMENT_IF_EXISTS, 1, _unread_key(user_id), amount)
+
+
+def change_unread_counts(counts):
+    """Như change_unread_count cho nhiều user ({user_id: số lượng}) trong một pipeline"""
+    counts = {user_id: amount for user_id, amount in counts.items() if amount}
+    if not counts:
+        return
+    pipeline = _connection().pipeline(transaction=False)
+    for user_id, amount in counts.items():
+        pipeline.eval(INCREMENT_IF_EXISTS, 1, _unread_key(user_id), amount)
+    pipeline.execute()
+
+
+def bump_broadcast_count():
+    """Có thông báo chung mới: tất cả user được tính thêm một thông báo chưa đọc"""
+    _connection().incr(cache.make_key(BROADCAST_SEQ_KEY))
+
+
+def reset_unread_count(user_id, count=0):
+    """Ghi lại số chưa đọc của user (sau khi đọc tất cả hoặc đối chiếu với DB)"""
+    connection = _connection()
+    seq = int(connection.get(cache.make_key(BROADCAST_SEQ_KEY)) or 0)
+    key = _unread_key(user_id)
+    pipeline = connection.pipeline()
+    pipeline.hset(key, mapping={"count": count, "seq": seq})
+    pipeline.expire(key, UNREAD_TIMEOUT)
+    pipeline.execute()
+
+
+def get_unread_count(user):
+    """Số thông báo chưa đọc của user, O(1) khi đã có trong Redis"""
+    connection = _connection()
+    pipeline = connection.pipeline(transaction=False)
+    pipeline.hmget(_unread_key(user.id), "count", "seq")
+    pipeline.get(cache.make_key(BROADCAST_SEQ_KEY))
+    (count, seq), broadcast_seq = pipeline.execute()
+    if count is None or seq is None:
+        return reconcile_unread_count(user)
+    return max(0, int(count) + int(broadcast_seq or 0) - int(seq))
+
+
+def reconcile_unread_count(user):
+    """Tính lại số chưa đọc từ DB và ghi đè giá trị trong Redis"""
+    count = Notification.objects.unread_for(user).count()
+    reset_unread_count(user.id, count)
+    return count
+
+
+def iter_counter_user_ids():
+    """Các user đang có bộ đếm trong Redis"""
+    prefix, suffix = cache.make_key(UNREAD_KEY).split("{}")
+    for key in _connection().scan_iter(match=f"{prefix}*{suffix}", count=1000):
+        key = key.decode()
+        user_id = key[len(prefix) : len(key) - len(suffix)]
+        if user_id.isdigit():
+            yield int(user_id)
+
+
+def send_notifications(messages):
+    """Gửi nhiều thông báo qua WebSocket trong một lần. messages: [(user_id, data)]"""
+    if not messages:
+        return
+    channel_layer = get_channel_layer()
+
+    async def send_all():
+        await asyncio.gather(
+            *(
+                channel_layer.group_send(
+                    f"user_{user_id}_notification",
+                    {"type": "send_notification", "data": data},
+                )
+                for user_id, data in messages
+            )
+        )
+
+    async_to_sync(send_all)()
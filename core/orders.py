@@ -0,0 +1,169 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils.timesince import timesince
+from django.utils.timezone import now
+from django.utils.translation import gettext as _
+
+from core.models import Notification, Order, OrderItem, OrderStatusHistory, Product
+from core.notifications import change_unread_counts, send_notifications
+from core.tasks import run_in_background
+
+# Các trạng thái mà đơn hàng đã từng được giao (tính vào số lượng đã bán)
+DELIVERED_STATUSES = [
+    "delivered",
+    "return_requested",
+    "return_approved",
+    "return_rejected",
+    "returned",
+    "refund_processed",
+]
+
+
+def _sold_quantity(order_items):
+    """Subquery tổng số lượng đã bán của sản phẩm (OuterRef) trong order_items"""
+    return Coalesce(
+        Subquery(
+            order_items.filter(product_id=OuterRef("id"))
+            .order_by()
+            .values("product_id")
+            .annotate(quantity=Sum("quantity"))
+            .values("quantity")
+        ),
+        Value(0),
+    )
+
+
+def add_sales_counts(order_ids):
+    """
+    Cộng số lượng đã bán của các đơn hàng vào Product.sale_count bằng một câu UPDATE
+    (gom theo sản phẩm, cộng bằng F() nên không mất lượt cộng khi chạy đồng thời).
+    """
+    order_ids = set(order_ids)
+    if not order_ids:
+        return 0
+    order_items = OrderItem.objects.filter(order_id__in=order_ids)
+    return Product.objects.filter(id__in=order_items.values("product_id")).update(
+        sale_count=F("sale_count") + _sold_quantity(order_items)
+    )
+
+
+def rebuild_sales_counts():
+    """Tính lại sale_count của toàn bộ sản phẩm từ các đơn hàng đã giao"""
+    order_items = OrderItem.objects.filter(order__status__in=DELIVERED_STATUSES)
+    return Product.objects.update(sale_count=_sold_quantity(order_items))
+
+
+def transition_orders(order_ids, new_status, user=None):
+    """
+    Chuyển trạng thái nhiều đơn hàng cùng lúc.
+    Khóa và kiểm tra các đơn hàng bằng một truy vấn, cập nhật bằng một câu UPDATE,
+    tạo lịch sử và thông báo bằng bulk_create, gửi thông báo sau khi commit.
+    Trả về danh sách lỗi cùng thứ tự với order_ids ({} nếu hợp lệ); có lỗi thì không
+    đơn hàng nào bị thay đổi.
+    """
+    order_ids = list(order_ids)
+    if new_status not in dict(Order.STATUS_CHOICES):
+        error = {"status": _("Trạng thái đơn hàng không hợp lệ.")}
+        return [error for order_id in order_ids]
+
+    valid_transitions = Order.get_valid_transitions()
+    with transaction.atomic():
+        # Khóa theo thứ tự id để các lượt chuyển đồng thời không bị deadlock
+        orders = {
+            order.id: order
+            for order in Order.objects.select_for_update()
+            .filter(id__in=order_ids)
+            .only("id", "invoice", "status", "user_id")
+            .order_by("id")
+        }
+
+        errors = []
+        for order_id in order_ids:
+            order = orders.get(order_id)
+            if order is None:
+                errors.append({"id": _("Đơn hàng ID %s không tồn tại.") % order_id})
+            elif new_status not in valid_transitions.get(order.status, []):
+                errors.append(
+                    {
+                        "status": _("Không thể chuyển trạng thái từ '%s' sang '%s'.")
+                        % (order.status, new_status)
+                    }
+                )
+            else:
+                errors.append({})
+        if any(errors):
+            return errors
+
+        current = now()
+        Order.objects.filter(id__in=orders).update(
+            status=new_status, updated_at=current
+        )
+        if new_status == "delivered":
+            add_sales_counts(orders)
+
+        message = OrderStatusHistory.STATUS_MESSAGES.get(
+            new_status, {"title": new_status, "description": ""}
+        )
+        OrderStatusHistory.objects.bulk_create(
+            OrderStatusHistory(
+                order_id=order.id,
+                previous_status=order.status,
+                new_status=new_status,
+                title=message["title"],
+                description=message["description"],
+                created_by=user,
+            )
+            for order in orders.values()
+        )
+
+        # Ảnh của sản phẩm đầu tiên trong mỗi đơn hàng
+        images = dict(
+            OrderItem.objects.filter(order_id__in=orders)
+            .order_by("order_id", "id")
+            .distinct("order_id")
+            .values_list("order_id", "image")
+        )
+        # bulk_create không gửi signal send_order_status_notification
+        notifications = Notification.objects.bulk_create(
+            Notification(
+                user_id=order.user_id,
+                title=f"Đơn hàng {order.invoice}",
+                message=message["description"],
+                notification_type="ORDER_STATUS",
+                image=images.get(order.id),
+                link=reverse("store:order_detail", kwargs={"invoice": order.invoice}),
+            )
+            for order in orders.values()
+        )
+        transaction.on_commit(
+            lambda: run_in_background(dispatch_order_notifications, notifications)
+        )
+    return errors
+
+
+def dispatch_order_notifications(notifications):
+    """Cập nhật bộ đếm chưa đọc và gửi thông báo qua WebSocket trong một lần"""
+    change_unread_counts(
+        Counter(notification.user_id for notification in notifications)
+    )
+    send_notifications(
+        [
+            (
+                notification.user_id,
+                {
+                    "id": notification.id,
+                    "title": notification.title,
+                    "message": notification.message,
+                    "notification_type": notification.notification_type,
+                    "image": notification.image.url if notification.image else None,
+                    "link": notification.link,
+                    "timesince": _("%s trước") % timesince(notification.created_at),
+                },
+            )
+            for notification in notifications
+        ]
+    )
@@ -0,0 +1,139 @@
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import islice
+
+from django.db.models import Q
+from django.utils.timezone import now
+
+from core.listing import refresh_listing_summaries
+from core.models import PromotionItem, Variant, VariantEffectivePrice
+
+REFRESH_CHUNK_SIZE = 1000
+
+EFFECTIVE_PRICE_UPDATE_FIELDS = [
+    "promotion",
+    "discount_type",
+    "discount_value",
+    "discount_price",
+    "discount",
+    "promotion_start",
+    "promotion_end",
+    "valid_until",
+    "updated_at",
+]
+
+
+def calculate_discount(price, discount_type, discount_value):
+    """Tính (giá sau giảm, phần trăm giảm) cho một mức khuyến mãi"""
+    price = Decimal(price or 0)
+    discount_value = Decimal(discount_value or 0)
+    if discount_type == "amount":
+        discount_price = max(price - discount_value, Decimal(0))
+    elif discount_type == "percent":
+        discount_price = price * (100 - discount_value) / 100
+    else:
+        return price, 0
+
+    discount_price = discount_price.quantize(Decimal("1"), rounding=ROUND_HALF_UP)
+    discount = (
+        int(((price - discount_price) / price * 100).to_integral_value(ROUND_HALF_UP))
+        if price
+        else 0
+    )
+    return discount_price, discount
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _build_effective_price(variant_id, price, items, current):
+    """Chọn khuyến mãi đang chạy có giá thấp nhất và thời điểm cần tính lại"""
+    best = None
+    next_change = None
+    for item in items:
+        start, end = item["promotion__start_date"], item["promotion__end_date"]
+        if start > current:
+            # Khuyến mãi sắp diễn ra: giá cần được tính lại khi bắt đầu
+            next_change = min(next_change or start, start)
+            continue
+
+        discount_price, discount = calculate_discount(
+            price, item["discount_type"], item["discount_value"]
+        )
+        if best is None or discount_price < best["discount_price"]:
+            best = {
+                "promotion_id": item["promotion_id"],
+                "discount_type": item["discount_type"],
+                "discount_value": item["discount_value"],
+                "discount_price": discount_price,
+                "discount": discount,
+                "promotion_start": start,
+                "promotion_end": end,
+            }
+        next_change = min(next_change or end, end)
+
+    if best is None:
+        best = {"discount_price": price, "discount": 0}
+    return VariantEffectivePrice(
+        variant_id=variant_id, valid_until=next_change, updated_at=current, **best
+    )
+
+
+def refresh_variant_prices(variant_ids=None):
+    """
+    Tính lại bảng giá hiệu lực cho các variant (None = toàn bộ) và dữ liệu
+    hiển thị danh sách của sản phẩm tương ứng. Trả về tập product_id bị ảnh hưởng.
+    """
+    variants = Variant.objects.order_by("id")
+    if variant_ids is not None:
+        variant_ids = set(variant_ids)
+        if not variant_ids:
+            return set()
+        variants = variants.filter(id__in=variant_ids)
+
+    current = now()
+    product_ids = set()
+    rows = variants.values_list("id", "product_id", "price").iterator(
+        chunk_size=REFRESH_CHUNK_SIZE
+    )
+    for chunk in _chunked(rows, REFRESH_CHUNK_SIZE):
+        items_by_variant = {}
+        items = PromotionItem.objects.filter(
+            variant_id__in=[variant_id for variant_id, _, _ in chunk],
+            promotion__end_date__gt=current,
+        ).values(
+            "variant_id",
+            "promotion_id",
+            "discount_type",
+            "discount_value",
+            "promotion__start_date",
+            "promotion__end_date",
+        )
+        for item in items:
+            items_by_variant.setdefault(item["variant_id"], []).append(item)
+
+        VariantEffectivePrice.objects.bulk_create(
+            [
+                _build_effective_price(
+                    variant_id, price, items_by_variant.get(variant_id, []), current
+                )
+                for variant_id, _, price in chunk
+            ],
+            update_conflicts=True,
+            unique_fields=["variant"],
+            update_fields=EFFECTIVE_PRICE_UPDATE_FIELDS,
+        )
+        product_ids.update(product_id for _, product_id, _ in chunk)
+
+    refresh_listing_summaries(product_ids)
+    return product_ids
+
+
+def refresh_expired_variant_prices():
+    """Tính lại giá cho các variant đã tới thời điểm bắt đầu/kết thúc khuyến mãi"""
+    variant_ids = Variant.objects.filter(
+        Q(effective_price__isnull=True) | Q(effective_price__valid_until__lte=now())
+    ).values_list("id", flat=True)
+    return refresh_variant_prices(list(variant_ids))
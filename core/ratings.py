@@ -0,0 +1,60 @@
+from django.db.models import Count, F, Q, Sum
+
+from core.models import ProductRatingStats, Review
+
+SCORES = range(1, 6)
+
+
+def change_rating_stats(product_id, score, amount):
+    """Cộng/trừ một lượt đánh giá `score` sao vào thống kê của sản phẩm bằng F()"""
+    if not product_id or score not in SCORES or not amount:
+        return
+    stats = ProductRatingStats.objects.filter(product_id=product_id)
+    changes = {
+        f"rating_{score}": F(f"rating_{score}") + amount,
+        "score_sum": F("score_sum") + score * amount,
+    }
+    if stats.update(**changes) or amount < 0:
+        return
+    # Chưa có thống kê: tạo dòng rỗng (bỏ qua nếu request khác vừa tạo) rồi cộng
+    ProductRatingStats.objects.bulk_create(
+        [ProductRatingStats(product_id=product_id)], ignore_conflicts=True
+    )
+    stats.update(**changes)
+
+
+def apply_review_change(old, new):
+    """Cập nhật thống kê khi đánh giá đổi từ old sang new ((product_id, score) hoặc None)"""
+    if old == new:
+        return
+    if old:
+        change_rating_stats(*old, -1)
+    if new:
+        change_rating_stats(*new, 1)
+
+
+def rebuild_rating_stats():
+    """Tính lại thống kê đánh giá của toàn bộ sản phẩm bằng một truy vấn gom nhóm"""
+    rows = (
+        Review.objects.order_by()
+        .values("product_id")
+        .annotate(
+            score_sum=Sum("score"),
+            **{
+                f"rating_{score}": Count("id", filter=Q(score=score))
+                for score in SCORES
+            },
+        )
+    )
+    stats = ProductRatingStats.objects.bulk_create(
+        [ProductRatingStats(**row) for row in rows],
+        update_conflicts=True,
+        unique_fields=["product"],
+        update_fields=[f"rating_{score}" for score in SCORES]
+        + ["score_sum", "updated_at"],
+    )
+    # Sản phẩm không còn đánh giá nào
+    ProductRatingStats.objects.exclude(
+        product_id__in=Review.objects.values("product_id")
+    ).delete()
+    return len(stats)
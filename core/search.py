@@ -0,0 +1,103 @@
+import re
+import unicodedata
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity,
+)
+from django.db.models import F, Q
+
+from core.models import AttributeValue, Product, ProductSearchDocument
+
+SEARCH_CONFIG = "simple"
+REFRESH_CHUNK_SIZE = 500
+
+
+def fold_text(value):
+    """Bỏ dấu tiếng Việt và viết thường, vd: Điện Thoại -> dien thoai"""
+    value = unicodedata.normalize("NFD", str(value or "")).replace("đ", "d")
+    value = value.replace("Đ", "D")
+    value = "".join(char for char in value if not unicodedata.combining(char))
+    return " ".join(value.lower().split())
+
+
+def search_terms(query):
+    return re.findall(r"\w+", fold_text(query))
+
+
+def build_search_query(query):
+    """tsquery dạng tiền tố: "ao th" -> ao:* & th:* (từ cuối đang gõ dở)"""
+    terms = search_terms(query)
+    if not terms:
+        return None
+    return SearchQuery(
+        " & ".join(f"{term}:*" for term in terms),
+        config=SEARCH_CONFIG,
+        search_type="raw",
+    )
+
+
+def search_products(queryset, query):
+    """Lọc và gắn điểm liên quan (search_rank) cho queryset Product"""
+    search_query = build_search_query(query)
+    if search_query is None:
+        return queryset
+    folded = fold_text(query)
+    return queryset.annotate(
+        search_rank=SearchRank(F("search_document__search_vector"), search_query)
+        + TrigramWordSimilarity(folded, "search_document__name"),
+    ).filter(
+        Q(search_document__search_vector=search_query)
+        | Q(search_document__name__trigram_word_similar=folded)
+    )
+
+
+def _refresh_chunk(product_ids):
+    attributes = {}
+    for product_id, value in (
+        AttributeValue.objects.filter(attribute__product_id__in=product_ids)
+        .order_by("id")
+        .values_list("attribute__product_id", "value")
+    ):
+        attributes.setdefault(product_id, []).append(value)
+
+    documents = [
+        ProductSearchDocument(
+            product_id=product_id,
+            name=fold_text(name),
+            sku=fold_text(sku),
+            category=fold_text(category_name),
+            attributes=fold_text(" ".join(attributes.get(product_id, []))),
+        )
+        for product_id, name, sku, category_name in Product.objects.filter(
+            id__in=product_ids
+        ).values_list("id", "name", "sku", "category__name")
+    ]
+    ProductSearchDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=["product"],
+        update_fields=["name", "sku", "category", "attributes", "updated_at"],
+    )
+    ProductSearchDocument.objects.filter(product_id__in=product_ids).update(
+        search_vector=SearchVector("name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("sku", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("category", weight="B", config=SEARCH_CONFIG)
+        + SearchVector("attributes", weight="C", config=SEARCH_CONFIG)
+    )
+
+
+def refresh_search_documents(product_ids=None):
+    """Tính lại dữ liệu tìm kiếm cho các sản phẩm (None = toàn bộ)"""
+    products = Product.objects.order_by("id")
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        products = products.filter(id__in=product_ids)
+
+    product_ids = list(products.values_list("id", flat=True))
+    for start in range(0, len(product_ids), REFRESH_CHUNK_SIZE):
+        _refresh_chunk(product_ids[start : start + REFRESH_CHUNK_SIZE])
@@ -1,29 +1,17 @@
 import os
 import shutil
+from functools import partial
 from django.conf import settings
+from django.db import transaction
 from django.dispatch import receiver
 from django.db.models.signals import post_delete, pre_save, post_save, m2m_changed
-from django.db.models import (
-    Prefetch,
-    OuterRef,
-    Subquery,
-    Case,
-    When,
-    Count,
-    Value,
-    F,
-    ExpressionWrapper,
-    DecimalField,
-    IntegerField,
-)
+from django.db.models import F
 from django.urls import reverse
 from django.utils.timesince import timesince
-from django.utils.timezone import now
-from api.serializers import CartSerializer
 from .models import (
     AttributeValue,
-    Cart,
     CartItem,
+    ChatRoom,
     ChatUser,
     Gallery,
     Notification,
@@ -37,7 +25,22 @@ from .models import (
     NotificationSettings,
     Comment,
     Variant,
+    Promotion,
+    PromotionItem,
+    ImageSnapshot,
+    ProductAttribute,
 )
+from .cache import invalidate_catalog
+from .carts import queue_cart_update
+from .chat_dispatch import apply_room_change
+from .listing import refresh_listing_summaries
+from .notifications import bump_broadcast_count, change_unread_count
+from .images import delete_derivatives, queue_image_derivatives
+from .pricing import refresh_variant_prices
+from .ratings import apply_review_change
+from .search import refresh_search_documents
+from .snapshots import is_default_image, snapshot_source_image
+from .tasks import run_after_commit
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import gettext_lazy as _
 from django.core.cache import cache
@@ -70,6 +73,7 @@ def delete_old_image_on_change(instance, field_name):
             ):
                 # Delete the old image file
                 print("Delete old image file:", old_image)
+                delete_derivatives(old_image.name)
                 old_image.delete(save=False)
 
         except Exception:
@@ -123,6 +127,7 @@ def delete_image_on_delete(instance, field_name):
         try:
             # Kiểm tra file có tồn tại và không phải ảnh mặc định
             if image and image.path != default_path and os.path.isfile(image.path):
+                delete_derivatives(image.name)
                 image.delete(save=False)
         except Exception as e:
             # Trường hợp đối tượng hoặc file không tồn tại
@@ -231,14 +236,85 @@ def delete_related_order_and_folder_image_on_delete(sender, instance, **kwargs):
 
 @receiver(post_delete, sender=OrderItem)
 def delete_image_order_item_on_delete(sender, instance, **kwargs):
-    delete_image_on_delete(instance, "image")
+    if instance.snapshot_id:
+        # Ảnh dùng chung: chỉ giảm số tham chiếu, file được dọn bởi prune_image_snapshots
+        ImageSnapshot.objects.filter(
+            id=instance.snapshot_id, ref_count__gt=0
+        ).update(ref_count=F("ref_count") - 1)
+    elif instance.image.name.startswith("images/order/"):
+        # Ảnh sao chép riêng cho đơn hàng (đơn hàng cũ)
+        delete_image_on_delete(instance, "image")
+
+
+@receiver(post_save, sender=Gallery)
+@receiver(post_save, sender=AttributeValue)
+def snapshot_image_on_upload(sender, instance, created, **kwargs):
+    """Tạo snapshot cho ảnh mới tải lên (chạy nền sau khi commit)"""
+    name = instance.image.name if instance.image else None
+    if not created and name == getattr(instance, "_loaded_image", None):
+        return
+    instance._loaded_image = name
+    if instance.snapshot_id:
+        # Ảnh đã đổi, snapshot cũ không còn đúng
+        sender.objects.filter(pk=instance.pk).update(snapshot=None)
+        instance.snapshot_id = None
+    if not is_default_image(name):
+        run_after_commit(snapshot_source_image, sender._meta.label, instance.pk, name)
+
+
+# Trường ảnh của các model cần tạo ảnh phái sinh
+IMAGE_FIELDS = {
+    Gallery: "image",
+    AttributeValue: "image",
+    Category: "image",
+    User: "avatar",
+}
+
+
+@receiver(pre_save, sender=Gallery)
+@receiver(pre_save, sender=AttributeValue)
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=User)
+def mark_uploaded_image(sender, instance, **kwargs):
+    # File mới tải lên chưa được ghi vào storage (_committed = False)
+    image = getattr(instance, IMAGE_FIELDS[sender])
+    instance._image_uploaded = bool(image) and not image._committed
+
+
+@receiver(post_save, sender=Gallery)
+@receiver(post_save, sender=AttributeValue)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=User)
+def queue_derivatives_on_upload(sender, instance, **kwargs):
+    """Tạo ảnh phái sinh cho ảnh mới tải lên (worker xử lý sau khi commit)"""
+    if getattr(instance, "_image_uploaded", False):
+        instance._image_uploaded = False
+        name = getattr(instance, IMAGE_FIELDS[sender]).name
+        transaction.on_commit(partial(queue_image_derivatives, name))
 
 
 @receiver(post_save, sender=Category)
 @receiver(post_delete, sender=Category)
-def clear_category_cache(sender, **kwargs):
+def clear_category_cache(sender, instance, **kwargs):
     """Xóa cache khi danh mục thay đổi."""
     cache.delete("category_list")
+    invalidate_catalog(
+        category_ids={instance.id, instance.parent_id} - {None}, category_tree=True
+    )
+
+
+@receiver([post_save, post_delete], sender=Product)
+def clear_catalog_cache_on_product_change(sender, instance, **kwargs):
+    """Vô hiệu hóa cache danh sách sản phẩm/danh mục khi sản phẩm thay đổi."""
+    loaded_category_id = getattr(instance, "_loaded_category_id", None)
+    category_ids = {instance.category_id, loaded_category_id} - {None}
+    invalidate_catalog(
+        product_ids=[instance.id],
+        category_ids=category_ids,
+        # Số lượng sản phẩm của danh mục chỉ đổi khi thêm/xóa/chuyển danh mục
+        category_tree=kwargs.get("created", True)
+        or loaded_category_id != instance.category_id,
+    )
 
 
 @receiver(post_delete, sender=Review)
@@ -290,9 +366,7 @@ def notify_comment_reply(sender, instance, created, **kwargs):
                 .order_by("-created_at")
                 .first()
             )
-            if not notification or (
-                notification and notification.notification_read.exists()
-            ):
+            if not notification or notification.is_read_by(comment_user):
                 # Nếu chưa có thông báo hoặc có thông báo nhưng đã đọc, tạo thông báo mới
                 title = "Có trả lời mới cho %s của bạn" % comment_or_review
                 message = "%s đã trả lời %s của bạn về sản phẩm %s." % (
@@ -320,6 +394,10 @@ def notify_comment_reply(sender, instance, created, **kwargs):
                         notification.title = title
                         notification.message = message
                         notification.save()
+                        # Thông báo đã đọc nay chưa đọc trở lại
+                        transaction.on_commit(
+                            partial(change_unread_count, comment_user.id, 1)
+                        )
                 # Lưu vào cache
                 cache.set(notification_count_key, 1, timeout=600)  # Timeout 10 phút
             else:
@@ -358,99 +436,25 @@ def notify_comment_reply(sender, instance, created, **kwargs):
                 )
 
 
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, **kwargs):
+    """Cập nhật bộ đếm thông báo chưa đọc khi có thông báo mới"""
+    if not created:
+        return
+    if instance.notification_type in Notification.FILTER_TYPES:
+        transaction.on_commit(bump_broadcast_count)
+    elif instance.user_id:
+        transaction.on_commit(partial(change_unread_count, instance.user_id, 1))
+
+
 @receiver([post_save, post_delete], sender=CartItem)
 def send_cart_update(sender, instance, **kwargs):
     """
     Gửi thông báo WebSocket khi giỏ hàng thay đổi.
+    Việc gửi được gom theo giỏ hàng và chạy nền sau khi transaction commit.
     """
-    user = instance.cart.user
-    if not user:
-        return
-
-    variant_queryset = Variant.objects.annotate(
-        image=Subquery(
-            AttributeValue.objects.filter(
-                variants=OuterRef("id"), image__isnull=False
-            ).values("image")[
-                :1
-            ]  # Lấy ảnh của thuộc tính nếu có
-        ),
-        discount_price=Case(
-            When(
-                promotion_items__promotion__start_date__lte=now(),
-                promotion_items__promotion__end_date__gte=now(),
-                promotion_items__discount_type="percent",
-                then=ExpressionWrapper(
-                    F("price") * (1 - F("promotion_items__discount_value") / 100),
-                    output_field=DecimalField(max_digits=10, decimal_places=0),
-                ),
-            ),
-            When(
-                promotion_items__promotion__start_date__lte=now(),
-                promotion_items__promotion__end_date__gte=now(),
-                promotion_items__discount_type="amount",
-                then=ExpressionWrapper(
-                    F("price") - F("promotion_items__discount_value"),
-                    output_field=DecimalField(max_digits=10, decimal_places=0),
-                ),
-            ),
-            default=F("price"),
-            output_field=DecimalField(max_digits=10, decimal_places=0),
-        ),
-        discount=Case(
-            When(
-                promotion_items__discount_type="percent",
-                then=F("promotion_items__discount_value"),
-            ),
-            When(
-                promotion_items__discount_type="amount",
-                then=(F("promotion_items__discount_value") / F("price")) * 100,
-            ),
-            default=Value(0),
-            output_field=IntegerField(),
-        ),
-    )
-
-    product_queryset = Product.objects.annotate(
-        cover_image=Subquery(
-            Gallery.objects.filter(product=OuterRef("id"))
-            .order_by("order")
-            .values("image")[:1]  # Lấy ảnh đại diện đầu tiên
-        )
-    )
-    # Query giỏ hàng của user
-    cart_queryset = (
-        Cart.objects.filter(user=user)
-        .prefetch_related(
-            Prefetch(
-                "cart_items",
-                queryset=CartItem.objects.prefetch_related(
-                    Prefetch("product", queryset=product_queryset),
-                    Prefetch(
-                        "variant", queryset=variant_queryset
-                    ),  # Gộp luôn variant với giá, ảnh, stock
-                ),
-            )
-        )
-        .annotate(
-            total_items=Count("cart_items"),
-        )
-        .first()
-    )
-
-    if not cart_queryset:
-        return
-
-    # Serialize lại giỏ hàng (đã được optimize)
-    cart_data = CartSerializer(cart_queryset).data
-
-    # Tên nhóm WebSocket của user
-    group_name = f"user_{user.id}_cart"
-
-    # Gửi thông báo WebSocket
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        group_name, {"type": "send_cart_update", "cart": cart_data}
+    queue_cart_update(
+        instance.cart_id, instance.id, deleted=kwargs["signal"] is post_delete
     )
 
 
@@ -492,4 +496,125 @@ def send_order_status_notification(sender, instance, created, **kwargs):
                 "type": "send_notification",
                 "data": notification_data,
             }
-        )
\ No newline at end of file
+        )
+
+
+@receiver(post_save, sender=Variant)
+def refresh_pricing_on_variant_save(sender, instance, update_fields=None, **kwargs):
+    """Tính lại giá hiệu lực (khi tạo variant hoặc đổi giá) và dữ liệu hiển thị của sản phẩm"""
+    if update_fields and "price" not in update_fields:
+        refresh_listing_summaries([instance.product_id])
+        return
+    refresh_variant_prices([instance.id])
+
+
+@receiver(post_delete, sender=Variant)
+def refresh_listing_summary_on_variant_delete(sender, instance, **kwargs):
+    # Chạy sau commit để bỏ qua sản phẩm bị xóa cùng lúc (cascade)
+    product_id = instance.product_id
+    transaction.on_commit(lambda: refresh_listing_summaries([product_id]))
+
+
+@receiver(post_save, sender=Review)
+def update_rating_stats_on_review_save(sender, instance, created, **kwargs):
+    """Cộng lượt đánh giá mới; khi sửa điểm thì trừ điểm cũ và cộng điểm mới"""
+    old = None if created else getattr(instance, "_loaded_rating", None)
+    new = (instance.product_id, instance.score)
+    apply_review_change(old, new)
+    instance._loaded_rating = new
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_stats_on_review_delete(sender, instance, **kwargs):
+    old = getattr(instance, "_loaded_rating", None) or (
+        instance.product_id,
+        instance.score,
+    )
+    apply_review_change(old, None)
+
+
+@receiver([post_save, post_delete], sender=Gallery)
+@receiver([post_save, post_delete], sender=Review)
+def refresh_listing_summary_on_change(sender, instance, **kwargs):
+    """Cập nhật ảnh đại diện / điểm đánh giá trong dữ liệu hiển thị của sản phẩm"""
+    product_id = instance.product_id
+    transaction.on_commit(lambda: refresh_listing_summaries([product_id]))
+
+
+@receiver(post_save, sender=PromotionItem)
+def refresh_effective_price_on_promotion_item_save(sender, instance, **kwargs):
+    """Tính lại giá hiệu lực của variant khi thêm/sửa khuyến mãi"""
+    refresh_variant_prices([instance.variant_id])
+
+
+@receiver(post_delete, sender=PromotionItem)
+def refresh_effective_price_on_promotion_item_delete(sender, instance, **kwargs):
+    # Chạy sau commit để bỏ qua variant bị xóa cùng lúc (cascade)
+    variant_id = instance.variant_id
+    transaction.on_commit(lambda: refresh_variant_prices([variant_id]))
+
+
+@receiver(post_save, sender=Promotion)
+def refresh_effective_price_on_promotion_change(sender, instance, created, **kwargs):
+    """Tính lại giá hiệu lực khi thời gian chương trình khuyến mãi thay đổi"""
+    if created:
+        return
+    refresh_variant_prices(
+        instance.promotion_items.values_list("variant_id", flat=True)
+    )
+
+
+@receiver(post_save, sender=Product)
+def refresh_search_document_on_product_save(sender, instance, **kwargs):
+    """Cập nhật dữ liệu tìm kiếm (tên, sku, danh mục) của sản phẩm"""
+    transaction.on_commit(partial(refresh_search_documents, [instance.id]))
+
+
+@receiver(post_save, sender=Category)
+def refresh_search_documents_on_category_save(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(
+            partial(
+                refresh_search_documents,
+                Product.objects.filter(category=instance).values_list("id", flat=True),
+            )
+        )
+
+
+@receiver([post_save, post_delete], sender=AttributeValue)
+def refresh_search_document_on_attribute_value_change(sender, instance, **kwargs):
+    product_id = (
+        ProductAttribute.objects.filter(id=instance.attribute_id)
+        .values_list("product_id", flat=True)
+        .first()
+    )
+    if product_id:
+        transaction.on_commit(partial(refresh_search_documents, [product_id]))
+
+
+@receiver(post_delete, sender=ProductAttribute)
+def refresh_search_document_on_attribute_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(refresh_search_documents, [instance.product_id]))
+
+
+@receiver(post_save, sender=ChatRoom)
+def update_chat_dispatch_on_room_save(sender, instance, created, **kwargs):
+    """Đưa phòng mới vào hàng đợi, cập nhật số phòng của nhân viên khi đổi trạng thái"""
+    old = None if created else getattr(instance, "_loaded_assignment", None)
+    new = (instance.status, instance.recipient_id)
+    if old != new:
+        transaction.on_commit(
+            partial(apply_room_change, instance.id, instance.created_at, old, new)
+        )
+    instance._loaded_assignment = new
+
+
+@receiver(post_delete, sender=ChatRoom)
+def update_chat_dispatch_on_room_delete(sender, instance, **kwargs):
+    old = getattr(instance, "_loaded_assignment", None) or (
+        instance.status,
+        instance.recipient_id,
+    )
+    transaction.on_commit(
+        partial(apply_room_change, instance.id, instance.created_at, old, None)
+    )
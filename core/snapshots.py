@@ -0,0 +1,141 @@
+import hashlib
+import os
+import shutil
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db.models import Case, F, IntegerField, Value, When
+
+from core.models import AttributeValue, Gallery, ImageSnapshot, OrderItem
+
+SNAPSHOT_DIR = "images/snapshots"
+DEFAULT_IMAGES = {"images/NoImage.png", "images/NoImage.png/"}
+
+
+def is_default_image(name):
+    return not name or name in DEFAULT_IMAGES
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link_or_copy(source, target):
+    """Tạo hard link (không tốn thêm dung lượng), không được thì sao chép"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        # Khác phân vùng hoặc hệ thống file không hỗ trợ hard link.
+        # copyfile dùng copy_file_range nên có thể reflink (copy-on-write) nếu được hỗ trợ
+        tmp_target = f"{target}.tmp{os.getpid()}"
+        shutil.copyfile(source, tmp_target)
+        os.replace(tmp_target, target)
+
+
+def create_snapshot(name):
+    """
+    Tạo (hoặc dùng lại) snapshot bất biến cho file ảnh `name`.
+    Trả về None nếu file không tồn tại.
+    """
+    if is_default_image(name) or not default_storage.exists(name):
+        return None
+
+    source = default_storage.path(name)
+    digest = _file_digest(source)
+    snapshot = ImageSnapshot.objects.filter(digest=digest).first()
+    if snapshot:
+        return snapshot
+
+    extension = os.path.splitext(name)[1].lower()
+    snapshot_name = f"{SNAPSHOT_DIR}/{digest[:2]}/{digest}{extension}"
+    _link_or_copy(source, default_storage.path(snapshot_name))
+    snapshot, _ = ImageSnapshot.objects.get_or_create(
+        digest=digest, defaults={"image": snapshot_name}
+    )
+    # Gắn snapshot cho các ảnh nguồn đang dùng file này
+    for model in (Gallery, AttributeValue):
+        model.objects.filter(image=name, snapshot__isnull=True).update(
+            snapshot=snapshot
+        )
+    return snapshot
+
+
+def snapshot_source_image(model_label, pk, name):
+    """Tạo snapshot cho ảnh Gallery/AttributeValue vừa tải lên (chạy nền)"""
+    model = apps.get_model(model_label)
+    snapshot = create_snapshot(name)
+    if snapshot:
+        model.objects.filter(pk=pk, image=name).update(snapshot=snapshot)
+
+
+def change_snapshot_refs(counts):
+    """Tăng/giảm số tham chiếu của nhiều snapshot bằng một câu UPDATE"""
+    counts = {
+        snapshot_id: count
+        for snapshot_id, count in counts.items()
+        if snapshot_id and count
+    }
+    if not counts:
+        return
+    ImageSnapshot.objects.filter(id__in=counts).update(
+        ref_count=F("ref_count")
+        + Case(
+            *(
+                When(id=snapshot_id, then=Value(count))
+                for snapshot_id, count in counts.items()
+            ),
+            output_field=IntegerField(),
+        )
+    )
+
+
+def snapshot_order_items(order_id):
+    """
+    Gắn snapshot cho các dòng đơn hàng đang tham chiếu trực tiếp ảnh nguồn
+    (ảnh nguồn chưa có snapshot lúc đặt hàng). Chạy nền sau khi đặt hàng.
+    """
+    items = OrderItem.objects.filter(order_id=order_id, snapshot__isnull=True)
+    names = set(items.values_list("image", flat=True))
+    counts = {}
+    for name in names:
+        if is_default_image(name):
+            continue
+        snapshot = create_snapshot(name)
+        if snapshot:
+            counts[snapshot.id] = items.filter(image=name).update(
+                image=snapshot.image.name, snapshot=snapshot
+            )
+    change_snapshot_refs(counts)
+
+
+def prune_snapshots():
+    """Xóa các snapshot không còn được dòng đơn hàng hay ảnh nguồn nào tham chiếu"""
+    snapshots = (
+        ImageSnapshot.objects.filter(ref_count=0)
+        .exclude(
+            id__in=Gallery.objects.filter(snapshot__isnull=False).values("snapshot_id")
+        )
+        .exclude(
+            id__in=AttributeValue.objects.filter(snapshot__isnull=False).values(
+                "snapshot_id"
+            )
+        )
+        .exclude(
+            id__in=OrderItem.objects.filter(snapshot__isnull=False).values(
+                "snapshot_id"
+            )
+        )
+    )
+    deleted = 0
+    for snapshot in snapshots.iterator():
+        snapshot.image.delete(save=False)
+        snapshot.delete()
+        deleted += 1
+    return deleted
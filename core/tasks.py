@@ -0,0 +1,32 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "BACKGROUND_THREADS", 4),
+    thread_name_prefix="background",
+)
+
+
+def run_in_background(func, *args, **kwargs):
+    """Chạy func trong thread nền của tiến trình hiện tại (không chặn request)"""
+
+    def run():
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Tác vụ nền %s bị lỗi", func.__qualname__)
+        finally:
+            # Thread nền dùng kết nối DB riêng, cần đóng khi xong
+            close_old_connections()
+
+    return _executor.submit(run)
+
+
+def run_after_commit(func, *args, **kwargs):
+    """Chạy func trong thread nền sau khi transaction hiện tại commit"""
+    transaction.on_commit(lambda: run_in_background(func, *args, **kwargs))
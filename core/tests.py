@@ -1,3 +1,248 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+
+from core.models import (
+    Category,
+    Order,
+    Product,
+    Promotion,
+    PromotionItem,
+    User,
+    Variant,
+    VariantEffectivePrice,
+)
+from core.pricing import refresh_expired_variant_prices, refresh_variant_prices
+
+ROW_COUNT = 25
+
+
+class AdminChangelistQueryCountTests(TestCase):
+    """Số truy vấn của trang danh sách trong admin không phụ thuộc số dòng mỗi trang"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+            full_name="Admin",
+            is_active=True,
+        )
+        # bulk_create không gửi signal (cache, dữ liệu tìm kiếm, ...)
+        category = Category.objects.bulk_create(
+            [Category(name="Danh mục", slug="danh-muc")]
+        )[0]
+        products = Product.objects.bulk_create(
+            Product(
+                sku=f"SKU{index}",
+                name=f"Sản phẩm kiểm tra {index}",
+                slug=f"san-pham-kiem-tra-{index}",
+                category=category,
+                detail="",
+            )
+            for index in range(ROW_COUNT)
+        )
+        variants = Variant.objects.bulk_create(
+            Variant(product=product, name="Mặc định", price=100000, stock=10)
+            for product in products
+        )
+        promotion = Promotion.objects.bulk_create(
+            [Promotion(name="Khuyến mãi", end_date=now() + timedelta(days=7))]
+        )[0]
+        PromotionItem.objects.bulk_create(
+            PromotionItem(
+                promotion=promotion,
+                product=variant.product,
+                variant=variant,
+                discount_type="percent",
+                discount_value=10,
+            )
+            for variant in variants
+        )
+        date_prefix = now().strftime("%Y%m%d")
+        Order.objects.bulk_create(
+            Order(user=cls.admin_user, invoice=f"VN-{date_prefix}{index:04d}")
+            for index in range(ROW_COUNT)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def get_changelist(self, model, list_per_page):
+        model_admin = admin.site._registry[model]
+        url = reverse(
+            f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist"
+        )
+        with mock.patch.object(model_admin, "list_per_page", list_per_page):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(response.context["cl"].result_list), min(list_per_page, ROW_COUNT)
+        )
+        return response
+
+    def assertFixedQueryCount(self, model):
+        # Request đầu tiên nạp các cache dùng chung (content type, ...)
+        self.get_changelist(model, 5)
+        with CaptureQueriesContext(connection) as queries:
+            self.get_changelist(model, 5)
+        with self.assertNumQueries(len(queries)):
+            self.get_changelist(model, ROW_COUNT)
+
+    def test_product_changelist(self):
+        self.assertFixedQueryCount(Product)
+
+    def test_variant_changelist(self):
+        self.assertFixedQueryCount(Variant)
+
+    def test_order_changelist(self):
+        self.assertFixedQueryCount(Order)
+
+    def test_promotion_item_changelist(self):
+        self.assertFixedQueryCount(PromotionItem)
+
+
+class VariantEffectivePriceTests(TestCase):
+    """Bảng giá hiệu lực chọn khuyến mãi thấp nhất và đổi giá đúng thời điểm"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.start = now()
+        # bulk_create không gửi signal (tự tính lại giá khi lưu)
+        category = Category.objects.bulk_create(
+            [Category(name="Danh mục", slug="danh-muc")]
+        )[0]
+        product = Product.objects.bulk_create(
+            [
+                Product(
+                    sku="SKU1",
+                    name="Sản phẩm kiểm tra",
+                    slug="san-pham-kiem-tra",
+                    category=category,
+                    detail="",
+                )
+            ]
+        )[0]
+        cls.variant = Variant.objects.bulk_create(
+            [Variant(product=product, name="Đỏ", price=100000, stock=10)]
+        )[0]
+        # Giảm 10%, đang chạy, kết thúc sau 5 ngày
+        cls.percent_promotion, cls.amount_promotion, cls.upcoming_promotion = (
+            Promotion.objects.bulk_create(
+                [
+                    Promotion(
+                        name="Giảm 10%",
+                        start_date=cls.start - timedelta(days=1),
+                        end_date=cls.start + timedelta(days=5),
+                    ),
+                    # Giảm 30.000đ, đang chạy, kết thúc sau 2 ngày
+                    Promotion(
+                        name="Giảm 30.000đ",
+                        start_date=cls.start - timedelta(days=1),
+                        end_date=cls.start + timedelta(days=2),
+                    ),
+                    # Giảm 50%, bắt đầu sau 1 ngày, kết thúc sau 3 ngày
+                    Promotion(
+                        name="Giảm 50%",
+                        start_date=cls.start + timedelta(days=1),
+                        end_date=cls.start + timedelta(days=3),
+                    ),
+                ]
+            )
+        )
+        PromotionItem.objects.bulk_create(
+            PromotionItem(
+                promotion=promotion,
+                product=product,
+                variant=cls.variant,
+                discount_type=discount_type,
+                discount_value=discount_value,
+            )
+            for promotion, discount_type, discount_value in [
+                (cls.percent_promotion, "percent", 10),
+                (cls.amount_promotion, "amount", 30000),
+                (cls.upcoming_promotion, "percent", 50),
+            ]
+        )
+
+    def at(self, days, refresh=refresh_expired_variant_prices):
+        """Chạy `refresh` tại thời điểm start + days (ngày) và trả về giá hiệu lực"""
+        current = self.start + timedelta(days=days)
+        with mock.patch("core.pricing.now", return_value=current):
+            refresh()
+        return VariantEffectivePrice.objects.get(variant=self.variant)
+
+    def assertPrice(self, price, discount_price, promotion, valid_until_days):
+        self.assertEqual(price.discount_price, discount_price)
+        self.assertEqual(price.promotion_id, promotion and promotion.id)
+        if valid_until_days is None:
+            self.assertIsNone(price.valid_until)
+        else:
+            self.assertEqual(
+                price.valid_until, self.start + timedelta(days=valid_until_days)
+            )
+
+    def test_picks_lowest_active_promotion(self):
+        price = self.at(0, lambda: refresh_variant_prices([self.variant.id]))
+        # 70.000đ < 90.000đ, khuyến mãi 50% chưa bắt đầu nên chưa được áp dụng
+        self.assertPrice(price, 70000, self.amount_promotion, 1)
+        self.assertEqual(price.discount, 30)
+
+    def test_expired_prices_flip_at_promotion_start_and_end(self):
+        self.assertPrice(self.at(0), 70000, self.amount_promotion, 1)
+        # Chưa tới valid_until: giá không được tính lại
+        with mock.patch(
+            "core.pricing.now", return_value=self.start + timedelta(hours=12)
+        ):
+            self.assertEqual(refresh_expired_variant_prices(), set())
+
+        # Khuyến mãi 50% bắt đầu
+        self.assertPrice(self.at(1), 50000, self.upcoming_promotion, 2)
+        # Khuyến mãi 30.000đ kết thúc, 50% vẫn thấp nhất
+        self.assertPrice(self.at(2), 50000, self.upcoming_promotion, 3)
+        # Khuyến mãi 50% kết thúc, còn lại giảm 10%
+        self.assertPrice(self.at(3), 90000, self.percent_promotion, 5)
+        # Hết khuyến mãi: về giá gốc
+        price = self.at(5)
+        self.assertPrice(price, 100000, None, None)
+        self.assertEqual(price.discount, 0)
+
+
+class InvoiceAllocationTests(TransactionTestCase):
+    """Nhiều request tạo đơn hàng đồng thời không nhận trùng mã đơn hàng"""
+
+    order_count = 50
+
+    def create_order(self, user_id):
+        try:
+            order = Order(user_id=user_id)
+            order.save()
+            return order.invoice
+        finally:
+            # Mỗi thread dùng kết nối DB riêng
+            connections.close_all()
+
+    def test_concurrent_orders_get_unique_invoices(self):
+        user = User.objects.create_user(
+            email="buyer@example.com", password="password", full_name="Buyer"
+        )
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            invoices = list(
+                executor.map(self.create_order, [user.id] * self.order_count)
+            )
+
+        self.assertEqual(len(set(invoices)), self.order_count)
+        self.assertEqual(Order.objects.count(), self.order_count)
+        # Mỗi đơn hàng lấy đúng một số từ sequence (không thử lại, không bỏ số)
+        prefix = f"VN-{now().strftime('%Y%m%d')}"
+        numbers = sorted(int(invoice[len(prefix) :]) for invoice in invoices)
+        self.assertEqual(
+            numbers, list(range(numbers[0], numbers[0] + self.order_count))
+        )
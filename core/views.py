@@ -17,12 +17,13 @@ from django.db.models import (
 )
 from django.db.models.functions import Coalesce
 from .models import *
+from .chats import get_chat_history, group_messages_by_date
 from django.views import View
 from django.views.generic import ListView, DetailView, TemplateView
 from django.contrib.auth.mixins import AccessMixin
 from django.utils.translation import gettext_lazy as _
 from django.db.models import Count
-from django.utils.timezone import localtime, now
+from django.utils.timezone import now
 
 
 class StaffRequiredMixin(AccessMixin):
@@ -78,24 +79,10 @@ class ChatDetailView(StaffRequiredMixin, SidebarStateAndPageActiveMixin, DetailV
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # Lấy danh sách tin nhắn và sắp xếp theo ngày
-        messages = (
-            self.object.messages.select_related("sender").all().order_by("created_at")
-        )
-
-        grouped_messages = {}
-        for message in messages:
-            # Convert thời gian tạo tin nhắn thành định dạng ngày (chỉ lấy phần ngày)
-            message_date = localtime(message.created_at).date()
-            if message_date not in grouped_messages:
-                grouped_messages[message_date] = []
-            grouped_messages[message_date].append(
-                {
-                    "content": message.content,
-                    "sender": {"id": message.sender.id, "name": message.sender.name},
-                    "time": message.created_at,
-                }
-            )
+        # Chỉ hiển thị cửa sổ tin nhắn gần nhất, tin cũ hơn được tải qua API theo cursor
+        messages, next_cursor = get_chat_history(self.object.id)
+        grouped_messages = group_messages_by_date(messages)
+        context["next_cursor"] = next_cursor
         context["messages_list"] = grouped_messages
 
         return context
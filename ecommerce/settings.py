@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.humanize',
+    'django.contrib.postgres',
     "corsheaders",
     'rest_framework',
     'rest_framework_simplejwt',
@@ -352,6 +353,8 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         # Giới hạn 1000 yêu cầu mỗi ngày cho tất cả các view mặc định không có throttle_scope riêng.
         'default': '1000/day',  
+        # Ghi nhận lượt xem sản phẩm (API không cần đăng nhập)
+        'product_view': '60/minute',
     },
 
     # Cấu hình exception handler (xử lý lỗi)